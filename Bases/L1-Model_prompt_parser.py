@@ -25,6 +25,8 @@
 
 
 import os
+import sys
+sys.path.append('..')
 import openai
 
 from dotenv import load_dotenv, find_dotenv
@@ -59,14 +61,19 @@ else:
 # In[3]:
 
 
+from llm_utils import completion
+
 def get_completion(prompt, model=llm_model):
-    messages = [{"role": "user", "content": prompt}]
-    response = openai.ChatCompletion.create(
-        model=model,
-        messages=messages,
-        temperature=0, 
-    )
-    return response.choices[0].message["content"]
+    return completion.get_completion(prompt, model=model, temperature=0)
+
+
+# In[ ]:
+
+
+# reuse temperature=0 answers across runs, for both the raw API calls
+# above and the LangChain ChatOpenAI models below
+from llm_utils.cache import enable_cache
+cache = enable_cache()
 
 
 # In[4]:
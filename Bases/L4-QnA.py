@@ -15,6 +15,8 @@
 
 
 import os
+import sys
+sys.path.append('..')
 
 from dotenv import load_dotenv, find_dotenv
 _ = load_dotenv(find_dotenv()) # read local .env file
@@ -46,9 +48,12 @@ else:
 from langchain.chains import RetrievalQA
 from langchain.chat_models import ChatOpenAI
 from langchain.document_loaders import CSVLoader
-from langchain.vectorstores import DocArrayInMemorySearch
+from llm_utils.vectorstore import NumpyVectorStore  # NumPy drop-in for DocArrayInMemorySearch
 from IPython.display import display, Markdown
 from langchain.llms import OpenAI
+from langchain.embeddings import OpenAIEmbeddings
+from llm_utils.embeddings import CachedEmbeddings
+from llm_utils.context import PackedRetriever, pack_context
 
 
 # In[4]:
@@ -74,7 +79,8 @@ from langchain.indexes import VectorstoreIndexCreator
 
 
 index = VectorstoreIndexCreator(
-    vectorstore_cls=DocArrayInMemorySearch
+    vectorstore_cls=NumpyVectorStore,
+    embedding=CachedEmbeddings(OpenAIEmbeddings()),
 ).from_loaders([loader])
 
 
@@ -138,8 +144,7 @@ docs[0]
 # In[15]:
 
 
-from langchain.embeddings import OpenAIEmbeddings
-embeddings = OpenAIEmbeddings()
+embeddings = CachedEmbeddings(OpenAIEmbeddings())
 
 
 # In[16]:
@@ -163,7 +168,7 @@ print(embed[:5])
 # In[19]:
 
 
-db = DocArrayInMemorySearch.from_documents(
+db = NumpyVectorStore.from_documents(
     docs, 
     embeddings
 )
@@ -208,7 +213,8 @@ llm = ChatOpenAI(temperature = 0.0, model=llm_model)
 # In[39]:
 
 
-qdocs = "".join([docs[i].page_content for i in range(len(docs))])
+# relevance-ordered, overlap-free and capped at a token budget
+qdocs = pack_context(docs, max_tokens=2000, model=llm_model)
 
 
 # In[40]:
@@ -230,7 +236,7 @@ display(Markdown(response))
 qa_stuff = RetrievalQA.from_chain_type(
     llm=llm, 
     chain_type="stuff", 
-    retriever=retriever, 
+    retriever=PackedRetriever(retriever=retriever, max_tokens=2000, model=llm_model), 
     verbose=True
 )
 
@@ -264,7 +270,7 @@ response = index.query(query, llm=llm)
 
 
 index = VectorstoreIndexCreator(
-    vectorstore_cls=DocArrayInMemorySearch,
+    vectorstore_cls=NumpyVectorStore,
     embedding=embeddings,
 ).from_loaders([loader])
 
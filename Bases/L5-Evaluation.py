@@ -14,6 +14,8 @@
 
 
 import os
+import sys
+sys.path.append('..')
 
 from dotenv import load_dotenv, find_dotenv
 _ = load_dotenv(find_dotenv()) # read local .env file
@@ -48,7 +50,9 @@ from langchain.chains import RetrievalQA
 from langchain.chat_models import ChatOpenAI
 from langchain.document_loaders import CSVLoader
 from langchain.indexes import VectorstoreIndexCreator
-from langchain.vectorstores import DocArrayInMemorySearch
+from llm_utils.vectorstore import NumpyVectorStore  # NumPy drop-in for DocArrayInMemorySearch
+from langchain.embeddings import OpenAIEmbeddings
+from llm_utils.embeddings import CachedEmbeddings
 
 
 # In[31]:
@@ -63,7 +67,8 @@ data = loader.load()
 
 
 index = VectorstoreIndexCreator(
-    vectorstore_cls=DocArrayInMemorySearch
+    vectorstore_cls=NumpyVectorStore,
+    embedding=CachedEmbeddings(OpenAIEmbeddings()),
 ).from_loaders([loader])
 
 
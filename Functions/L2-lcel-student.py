@@ -11,6 +11,8 @@
 
 
 import os
+import sys
+sys.path.append('..')
 import openai
 
 from dotenv import load_dotenv, find_dotenv
@@ -64,15 +66,16 @@ chain.invoke({"topic": "aspirapolvere"})
 
 
 from langchain.embeddings import OpenAIEmbeddings
-from langchain.vectorstores import DocArrayInMemorySearch
+from llm_utils.vectorstore import NumpyVectorStore  # NumPy drop-in for DocArrayInMemorySearch
+from llm_utils.embeddings import CachedEmbeddings
 
 
 # In[15]:
 
 
-vectorstore = DocArrayInMemorySearch.from_texts(
+vectorstore = NumpyVectorStore.from_texts(
     ["harrison worked at kensho", "bears like to eat honey"],
-    embedding=OpenAIEmbeddings()
+    embedding=CachedEmbeddings(OpenAIEmbeddings())
 )
 retriever = vectorstore.as_retriever()
 
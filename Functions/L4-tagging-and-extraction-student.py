@@ -7,6 +7,8 @@
 
 
 import os
+import sys
+sys.path.append('..')
 import openai
 
 from dotenv import load_dotenv, find_dotenv
@@ -47,6 +49,9 @@ from langchain.chat_models import ChatOpenAI
 # In[6]:
 
 
+from llm_utils.cache import enable_cache
+cache = enable_cache()  # temperature=0 responses are served from disk on re-runs
+
 model = ChatOpenAI(temperature=0)
 
 
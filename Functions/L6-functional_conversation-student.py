@@ -613,6 +613,29 @@ dashboard
 
 
 
+# `cbfs` keeps one agent and one memory for the whole process. `ChatServer` hosts many sessions in one asyncio process instead: every session gets its own `AgentExecutor` and memory, while the model client and tools are shared. The blocking agent runs in worker threads, and the number of answers in flight is bounded.
+
+# In[ ]:
+
+
+import sys
+sys.path.append('..')
+from llm_utils.chat_server import ChatServer, ChainResponder
+
+shared_model = ChatOpenAI(temperature=0).bind(functions=[format_tool_to_openai_function(f) for f in tools])
+
+def make_agent():
+    # one memory per session; model client and tools are shared
+    memory = ConversationBufferMemory(return_messages=True, memory_key="chat_history")
+    agent = RunnablePassthrough.assign(
+        agent_scratchpad=lambda x: format_to_openai_functions(x["intermediate_steps"])
+    ) | prompt | shared_model | OpenAIFunctionsAgentOutputParser()
+    return AgentExecutor(agent=agent, tools=tools, verbose=False, memory=memory)
+
+agent_server = ChatServer(ChainResponder(make_agent), idle_timeout=900, max_concurrent=32)
+# agent_server.run(port=8081)
+
+
 # In[ ]:
 
 
@@ -19,12 +19,17 @@ import operator
 from langchain_core.messages import AnyMessage, SystemMessage, HumanMessage, ToolMessage
 from langchain_openai import ChatOpenAI
 from langchain_community.tools.tavily_search import TavilySearchResults
+import sys
+sys.path.append('..')
+from llm_utils.tool_calls import ToolCallExecutor
+from llm_utils.search_cache import CachedTavilySearchAPIWrapper
 
 
 # In[3]:
 
 
-tool = TavilySearchResults(max_results=4) #increased number of results
+# repeated queries are answered from a cache shared by every agent and thread
+tool = TavilySearchResults(max_results=4, api_wrapper=CachedTavilySearchAPIWrapper()) #increased number of results
 print(type(tool))
 print(tool.name)
 
@@ -39,6 +44,8 @@ class AgentState(TypedDict):
 
 
 # > Note: in `take_action` below, some logic was added to cover the case that the LLM returned a non-existent tool name. Even with function calling, LLMs can still occasionally hallucinate. Note that all that is done is instructing the LLM to try again! An advantage of an agentic organization.
+# 
+# > `take_action` also runs a turn's tool calls together through `ToolCallExecutor`, instead of one after another. When the model asks for several searches at once, the turn takes about as long as the slowest one. Each tool has a concurrency limit and a timeout, and the results come back as `ToolMessage`s in the order of the calls.
 
 # In[ ]:
 
@@ -59,6 +66,8 @@ class Agent:
         graph.set_entry_point("llm")
         self.graph = graph.compile()
         self.tools = {t.name: t for t in tools}
+        # runs a turn's tool calls concurrently, at most 4 at a time per tool
+        self.executor = ToolCallExecutor(self.tools, default_limit=4, default_timeout=30)
         self.model = model.bind_tools(tools)
 
     def exists_action(self, state: AgentState):
@@ -74,15 +83,12 @@ class Agent:
 
     def take_action(self, state: AgentState):
         tool_calls = state['messages'][-1].tool_calls
-        results = []
         for t in tool_calls:
             print(f"Calling: {t}")
             if not t['name'] in self.tools:      # check for bad tool name from LLM
                 print("\n ....bad tool name....")
-                result = "bad tool name, retry"  # instruct LLM to retry if bad
-            else:
-                result = self.tools[t['name']].invoke(t['args'])
-            results.append(ToolMessage(tool_call_id=t['id'], name=t['name'], content=str(result)))
+        # all calls run together; a bad name comes back as "bad tool name, retry"
+        results = self.executor.run(tool_calls)
         print("Back to the model!")
         return {'messages': results}
 
@@ -132,6 +138,7 @@ result['messages'][-1].content
 
 messages = [HumanMessage(content="What is the weather in SF and LA?")]
 result = abot.graph.invoke({"messages": messages})
+abot.executor.last_duration  # seconds for both searches together, about the slower one
 
 
 # In[ ]:
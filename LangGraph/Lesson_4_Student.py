@@ -20,12 +20,16 @@ import operator
 from langchain_core.messages import AnyMessage, SystemMessage, HumanMessage, ToolMessage
 from langchain_openai import ChatOpenAI
 from langchain_community.tools.tavily_search import TavilySearchResults
+import sys
+sys.path.append('..')
+from llm_utils.tool_calls import ToolCallExecutor
+from llm_utils.search_cache import CachedTavilySearchAPIWrapper
 
 
 # In[3]:
 
 
-tool = TavilySearchResults(max_results=2)
+tool = TavilySearchResults(max_results=2, api_wrapper=CachedTavilySearchAPIWrapper())  # cached, shared by all threads
 
 
 # In[4]:
@@ -39,8 +43,10 @@ class AgentState(TypedDict):
 
 
 from langgraph.checkpoint.sqlite import SqliteSaver
+from llm_utils.checkpoint import DeltaSqliteSaver
 
-memory = SqliteSaver.from_conn_string(":memory:")
+# stores per-step deltas (zstd-compressed) instead of the full state at every step
+memory = DeltaSqliteSaver.from_conn_string(":memory:")
 
 
 # In[6]:
@@ -57,6 +63,8 @@ class Agent:
         graph.set_entry_point("llm")
         self.graph = graph.compile(checkpointer=checkpointer)
         self.tools = {t.name: t for t in tools}
+        # runs a turn's tool calls concurrently, at most 4 at a time per tool
+        self.executor = ToolCallExecutor(self.tools, default_limit=4, default_timeout=30)
         self.model = model.bind_tools(tools)
 
     def call_openai(self, state: AgentState):
@@ -72,11 +80,10 @@ class Agent:
 
     def take_action(self, state: AgentState):
         tool_calls = state['messages'][-1].tool_calls
-        results = []
         for t in tool_calls:
             print(f"Calling: {t}")
-            result = self.tools[t['name']].invoke(t['args'])
-            results.append(ToolMessage(tool_call_id=t['id'], name=t['name'], content=str(result)))
+        # all calls run together; ToolMessages come back in call order
+        results = self.executor.run(tool_calls)
         print("Back to the model!")
         return {'messages': results}
 
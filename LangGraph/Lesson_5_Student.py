@@ -25,9 +25,15 @@ import operator
 from langchain_core.messages import AnyMessage, SystemMessage, HumanMessage, ToolMessage
 from langchain_openai import ChatOpenAI
 from langchain_community.tools.tavily_search import TavilySearchResults
+import sys
+sys.path.append('..')
+from llm_utils.tool_calls import ToolCallExecutor
+from llm_utils.search_cache import CachedTavilySearchAPIWrapper
 from langgraph.checkpoint.sqlite import SqliteSaver
+from llm_utils.checkpoint import DeltaSqliteSaver
 
-memory = SqliteSaver.from_conn_string(":memory:")
+# stores per-step deltas (zstd-compressed) instead of the full state at every step
+memory = DeltaSqliteSaver.from_conn_string(":memory:")
 
 
 # In[3]:
@@ -44,24 +50,22 @@ appends new messages to the end of the existing messages array.
 Now, to support replacing existing messages, we annotate the
 `messages` key with a customer reducer function, which replaces
 messages with the same `id`, and appends them otherwise.
+
+Looking each id up by scanning the whole history made every update
+slower as the thread grew; `MessageLog` keeps an id -> position
+index next to the list, so each new message is O(1).
 """
+from llm_utils.messages import MessageLog
+
 def reduce_messages(left: list[AnyMessage], right: list[AnyMessage]) -> list[AnyMessage]:
     # assign ids to messages that don't have them
     for message in right:
         if not message.id:
             message.id = str(uuid4())
-    # merge the new messages with the existing messages
-    merged = left.copy()
-    for message in right:
-        for i, existing in enumerate(merged):
-            # replace any existing messages with the same id
-            if existing.id == message.id:
-                merged[i] = message
-                break
-        else:
-            # append any new messages to the end
-            merged.append(message)
-    return merged
+    # merge the new messages with the existing messages:
+    # replace any existing messages with the same id,
+    # append any new messages to the end
+    return MessageLog.of(left).merged(right)
 
 class AgentState(TypedDict):
     messages: Annotated[list[AnyMessage], reduce_messages]
@@ -70,7 +74,7 @@ class AgentState(TypedDict):
 # In[4]:
 
 
-tool = TavilySearchResults(max_results=2)
+tool = TavilySearchResults(max_results=2, api_wrapper=CachedTavilySearchAPIWrapper())  # cached, shared by all threads
 
 
 # ## Manual human approval
@@ -92,6 +96,8 @@ class Agent:
             interrupt_before=["action"]
         )
         self.tools = {t.name: t for t in tools}
+        # runs a turn's tool calls concurrently, at most 4 at a time per tool
+        self.executor = ToolCallExecutor(self.tools, default_limit=4, default_timeout=30)
         self.model = model.bind_tools(tools)
 
     def call_openai(self, state: AgentState):
@@ -108,11 +114,10 @@ class Agent:
 
     def take_action(self, state: AgentState):
         tool_calls = state['messages'][-1].tool_calls
-        results = []
         for t in tool_calls:
             print(f"Calling: {t}")
-            result = self.tools[t['name']].invoke(t['args'])
-            results.append(ToolMessage(tool_call_id=t['id'], name=t['name'], content=str(result)))
+        # all calls run together; ToolMessages come back in call order
+        results = self.executor.run(tool_calls)
         print("Back to the model!")
         return {'messages': results}
 
@@ -261,23 +266,23 @@ for event in abot.graph.stream(None, thread):
 
 
 # ## Time Travel
+# 
+# `get_state_history` loads and decodes every state of the thread. `memory.history` pages through the checkpoints using only their step, writing node and next nodes, and `memory.find` jumps to a step or node through an index.
 
 # In[23]:
 
 
-states = []
-for state in abot.graph.get_state_history(thread):
-    print(state)
-    print('--')
-    states.append(state)
+entries, cursor = memory.history(thread, limit=20)  # newest first; pass `cursor` for the next page
+for entry in entries:
+    print(entry.step, entry.node, entry.next, entry.config['configurable']['thread_ts'])
 
 
-# To fetch the same state as was filmed, the offset below is changed to `-3` from `-1`. This accounts for the initial state `__start__` and the first state that are now stored to state memory with the latest version of software.
+# The filmed version replayed the first state (`states[-1]`). The latest version of software also stores the initial `__start__` state and the first state, so the same state is now the first checkpoint at step 1 (`states[-3]` in the full list).
 
 # In[24]:
 
 
-to_replay = states[-3]
+to_replay = abot.graph.get_state(memory.find(thread, step=1, oldest=True))
 
 
 # In[25]:
@@ -387,6 +392,9 @@ from langgraph.graph import StateGraph, END
 from typing import TypedDict, Annotated
 import operator
 from langgraph.checkpoint.sqlite import SqliteSaver
+import sys
+sys.path.append('..')
+from llm_utils.checkpoint import DeltaSqliteSaver
 
 
 # Define a simple 2 node graph with the following state:
@@ -444,7 +452,7 @@ builder.set_entry_point("Node1")
 # In[41]:
 
 
-memory = SqliteSaver.from_conn_string(":memory:")
+memory = DeltaSqliteSaver.from_conn_string(":memory:")
 graph = builder.compile(checkpointer=memory)
 
 
@@ -479,23 +487,23 @@ for state in graph.get_state_history(thread):
     print(state, "\n")
 
 
-# Store just the `config` into an list. Note the sequence of counts on the right. `get_state_history` returns the most recent snapshots first.
+# The same history, metadata only: each entry has the `config`, the `step`, the node that wrote it and the nodes that ran `next` from it, without loading any state. Like `get_state_history`, it returns the most recent snapshots first, one page at a time.
 
 # In[45]:
 
 
-states = []
-for state in graph.get_state_history(thread):
-    states.append(state.config)
-    print(state.config, state.values['count'])
+entries, cursor = memory.history(thread, limit=50)
+for entry in entries:
+    print(entry.config, entry.step, entry.node, entry.next)
 
 
-# Grab an early state.
+# Grab an early state: the first one at step 1, looked up through an index (this is `states[-3]` of the full list).
 
 # In[46]:
 
 
-states[-3]
+early = memory.find(thread, step=1, oldest=True)
+early
 
 
 # This is the state after Node1 completed for the first time. Note `next` is `Node2`and `count` is 1.
@@ -503,16 +511,16 @@ states[-3]
 # In[47]:
 
 
-graph.get_state(states[-3])
+graph.get_state(early)
 
 
 # ### Go Back in Time
-# Use that state in `invoke` to go back in time. Notice it uses states[-3] as *current_state* and continues to node2,
+# Use that state in `invoke` to go back in time. Notice it uses `early` as *current_state* and continues to node2,
 
 # In[48]:
 
 
-graph.invoke(None, states[-3])
+graph.invoke(None, early)
 
 
 # Notice the new states are now in state history. Notice the counts on the far right.
@@ -525,7 +533,7 @@ for state in graph.get_state_history(thread):
     print(state.config, state.values['count'])
 
 
-# You can see the details below. Lots of text, but try to find the node that start the new branch. Notice the parent *config* is not the previous entry in the stack, but is the entry from state[-3].
+# You can see the details below. Lots of text, but try to find the node that start the new branch. Notice the parent *config* is not the previous entry in the stack, but is the entry from `early`.
 
 # In[50]:
 
@@ -556,10 +564,9 @@ Image(graph.get_graph().draw_png())
 # In[53]:
 
 
-states2 = []
-for state in graph.get_state_history(thread2):
-    states2.append(state.config)
-    print(state.config, state.values['count'])   
+entries, cursor = memory.history(thread2, limit=50)
+for entry in entries:
+    print(entry.config, entry.step, entry.node, entry.next)
 
 
 # Start by grabbing a state.
@@ -567,7 +574,7 @@ for state in graph.get_state_history(thread2):
 # In[54]:
 
 
-save_state = graph.get_state(states2[-3])
+save_state = graph.get_state(memory.find(thread2, step=1, oldest=True))
 save_state
 
 
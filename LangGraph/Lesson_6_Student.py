@@ -19,8 +19,12 @@ from typing import TypedDict, Annotated, List
 import operator
 from langgraph.checkpoint.sqlite import SqliteSaver
 from langchain_core.messages import AnyMessage, SystemMessage, HumanMessage, AIMessage, ChatMessage
+import sys
+sys.path.append('..')
+from llm_utils.checkpoint import DeltaSqliteSaver
 
-memory = SqliteSaver.from_conn_string(":memory:")
+# stores per-step deltas (zstd-compressed) instead of the full state at every step
+memory = DeltaSqliteSaver.from_conn_string(":memory:")
 
 
 # In[33]:
@@ -102,7 +106,9 @@ class Queries(BaseModel):
 
 from tavily import TavilyClient
 import os
-tavily = TavilyClient(api_key=os.environ["TAVILY_API_KEY"])
+from llm_utils.search_cache import CachedSearchClient
+# revisions repeat many queries: serve them from a shared cache (1h TTL, refreshed in the background)
+tavily = CachedSearchClient(TavilyClient(api_key=os.environ["TAVILY_API_KEY"]))
 
 
 # In[42]:
@@ -261,6 +267,12 @@ for s in graph.stream({
 # In[ ]:
 
 
+tavily.cache.stats()  # queries the revisions repeated were not sent again
+
+
+# In[ ]:
+
+
 
 
 
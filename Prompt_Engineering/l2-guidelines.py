@@ -14,6 +14,8 @@
 
 import openai
 import os
+import sys
+sys.path.append('..')
 
 from dotenv import load_dotenv, find_dotenv
 _ = load_dotenv(find_dotenv())
@@ -30,14 +32,7 @@ openai.api_key  = os.getenv('OPENAI_API_KEY')
 # In[2]:
 
 
-def get_completion(prompt, model="gpt-3.5-turbo"):
-    messages = [{"role": "user", "content": prompt}]
-    response = openai.ChatCompletion.create(
-        model=model,
-        messages=messages,
-        temperature=0, # this is the degree of randomness of the model's output
-    )
-    return response.choices[0].message["content"]
+from llm_utils.completion import get_completion
 
 
 # **Note:** This and all other lab notebooks of this course use OpenAI library version `0.27.0`. 
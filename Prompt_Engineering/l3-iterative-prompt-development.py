@@ -11,6 +11,8 @@
 
 import openai
 import os
+import sys
+sys.path.append('..')
 
 from dotenv import load_dotenv, find_dotenv
 _ = load_dotenv(find_dotenv()) # read local .env file
@@ -21,14 +23,12 @@ openai.api_key  = os.getenv('OPENAI_API_KEY')
 # In[2]:
 
 
-def get_completion(prompt, model="gpt-3.5-turbo"):
-    messages = [{"role": "user", "content": prompt}]
-    response = openai.ChatCompletion.create(
-        model=model,
-        messages=messages,
-        temperature=0, # this is the degree of randomness of the model's output
-    )
-    return response.choices[0].message["content"]
+from llm_utils.completion import get_completion
+from llm_utils.cache import enable_cache
+
+# temperature=0 answers are kept on disk, so re-running the notebook
+# only pays for the prompt variants that changed
+cache = enable_cache()
 
 
 # **Note**: In June 2023, OpenAI updated gpt-3.5-turbo. The results you see in the notebook may be slightly different than those in the video. Some of the prompts have also been slightly modified to product the desired results.
@@ -234,6 +234,12 @@ from IPython.display import display, HTML
 display(HTML(response))
 
 
+# In[12]:
+
+
+cache.stats()
+
+
 # ## Try experimenting on your own!
 
 # In[ ]:
@@ -11,6 +11,8 @@
 
 import openai
 import os
+import sys
+sys.path.append('..')
 
 from dotenv import load_dotenv, find_dotenv
 _ = load_dotenv(find_dotenv()) # read local .env file
@@ -21,14 +23,7 @@ openai.api_key  = os.getenv('OPENAI_API_KEY')
 # In[2]:
 
 
-def get_completion(prompt, model="gpt-3.5-turbo"): # Andrew mentioned that the prompt/ completion paradigm is preferable for this class
-    messages = [{"role": "user", "content": prompt}]
-    response = openai.ChatCompletion.create(
-        model=model,
-        messages=messages,
-        temperature=0, # this is the degree of randomness of the model's output
-    )
-    return response.choices[0].message["content"]
+from llm_utils.completion import get_completion, get_completions
 
 
 # ## Text to summarize
@@ -216,6 +211,7 @@ reviews = [review_1, review_2, review_3, review_4]
 # In[9]:
 
 
+prompts = []
 for i in range(len(reviews)):
     prompt = f"""
     Your task is to generate a short summary of a product \ 
@@ -226,8 +222,11 @@ for i in range(len(reviews)):
 
     Review: ```{reviews[i]}```
     """
+    prompts.append(prompt)
 
-    response = get_completion(prompt)
+# all the reviews are summarized concurrently, answers keep the input order
+responses = get_completions(prompts)
+for i, response in enumerate(responses):
     print(i, response, "\n")
 
 
@@ -12,6 +12,8 @@
 
 import openai
 import os
+import sys
+sys.path.append('..')
 
 from dotenv import load_dotenv, find_dotenv
 _ = load_dotenv(find_dotenv()) # read local .env file
@@ -22,14 +24,7 @@ openai.api_key  = os.getenv('OPENAI_API_KEY')
 # In[2]:
 
 
-def get_completion(prompt, model="gpt-3.5-turbo", temperature=0): 
-    messages = [{"role": "user", "content": prompt}]
-    response = openai.ChatCompletion.create(
-        model=model,
-        messages=messages,
-        temperature=temperature, 
-    )
-    return response.choices[0].message["content"]
+from llm_utils.completion import get_completion, get_completions
 
 
 # ## Translation
@@ -100,16 +95,20 @@ user_messages = [
 # In[8]:
 
 
+# the two prompts for a message don't depend on each other,
+# so every prompt of every message goes out in one concurrent batch
+prompts = []
 for issue in user_messages:
-    prompt = f"Tell me what language this is: ```{issue}```"
-    lang = get_completion(prompt)
-    print(f"Original message ({lang}): {issue}")
-
-    prompt = f"""
+    prompts.append(f"Tell me what language this is: ```{issue}```")
+    prompts.append(f"""
     Translate the following  text to English \
     and Korean: ```{issue}```
-    """
-    response = get_completion(prompt)
+    """)
+responses = get_completions(prompts)
+
+for i, issue in enumerate(user_messages):
+    lang, response = responses[2 * i], responses[2 * i + 1]
+    print(f"Original message ({lang}): {issue}")
     print(response, "\n")
 
 
@@ -182,13 +181,12 @@ text = [
   "That medicine effects my ability to sleep. Have you heard of the butterfly affect?", # Homonyms
   "This phrase is to cherck chatGPT for speling abilitty"  # spelling
 ]
-for t in text:
-    prompt = f"""Proofread and correct the following text
+prompts = [f"""Proofread and correct the following text
     and rewrite the corrected version. If you don't find
     and errors, just say "No errors found". Don't use 
     any punctuation around the text:
-    ```{t}```"""
-    response = get_completion(prompt)
+    ```{t}```""" for t in text]
+for response in get_completions(prompts):
     print(response)
 
 
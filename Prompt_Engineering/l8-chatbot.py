@@ -11,6 +11,8 @@
 
 
 import os
+import sys
+sys.path.append('..')
 import openai
 from dotenv import load_dotenv, find_dotenv
 _ = load_dotenv(find_dotenv()) # read local .env file
@@ -21,23 +23,8 @@ openai.api_key  = os.getenv('OPENAI_API_KEY')
 # In[2]:
 
 
-def get_completion(prompt, model="gpt-3.5-turbo"):
-    messages = [{"role": "user", "content": prompt}]
-    response = openai.ChatCompletion.create(
-        model=model,
-        messages=messages,
-        temperature=0, # this is the degree of randomness of the model's output
-    )
-    return response.choices[0].message["content"]
-
-def get_completion_from_messages(messages, model="gpt-3.5-turbo", temperature=0):
-    response = openai.ChatCompletion.create(
-        model=model,
-        messages=messages,
-        temperature=temperature, # this is the degree of randomness of the model's output
-    )
-#     print(str(response.choices[0].message))
-    return response.choices[0].message["content"]
+from llm_utils.completion import get_completion, get_completion_from_messages, stream_completion_from_messages
+from llm_utils.streaming import StreamRunner, markdown_updater
 
 
 # In[3]:
@@ -92,21 +79,32 @@ print(response)
 
 # # OrderBot
 # We can automate the collection of user prompts and assistant responses to build a  OrderBot. The OrderBot will take orders at a pizza restaurant. 
+# 
+# The reply is streamed into the chat as it is generated, instead of appearing all at once when it is complete. Sending a new message stops a reply that is still being written; the part already shown stays in the context.
 
 # In[8]:
 
 
+runner = StreamRunner()
+
 def collect_messages(_):
+    runner.cancel()  # keeps a partial reply in `context` before the new message
     prompt = inp.value_input
     inp.value = ''
     context.append({'role':'user', 'content':f"{prompt}"})
-    response = get_completion_from_messages(context) 
-    context.append({'role':'assistant', 'content':f"{response}"})
+    response = pn.pane.Markdown("", width=600, style={'background-color': '#F6F6F6'})
     panels.append(
         pn.Row('User:', pn.pane.Markdown(prompt, width=600)))
     panels.append(
-        pn.Row('Assistant:', pn.pane.Markdown(response, width=600, style={'background-color': '#F6F6F6'})))
- 
+        pn.Row('Assistant:', response))
+
+    def save(text):
+        if text:
+            context.append({'role':'assistant', 'content':f"{text}"})
+
+    messages = list(context)
+    runner.start(lambda stream: stream.consume(stream_completion_from_messages(messages)),
+                 on_update=markdown_updater(response), on_done=save, on_cancel=save)
     return pn.Column(*panels)
 
 
@@ -163,6 +161,12 @@ dashboard = pn.Column(
 dashboard
 
 
+# In[12]:
+
+
+runner.summary()  # time to first token of the replies so far
+
+
 # In[13]:
 
 
@@ -27,6 +27,7 @@ import os
 import openai
 import sys
 sys.path.append('../..')
+sys.path.append('..')
 
 from dotenv import load_dotenv, find_dotenv
 _ = load_dotenv(find_dotenv()) # read local .env file
@@ -82,6 +83,18 @@ print(page.page_content[0:500])
 page.metadata
 
 
+# For a whole folder of PDFs, `load_pdfs` parses the files in parallel on a process pool and returns the pages in the order of the paths.
+
+# In[ ]:
+
+
+import glob
+from llm_utils.ingest import load_pdfs
+
+pages = load_pdfs(sorted(glob.glob("docs/cs229_lectures/*.pdf")))
+len(pages)
+
+
 # ## YouTube
 
 # In[9]:
@@ -14,6 +14,7 @@ import os
 import openai
 import sys
 sys.path.append('../..')
+sys.path.append('..')
 
 from dotenv import load_dotenv, find_dotenv
 _ = load_dotenv(find_dotenv()) # read local .env file
@@ -26,19 +27,17 @@ openai.api_key  = os.environ['OPENAI_API_KEY']
 # In[2]:
 
 
-from langchain.document_loaders import PyPDFLoader
+from llm_utils.ingest import load_pdfs
 
-# Load PDF
-loaders = [
+# Load PDF (parsed in parallel, each distinct file only once)
+paths = [
     # Duplicate documents on purpose - messy data
-    PyPDFLoader("docs/cs229_lectures/MachineLearning-Lecture01.pdf"),
-    PyPDFLoader("docs/cs229_lectures/MachineLearning-Lecture01.pdf"),
-    PyPDFLoader("docs/cs229_lectures/MachineLearning-Lecture02.pdf"),
-    PyPDFLoader("docs/cs229_lectures/MachineLearning-Lecture03.pdf")
+    "docs/cs229_lectures/MachineLearning-Lecture01.pdf",
+    "docs/cs229_lectures/MachineLearning-Lecture01.pdf",
+    "docs/cs229_lectures/MachineLearning-Lecture02.pdf",
+    "docs/cs229_lectures/MachineLearning-Lecture03.pdf"
 ]
-docs = []
-for loader in loaders:
-    docs.extend(loader.load())
+docs = load_pdfs(paths)
 
 
 # In[3]:
@@ -64,6 +63,24 @@ splits = text_splitter.split_documents(docs)
 len(splits)
 
 
+# The duplicated lecture produces identical chunks, and transcripts often contain near-identical passages. Embedding them costs money, bloats the index and crowds out other results, so we drop exact duplicates (by hash) and near duplicates (MinHash/LSH) before embedding. `dedup.sources(i)` still lists the metadata of every chunk merged into the kept chunk `i`.
+
+# In[ ]:
+
+
+from llm_utils.dedup import dedup_documents
+
+dedup = dedup_documents(splits)
+dedup
+
+
+# In[ ]:
+
+
+splits = dedup.documents
+len(splits)
+
+
 # ## Embeddings
 # 
 # Let's take our splits and embed them.
@@ -72,7 +89,12 @@ len(splits)
 
 
 from langchain.embeddings.openai import OpenAIEmbeddings
-embedding = OpenAIEmbeddings()
+from llm_utils.embeddings import BatchedEmbeddings, CachedEmbeddings
+
+# vectors are cached on disk by (model, text hash) and shared by every
+# vector store in these notebooks, so unchanged chunks are never re-embedded;
+# the ones that are missing go out in concurrent, provider-sized batches
+embedding = CachedEmbeddings(BatchedEmbeddings(OpenAIEmbeddings()))
 
 
 # In[42]:
@@ -87,10 +109,10 @@ sentence4 = "i like canines"
 # In[49]:
 
 
-embedding1 = embedding.embed_query(sentence1)
-embedding2 = embedding.embed_query(sentence2)
-embedding3 = embedding.embed_query(sentence3)
-embedding4 = embedding.embed_query(sentence4)
+# one request for all four sentences instead of four round-trips
+embedding1, embedding2, embedding3, embedding4 = embedding.embed_documents(
+    [sentence1, sentence2, sentence3, sentence4]
+)
 
 
 # In[50]:
@@ -219,11 +241,9 @@ question = "what did they say about matlab?"
 docs = vectordb.similarity_search(question,k=5)
 
 
-# Notice that we're getting duplicate chunks (because of the duplicate `MachineLearning-Lecture01.pdf` in the index).
+# Without the deduplication step we would get duplicate chunks here (because of the duplicate `MachineLearning-Lecture01.pdf` in the index), and `docs[0]` and `docs[1]` would be indentical.
 # 
-# Semantic search fetches all similar documents, but does not enforce diversity.
-# 
-# `docs[0]` and `docs[1]` are indentical.
+# Semantic search fetches all similar documents, but does not enforce diversity, so near-identical chunks that slip through still crowd the results.
 
 # In[68]:
 
@@ -268,6 +288,59 @@ print(docs[4].page_content)
 
 # Approaches discussed in the next lecture can be used to address both!
 
+# ## Approximate nearest neighbour search
+# 
+# Exact search compares the question with every chunk, so its latency grows linearly with the corpus. For tens of millions of chunks, `AnnVectorStore` answers `similarity_search` / `max_marginal_relevance_search` from an ANN index instead: `mode="hnsw"` for low latency (tuned with `ef_search`) or `mode="ivfpq"` for a compressed, memory-friendly index (tuned with `nprobe`). `recall_report` measures what the speed-up costs in recall against exact search.
+
+# In[ ]:
+
+
+from llm_utils.ann import AnnVectorStore, recall_report
+
+ann_db = AnnVectorStore.from_documents(splits, embedding, mode="hnsw", ef_search=64)
+ann_db.save('docs/chroma_ann/')  # reopen later with AnnVectorStore.load('docs/chroma_ann/', embedding)
+
+ann_db.similarity_search("is there an email i can ask for help", k=3)
+
+
+# In[ ]:
+
+
+questions = [
+    "is there an email i can ask for help",
+    "what did they say about matlab?",
+    "what did they say about regression in the third lecture?",
+]
+recall_report(ann_db, embedding.embed_documents(questions), k=3)
+
+
+# In[ ]:
+
+
+
+
+
+# ## Incremental ingestion
+# 
+# Rebuilding the whole database re-parses and re-embeds every PDF. `IngestionPipeline` keeps a manifest of each file's content hash and mtime next to the database, so running the cell again only parses, splits and embeds the files that were added or edited (and drops the chunks of deleted files).
+
+# In[ ]:
+
+
+import glob
+from llm_utils.ingest import IngestionPipeline
+
+pipeline = IngestionPipeline(
+    manifest_path='docs/chroma_incremental/manifest.json',
+    splitter=text_splitter
+)
+incremental_db = Chroma(
+    persist_directory='docs/chroma_incremental/',
+    embedding_function=embedding
+)
+result = pipeline.run(sorted(glob.glob("docs/cs229_lectures/*.pdf")), incremental_db)
+result
+
 # In[ ]:
 
 
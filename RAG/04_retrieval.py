@@ -17,6 +17,7 @@ import os
 import openai
 import sys
 sys.path.append('../..')
+sys.path.append('..')
 
 from dotenv import load_dotenv, find_dotenv
 _ = load_dotenv(find_dotenv()) # read local .env file
@@ -37,13 +38,14 @@ openai.api_key  = os.environ['OPENAI_API_KEY']
 
 from langchain.vectorstores import Chroma
 from langchain.embeddings.openai import OpenAIEmbeddings
+from llm_utils.embeddings import CachedEmbeddings
 persist_directory = 'docs/chroma/'
 
 
 # In[7]:
 
 
-embedding = OpenAIEmbeddings()
+embedding = CachedEmbeddings(OpenAIEmbeddings())
 vectordb = Chroma(
     persist_directory=persist_directory,
     embedding_function=embedding
@@ -120,7 +122,10 @@ docs_ss[1].page_content[:100]
 # In[17]:
 
 
-docs_mmr = vectordb.max_marginal_relevance_search(question,k=3)
+# vectorized MMR: the candidate similarity matrix is computed once,
+# so a large fetch_k stays cheap
+from llm_utils.mmr import MMRRetriever, mmr_search
+docs_mmr = mmr_search(vectordb, question, k=3, fetch_k=200)
 
 
 # In[18]:
@@ -245,6 +250,52 @@ for d in docs:
     print(d.metadata)
 
 
+# In a large store a filter like the one above should not cost a scan of every chunk. `NumpyVectorStore` keeps a metadata index (inverted lists for fields like `source`, sorted arrays for integers like `page`) and turns the filter into the matching rows *before* any vector is scored. Narrow filters only score the matching chunks; broad ones score everything and mask the rest. Its filters use Chroma's syntax, so the self-query retriever can drive it through `ChromaTranslator`.
+
+# In[ ]:
+
+
+from langchain.retrievers.self_query.chroma import ChromaTranslator
+from llm_utils.vectorstore import NumpyVectorStore
+
+indexed_db = NumpyVectorStore.from_chroma(vectordb)
+indexed_retriever = SelfQueryRetriever.from_llm(
+    llm,
+    indexed_db,
+    document_content_description,
+    metadata_field_info,
+    structured_query_translator=ChromaTranslator(),
+    verbose=True
+)
+for d in indexed_retriever.get_relevant_documents(question):
+    print(d.metadata)
+
+
+# Every self-query question costs an LLM call just to build the filter, before any search happens. `CachedSelfQueryRetriever` first checks an LRU cache of structured queries (keyed by the normalized question), then a few regex rules for common phrasings like "in the third lecture" or "page 5", and only calls the LLM for the rest, caching its answer.
+
+# In[ ]:
+
+
+from llm_utils.query_cache import (
+    CachedSelfQueryRetriever, QueryConstructionCache, RuleBasedQueryParser, lecture_rules)
+
+query_cache = QueryConstructionCache(maxsize=10_000)
+cached_retriever = CachedSelfQueryRetriever.from_llm(
+    llm,
+    indexed_db,
+    document_content_description,
+    metadata_field_info,
+    structured_query_translator=ChromaTranslator(),
+    query_cache=query_cache,
+    rule_parser=RuleBasedQueryParser(
+        lecture_rules("docs/cs229_lectures/MachineLearning-Lecture{n:02d}.pdf")),
+    verbose=True
+)
+for q in [question, "What did they say about regression in the third lecture", "what did they say about matlab?"]:
+    cached_retriever.get_relevant_documents(q)
+print(f"query cache: {query_cache.hits} hits, {query_cache.misses} misses")
+
+
 # ### Additional tricks: compression
 # 
 # Another approach for improving the quality of retrieved docs is compression.
@@ -282,7 +333,7 @@ compressor = LLMChainExtractor.from_llm(llm)
 
 compression_retriever = ContextualCompressionRetriever(
     base_compressor=compressor,
-    base_retriever=vectordb.as_retriever(search_type = "mmr")
+    base_retriever=MMRRetriever(vectorstore=vectordb, fetch_k=200)
 )
 
 
@@ -294,6 +345,32 @@ compressed_docs = compression_retriever.get_relevant_documents(question)
 pretty_print_docs(compressed_docs)
 
 
+# `LLMChainExtractor` makes one LLM call per retrieved document, one after the other. `EmbeddingCompressor` splits the documents into sentences, scores them all against the question with the (cached) embeddings and keeps the best ones within a token budget: no LLM call at all. `HybridCompressor` only sends the borderline documents to the LLM extractor, in parallel.
+
+# In[ ]:
+
+
+from llm_utils.compression import EmbeddingCompressor, HybridCompressor
+
+embedding_compressor = EmbeddingCompressor(embeddings=embedding, token_budget=500, similarity_threshold=0.75)
+fast_compression_retriever = ContextualCompressionRetriever(
+    base_compressor=embedding_compressor,
+    base_retriever=MMRRetriever(vectorstore=vectordb, fetch_k=200)
+)
+pretty_print_docs(fast_compression_retriever.get_relevant_documents(question))
+
+
+# In[ ]:
+
+
+hybrid_compression_retriever = ContextualCompressionRetriever(
+    base_compressor=HybridCompressor(embedding_compressor=embedding_compressor,
+                                     llm_compressor=compressor, low=0.75, high=0.82),
+    base_retriever=MMRRetriever(vectorstore=vectordb, fetch_k=200)
+)
+pretty_print_docs(hybrid_compression_retriever.get_relevant_documents(question))
+
+
 # ## Combining various techniques
 
 # In[34]:
@@ -301,7 +378,7 @@ pretty_print_docs(compressed_docs)
 
 compression_retriever = ContextualCompressionRetriever(
     base_compressor=compressor,
-    base_retriever=vectordb.as_retriever(search_type = "mmr")
+    base_retriever=MMRRetriever(vectorstore=vectordb, fetch_k=200)
 )
 
 
@@ -358,6 +435,28 @@ docs_svm=svm_retriever.get_relevant_documents(question)
 docs_svm[0]
 
 
+# `SVMRetriever` trains a new SVM against *every* chunk for each question. `ShortlistSVMRetriever` first shortlists the 200 nearest chunks with the ANN index and trains the same SVM on those only, warm-started from its last solution for the question, so the cost per question no longer grows with the corpus.
+
+# In[ ]:
+
+
+from llm_utils.ann import AnnVectorStore
+from llm_utils.svm import ShortlistSVMRetriever
+
+ann_splits = AnnVectorStore.from_texts(splits, embedding, mode="hnsw")
+shortlist_svm_retriever = ShortlistSVMRetriever(vectorstore=ann_splits, k=4, shortlist=200)
+docs_svm = shortlist_svm_retriever.get_relevant_documents(question)
+docs_svm[0]
+
+
+# In[ ]:
+
+
+# several questions: one embedding request, the SVM fits run on a thread pool
+shortlist_svm_retriever.get_relevant_documents_batch(
+    ["What are major topics for this class?", "what did they say about matlab?"])
+
+
 # In[40]:
 
 
@@ -366,6 +465,34 @@ docs_tfidf=tfidf_retriever.get_relevant_documents(question)
 docs_tfidf[0]
 
 
+# Both of those refit over the whole corpus every time. A hybrid retriever keeps a persistent BM25 index (sparse postings) next to the Chroma vectors, searches both at the same time and merges the two rankings with reciprocal rank fusion. Keyword questions like "matlab" are matched exactly, paraphrases are still found by the embeddings, and new chunks are added to both indexes without a refit.
+
+# In[ ]:
+
+
+from llm_utils.bm25 import BM25Index
+from llm_utils.hybrid import HybridRetriever
+
+bm25_directory = os.path.join(persist_directory, "bm25")
+if os.path.exists(os.path.join(bm25_directory, "records.jsonl")):
+    bm25 = BM25Index.load(bm25_directory)
+else:
+    bm25 = BM25Index.from_chroma(vectordb)
+    bm25.save(bm25_directory)
+
+hybrid_retriever = HybridRetriever(vectorstore=vectordb, bm25=bm25, k=4, fetch_k=20)
+docs_hybrid = hybrid_retriever.get_relevant_documents("what did they say about matlab?")
+docs_hybrid[0]
+
+
+# In[ ]:
+
+
+# new chunks go into both indexes under the same ids, no refit
+# hybrid_retriever.add_documents(new_splits)
+# bm25.save(bm25_directory)
+
+
 # In[ ]:
 
 
@@ -20,6 +20,7 @@ import os
 import openai
 import sys
 sys.path.append('../..')
+sys.path.append('..')
 
 from dotenv import load_dotenv, find_dotenv
 _ = load_dotenv(find_dotenv()) # read local .env file
@@ -47,8 +48,10 @@ print(llm_name)
 
 from langchain.vectorstores import Chroma
 from langchain.embeddings.openai import OpenAIEmbeddings
+from llm_utils.embeddings import CachedEmbeddings
+from llm_utils.context import PackedRetriever
 persist_directory = 'docs/chroma/'
-embedding = OpenAIEmbeddings()
+embedding = CachedEmbeddings(OpenAIEmbeddings())
 vectordb = Chroma(persist_directory=persist_directory, embedding_function=embedding)
 
 
@@ -84,9 +87,10 @@ from langchain.chains import RetrievalQA
 # In[8]:
 
 
+# "stuff" chain: retrieved chunks are deduplicated and packed into a token budget
 qa_chain = RetrievalQA.from_chain_type(
     llm,
-    retriever=vectordb.as_retriever()
+    retriever=PackedRetriever(retriever=vectordb.as_retriever(), max_tokens=3000, model=llm_name)
 )
 
 
@@ -123,7 +127,7 @@ QA_CHAIN_PROMPT = PromptTemplate.from_template(template)
 # Run chain
 qa_chain = RetrievalQA.from_chain_type(
     llm,
-    retriever=vectordb.as_retriever(),
+    retriever=PackedRetriever(retriever=vectordb.as_retriever(), max_tokens=3000, model=llm_name),
     return_source_documents=True,
     chain_type_kwargs={"prompt": QA_CHAIN_PROMPT}
 )
@@ -218,6 +222,41 @@ result = qa_chain_mr({"query": question})
 result["result"]
 
 
+# `RetrievalQA`'s map_reduce makes its map calls one after another. `MapReduceQA` runs them concurrently, so the map phase costs about one round-trip. It also streams each partial answer as it arrives (in document order) and reduces many answers in a tree. With `confidence_threshold` set, the map calls still queued are cancelled once one document answers the question well enough.
+
+# In[ ]:
+
+
+from llm_utils.qa import MapReduceQA
+
+qa_engine = MapReduceQA(llm, retriever=vectordb.as_retriever(search_kwargs={"k": 8}),
+                        max_concurrency=8, reduce_fanout=4)
+for event in qa_engine.stream(question):
+    if event["type"] == "map":
+        print(f"[doc {event['index']}] {event['text'][:80]!r}")
+    elif event["type"] == "collapse":
+        print(f"[reduce level {event['level']}] {len(event['summaries'])} partial answers")
+    elif event["type"] == "answer":
+        print(event["text"])
+
+
+# In[ ]:
+
+
+fast_qa_engine = MapReduceQA(llm, retriever=vectordb.as_retriever(search_kwargs={"k": 8}),
+                             confidence_threshold=0.9)
+fast_qa_engine.run(question)["result"]
+
+
+# Refine can't run in parallel, since each step needs the previous answer, but it can show every intermediate answer as soon as it is ready.
+
+# In[ ]:
+
+
+for answer in qa_engine.refine(question):
+    print(answer, "\n---")
+
+
 # ### RetrievalQA limitations
 #  
 # QA fails to preserve conversational history.
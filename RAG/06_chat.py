@@ -18,6 +18,7 @@ import os
 import openai
 import sys
 sys.path.append('../..')
+sys.path.append('..')
 
 import panel as pn  # GUI
 pn.extension()
@@ -63,8 +64,10 @@ print(llm_name)
 
 from langchain.vectorstores import Chroma
 from langchain.embeddings.openai import OpenAIEmbeddings
+from llm_utils.embeddings import BatchedEmbeddings, CachedEmbeddings
+from llm_utils.context import PackedRetriever
 persist_directory = 'docs/chroma/'
-embedding = OpenAIEmbeddings()
+embedding = CachedEmbeddings(OpenAIEmbeddings())
 vectordb = Chroma(persist_directory=persist_directory, embedding_function=embedding)
 
 
@@ -99,7 +102,7 @@ QA_CHAIN_PROMPT = PromptTemplate(input_variables=["context", "question"],templat
 from langchain.chains import RetrievalQA
 question = "Is probability a class topic?"
 qa_chain = RetrievalQA.from_chain_type(llm,
-                                       retriever=vectordb.as_retriever(),
+                                       retriever=PackedRetriever(retriever=vectordb.as_retriever(), model=llm_name),
                                        return_source_documents=True,
                                        chain_type_kwargs={"prompt": QA_CHAIN_PROMPT})
 
@@ -126,7 +129,7 @@ memory = ConversationBufferMemory(
 
 
 from langchain.chains import ConversationalRetrievalChain
-retriever=vectordb.as_retriever()
+retriever=PackedRetriever(retriever=vectordb.as_retriever(), model=llm_name)
 qa = ConversationalRetrievalChain.from_llm(
     llm,
     retriever=retriever,
@@ -160,6 +163,25 @@ result = qa({"question": question})
 result['answer']
 
 
+# Before retrieving, the chain asks the LLM to rewrite the question as a standalone one. That isn't needed on the first turn or when the question doesn't refer back ("Is probability a class topic?"), only for follow-ups like "why are those prerequesites needed?". `FastConversationalRetrievalChain` makes the call only when needed, caches the rewrites, and can start retrieving for the raw question while the rewrite is running.
+
+# In[ ]:
+
+
+from llm_utils.conversation import FastConversationalRetrievalChain, RephraseCache
+
+fast_qa = FastConversationalRetrievalChain.from_llm(
+    llm,
+    retriever=retriever,
+    memory=ConversationBufferMemory(memory_key="chat_history", return_messages=True),
+    rephrase_cache=RephraseCache(),
+    speculative_retrieval=True,
+)
+for question in ["Is probability a class topic?", "why are those prerequesites needed?"]:
+    print(fast_qa({"question": question})["answer"])
+fast_qa.stats
+
+
 # # Create a chatbot that works on your documents
 
 # In[18]:
@@ -167,7 +189,11 @@ result['answer']
 
 from langchain.embeddings.openai import OpenAIEmbeddings
 from langchain.text_splitter import CharacterTextSplitter, RecursiveCharacterTextSplitter
-from langchain.vectorstores import DocArrayInMemorySearch
+from llm_utils.vectorstore import NumpyVectorStore  # NumPy drop-in for DocArrayInMemorySearch
+from llm_utils.file_index import open_file_index  # persistent per-file NumpyVectorStore
+from llm_utils.conversation import FastConversationalRetrievalChain, RephraseCache
+rephrase_cache = RephraseCache()  # shared by every chatbot session
+from llm_utils.streaming import StreamRunner, StreamingCallbackHandler, markdown_updater
 from langchain.document_loaders import TextLoader
 from langchain.chains import RetrievalQA,  ConversationalRetrievalChain
 from langchain.memory import ConversationBufferMemory
@@ -182,25 +208,30 @@ from langchain.document_loaders import PyPDFLoader
 
 
 def load_db(file, chain_type, k):
-    # load documents
-    loader = PyPDFLoader(file)
-    documents = loader.load()
-    # split documents
+    # split settings and embedding model are part of the index key
     text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=150)
-    docs = text_splitter.split_documents(documents)
-    # define embedding
-    embeddings = OpenAIEmbeddings()
-    # create vector database from data
-    db = DocArrayInMemorySearch.from_documents(docs, embeddings)
+    embeddings = CachedEmbeddings(BatchedEmbeddings(OpenAIEmbeddings()))
+    # vector database for this file's content: loaded from disk if any session
+    # has seen the same bytes before, otherwise parsed, split, embedded and saved
+    db = open_file_index(file, embeddings, text_splitter)
     # define retriever
     retriever = db.as_retriever(search_type="similarity", search_kwargs={"k": k})
+    # pack the chunks into a token budget so a large k cannot overflow the prompt
+    retriever = PackedRetriever(retriever=retriever, max_tokens=3000, model=llm_name)
     # create a chatbot chain. Memory is managed externally.
-    qa = ConversationalRetrievalChain.from_llm(
-        llm=ChatOpenAI(model_name=llm_name, temperature=0), 
+    # the condense-question LLM call is skipped on the first turn and for
+    # questions without references to earlier turns; rewrites are cached
+    # only the answering LLM streams its tokens to the UI
+    qa = FastConversationalRetrievalChain.from_llm(
+        llm=ChatOpenAI(model_name=llm_name, temperature=0, streaming=True,
+                       callbacks=[StreamingCallbackHandler()]),
+        condense_question_llm=ChatOpenAI(model_name=llm_name, temperature=0),
         chain_type=chain_type, 
         retriever=retriever, 
         return_source_documents=True,
         return_generated_question=True,
+        rephrase_cache=rephrase_cache,
+        speculative_retrieval=True,
     )
     return qa 
 
@@ -222,6 +253,7 @@ class cbfs(param.Parameterized):
         self.panels = []
         self.loaded_file = "docs/cs229_lectures/MachineLearning-Lecture01.pdf"
         self.qa = load_db(self.loaded_file,"stuff", 4)
+        self.runner = StreamRunner()  # streams answers; a new question stops the previous one
     
     def call_load_db(self, count):
         if count == 0 or file_input.value is None:  # init or no file specified :
@@ -238,14 +270,27 @@ class cbfs(param.Parameterized):
     def convchain(self, query):
         if not query:
             return pn.WidgetBox(pn.Row('User:', pn.pane.Markdown("", width=600)), scroll=True)
-        result = self.qa({"question": query, "chat_history": self.chat_history})
-        self.chat_history.extend([(query, result["answer"])])
-        self.db_query = result["generated_question"]
-        self.db_response = result["source_documents"]
-        self.answer = result['answer'] 
+        self.runner.cancel()  # a partial answer still being written ends up in the history first
+        chat_history = list(self.chat_history)
+        answer = pn.pane.Markdown("", width=600, style={'background-color': '#F6F6F6'})
+
+        def done(result):
+            self.chat_history = self.chat_history + [(query, result["answer"])]
+            self.db_query = result["generated_question"]
+            self.db_response = result["source_documents"]
+            self.answer = answer.object = result['answer']
+
+        def stopped(partial):
+            if partial:
+                self.chat_history = self.chat_history + [(query, partial)]
+            answer.object = partial + " *(stopped)*"
+
+        # the answer streams into `answer` on a worker thread
+        self.runner.start(lambda stream: self.qa({"question": query, "chat_history": chat_history}),
+                          on_update=markdown_updater(answer), on_done=done, on_cancel=stopped)
         self.panels.extend([
             pn.Row('User:', pn.pane.Markdown(query, width=600)),
-            pn.Row('ChatBot:', pn.pane.Markdown(self.answer, width=600, style={'background-color': '#F6F6F6'}))
+            pn.Row('ChatBot:', answer)
         ])
         inp.value = ''  #clears loading indicator when cleared
         return pn.WidgetBox(*self.panels,scroll=True)
@@ -281,6 +326,7 @@ class cbfs(param.Parameterized):
         return pn.WidgetBox(*rlist, width=600, scroll=True)
 
     def clr_history(self,count=0):
+        self.runner.cancel()
         self.chat_history = []
         return 
 
@@ -331,6 +377,32 @@ dashboard = pn.Column(
 dashboard
 
 
+# Answers are streamed into the conversation as they are generated. The runner records each answer's time to first token:
+
+# In[ ]:
+
+
+cb.runner.summary()
+
+
+# The panel app above serves one user: one chain and one history per Python process, and every answer blocks. To serve many users, `ChatServer` runs an asyncio HTTP/WebSocket service with one memory per session over a shared retriever and model client. Idle sessions are evicted, and requests beyond `max_concurrent` answers (plus a bounded queue) are refused instead of piling up. Answers stream token by token. Start it from a script, since `run()` blocks. `python -m llm_utils.chat_server benchmark --users 300` load-tests the same server against a local fake model.
+
+# In[ ]:
+
+
+from llm_utils.chat_server import ChatServer, RetrievalChatResponder
+
+shared_db = open_file_index("docs/cs229_lectures/MachineLearning-Lecture01.pdf",
+                            CachedEmbeddings(BatchedEmbeddings(OpenAIEmbeddings())),
+                            RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=150))
+chat_server = ChatServer(
+    RetrievalChatResponder(ChatOpenAI(model_name=llm_name, temperature=0),
+                           shared_db.as_retriever(search_kwargs={"k": 4}), model=llm_name),
+    idle_timeout=900, max_concurrent=64, max_waiting=256,
+)
+# chat_server.run(port=8080)
+
+
 # Feel free to copy this code and modify it to add your own features. You can try alternate memory and retriever models by changing the configuration in `load_db` function and the `convchain` method. [Panel](https://panel.holoviz.org/) and [Param](https://param.holoviz.org/) have many useful features and widgets you can use to extend the GUI.
 # 
 
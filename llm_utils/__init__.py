@@ -0,0 +1,4 @@
+# Shared helpers for the course notebooks.
+#
+# The notebooks live one directory below the repo root, so they pick this
+# package up with `sys.path.append('..')` before importing from it.
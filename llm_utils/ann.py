@@ -0,0 +1,339 @@
+# Approximate nearest neighbour search for large corpora.
+#
+# `AnnVectorStore` is a `NumpyVectorStore` whose unfiltered searches go
+# through an ANN index instead of a full matrix product:
+#
+#   * "hnsw"  - hnswlib graph, lowest latency; recall/latency tuned with `ef_search`
+#   * "ivfpq" - faiss IVF with product quantization, a few bytes per vector;
+#               tuned with `nprobe`
+#
+# The exact matrix is still kept (memory-mapped after `load`) for MMR, narrow
+# pre-filtered searches and `recall_report`'s exact baseline. Both libraries are
+# optional and only imported when their mode is used.
+#
+# Deleting from a built index does not rebuild it: the rows are removed from
+# the index (hnswlib `mark_deleted`, faiss `remove_ids`) and tombstoned in the
+# store, which leaves them out of exact and filtered searches too. Once more
+# than `max_deleted_fraction` of the rows are tombstones, the store is
+# compacted and the index rebuilt.
+
+import os
+import time
+
+import numpy as np
+
+from llm_utils.vectorstore import NumpyVectorStore, normalize_rows, top_k
+
+
+class HnswIndex:
+    def __init__(self, dim, M=16, ef_construction=200, ef_search=64):
+        import hnswlib
+
+        self.dim = dim
+        self.M = M
+        self.ef_construction = ef_construction
+        self._index = hnswlib.Index(space="ip", dim=dim)
+        self._initialized = False
+        self.ef_search = ef_search
+
+    @property
+    def ef_search(self):
+        return self._ef_search
+
+    @ef_search.setter
+    def ef_search(self, value):
+        self._ef_search = value
+        if self._initialized:
+            self._index.set_ef(value)
+
+    def add(self, vectors, start):
+        if not self._initialized:
+            self._index.init_index(max_elements=max(1024, len(vectors)), M=self.M,
+                                   ef_construction=self.ef_construction)
+            self._index.set_ef(self._ef_search)
+            self._initialized = True
+        needed = self._index.get_current_count() + len(vectors)
+        if needed > self._index.get_max_elements():
+            self._index.resize_index(max(needed, 2 * self._index.get_max_elements()))
+        self._index.add_items(vectors, np.arange(start, start + len(vectors)))
+
+    def remove(self, rows):
+        for row in rows:
+            self._index.mark_deleted(int(row))
+
+    def search(self, queries, k):
+        k = min(k, self._index.get_current_count() if self._initialized else 0)
+        if k == 0:
+            return np.empty((len(queries), 0), dtype=np.int64), np.empty((len(queries), 0))
+        # hnswlib needs ef >= k
+        if self._ef_search < k:
+            self._index.set_ef(k)
+        labels, distances = self._index.knn_query(queries, k=k)
+        self._index.set_ef(self._ef_search)
+        # "ip" space reports 1 - <q, v>
+        return labels.astype(np.int64), 1.0 - distances
+
+    def save(self, path):
+        self._index.save_index(path)
+
+    def load(self, path, max_elements):
+        self._index.load_index(path, max_elements=max_elements)
+        self._index.set_ef(self._ef_search)
+        self._initialized = True
+
+
+class IvfPqIndex:
+    def __init__(self, dim, nlist=1024, m=16, nbits=8, nprobe=16):
+        import faiss
+
+        self.dim = dim
+        self.nlist = nlist
+        self.m = m
+        self.nbits = nbits
+        self._faiss = faiss
+        self._index = None
+        self._ivf = None
+        self.nprobe = nprobe
+
+    @property
+    def nprobe(self):
+        return self._nprobe
+
+    @nprobe.setter
+    def nprobe(self, value):
+        self._nprobe = value
+        if self._ivf is not None:
+            self._ivf.nprobe = value
+
+    @property
+    def trained(self):
+        return self._index is not None
+
+    def train(self, vectors):
+        faiss = self._faiss
+        # keep the usual ~39 training points per centroid
+        nlist = max(1, min(self.nlist, len(vectors) // 39))
+        quantizer = faiss.IndexFlatIP(self.dim)
+        index = faiss.IndexIVFPQ(quantizer, self.dim, nlist, self.m, self.nbits,
+                                 faiss.METRIC_INNER_PRODUCT)
+        index.train(np.ascontiguousarray(vectors, dtype=np.float32))
+        index.nprobe = self._nprobe
+        self._index = faiss.IndexIDMap(index)
+        self._ivf = index
+
+    def add(self, vectors, start):
+        if self._index is None:
+            return
+        ids = np.arange(start, start + len(vectors), dtype=np.int64)
+        self._index.add_with_ids(np.ascontiguousarray(vectors, dtype=np.float32), ids)
+
+    def remove(self, rows):
+        if self._index is not None:
+            self._index.remove_ids(np.asarray(rows, dtype=np.int64))
+
+    def search(self, queries, k):
+        scores, labels = self._index.search(np.ascontiguousarray(queries, dtype=np.float32), k)
+        return labels.astype(np.int64), scores
+
+    def save(self, path):
+        self._faiss.write_index(self._index, path)
+
+    def load(self, path, max_elements=None):
+        self._index = self._faiss.read_index(path)
+        self._ivf = self._faiss.extract_index_ivf(self._index)
+        self._ivf.nprobe = self._nprobe
+
+
+_INDEX_TYPES = {"hnsw": HnswIndex, "ivfpq": IvfPqIndex}
+_INDEX_FILES = {"hnsw": "index.hnsw", "ivfpq": "index.ivfpq"}
+
+
+class AnnVectorStore(NumpyVectorStore):
+    """`NumpyVectorStore` that answers unfiltered queries from an ANN index.
+
+    `mode` is "hnsw" or "ivfpq"; `index_kwargs` go to the index (`M`,
+    `ef_construction`, `ef_search` / `nlist`, `m`, `nbits`, `nprobe`). An
+    IVF-PQ index is trained the first time `train_min` vectors are present;
+    until then search stays exact. Deleted rows are tombstoned until they
+    are more than `max_deleted_fraction` of the store.
+    """
+
+    def __init__(self, embedding, mode="hnsw", train_min=10_000, max_deleted_fraction=0.2,
+                 **index_kwargs):
+        super().__init__(embedding)
+        if mode not in _INDEX_TYPES:
+            raise ValueError(f"unknown ANN mode {mode!r}, expected one of {sorted(_INDEX_TYPES)}")
+        self.mode = mode
+        self.train_min = train_min
+        self.index_kwargs = index_kwargs
+        self.index = None
+        self.max_deleted_fraction = max_deleted_fraction
+        self._dead = np.empty(0, dtype=np.int64)  # sorted tombstoned rows
+
+    def __len__(self):
+        return self._size - len(self._dead)
+
+    def live_rows(self):
+        return np.setdiff1d(np.arange(self._size), self._dead, assume_unique=True)
+
+    def _ensure_index(self, dim):
+        if self.index is None:
+            self.index = _INDEX_TYPES[self.mode](dim, **self.index_kwargs)
+
+    def add_vectors(self, vectors, texts, metadatas=None, ids=None):
+        start = self._size
+        ids = super().add_vectors(vectors, texts, metadatas, ids)
+        if not ids:
+            return ids
+        self._ensure_index(self._matrix.shape[1])
+        if self.mode == "ivfpq" and not self.index.trained:
+            if self._size >= self.train_min:
+                self.index.train(self.matrix)
+                self.index.add(self.matrix, 0)
+        else:
+            self.index.add(self._matrix[start:self._size], start)
+        return ids
+
+    def delete(self, ids=None, **kwargs):
+        if not self.approximate:
+            # no index to keep in step with: compact right away
+            return super().delete(ids)
+        rows = [self._id_to_row.pop(i) for i in ids or () if i in self._id_to_row]
+        if not rows:
+            return False
+        self.index.remove(rows)
+        self._dead = np.union1d(self._dead, rows)
+        if len(self._dead) > self.max_deleted_fraction * self._size:
+            # both index types address vectors by row, so rebuild after compaction
+            self._drop_rows(set(self._dead.tolist()))
+            self._dead = np.empty(0, dtype=np.int64)
+            self.rebuild()
+        return True
+
+    def filter_rows(self, filter):
+        rows = super().filter_rows(filter)
+        if len(self._dead):
+            rows = np.setdiff1d(rows, self._dead, assume_unique=True)
+        return rows
+
+    def rebuild(self):
+        self.index = None
+        if self._size:
+            self._ensure_index(self._matrix.shape[1])
+            if self.mode == "ivfpq":
+                if self._size >= self.train_min:
+                    self.index.train(self.matrix)
+                    self.index.add(self.matrix, 0)
+            else:
+                self.index.add(self.matrix, 0)
+
+    @property
+    def approximate(self):
+        return self.index is not None and (self.mode != "ivfpq" or self.index.trained)
+
+    def _search_all(self, queries, k):
+        if not self.approximate:
+            return super()._search_all(queries, k)
+        k = min(k, len(self))
+        if k == 0:
+            empty = np.empty((len(queries), 0))
+            return empty.astype(np.int64), empty.astype(np.float32)
+        rows, scores = self.index.search(queries, k)
+        # faiss pads with -1 when a query's probed lists hold fewer than k
+        # vectors: score just those queries exactly, keep the others' hits
+        short = (rows < 0).any(axis=1)
+        if short.any():
+            exact_rows, exact_scores = self._search_rows(queries[short], k, self.live_rows())
+            rows[short], scores[short] = exact_rows, exact_scores
+        return rows, scores
+
+    def _search_post_filtered(self, queries, k, rows):
+        if not self.approximate:
+            return super()._search_post_filtered(queries, k, rows)
+        # over-fetch from the ANN index in proportion to the filter's selectivity
+        allowed = np.zeros(self._size, dtype=bool)
+        allowed[rows] = True
+        want = min(k, len(rows))
+        fetch = min(len(self), 2 * int(np.ceil(k * self._size / len(rows))) + k)
+        found, scores = self.index.search(queries, fetch)
+        keep = found >= 0
+        keep[keep] = allowed[found[keep]]
+        order = np.argsort(~keep, axis=1, kind="stable")[:, :want]
+        found = np.take_along_axis(found, order, axis=1)
+        scores = np.take_along_axis(scores, order, axis=1)
+        short = keep.sum(axis=1) < want
+        if short.any():
+            # not enough survivors for these queries: score the candidate rows exactly
+            exact_rows, exact_scores = self._search_rows(queries[short], k, rows)
+            found[short], scores[short] = exact_rows, exact_scores
+        return found, scores
+
+    # -- persistence -------------------------------------------------------
+
+    def save(self, directory):
+        super().save(directory)
+        np.save(os.path.join(directory, "deleted.npy"), self._dead)
+        if self.approximate:
+            self.index.save(os.path.join(directory, _INDEX_FILES[self.mode]))
+
+    @classmethod
+    def load(cls, directory, embedding, mode="hnsw", mmap=True, **kwargs):
+        store = super().load(directory, embedding, mmap=mmap, mode=mode, **kwargs)
+        deleted = os.path.join(directory, "deleted.npy")
+        if os.path.exists(deleted):
+            store._dead = np.load(deleted).astype(np.int64)
+            dead = set(store._dead.tolist())
+            store._id_to_row = {id_: r for r, id_ in enumerate(store.ids) if r not in dead}
+        path = os.path.join(directory, _INDEX_FILES[mode])
+        if store._size and os.path.exists(path):
+            store._ensure_index(store._matrix.shape[1])
+            store.index.load(path, max_elements=store._size)
+        else:
+            if len(store._dead):
+                store._drop_rows(set(store._dead.tolist()))
+                store._dead = np.empty(0, dtype=np.int64)
+            store.rebuild()
+        return store
+
+
+def recall_report(store, queries, k=10, settings=None):
+    """Recall@k and latency of `store`'s ANN search against exact search.
+
+    `queries` are query vectors; `settings` is a list of values for the
+    store's knob (`ef_search` for HNSW, `nprobe` for IVF-PQ). Returns one
+    dict per setting plus an "exact" baseline row.
+    """
+    queries = normalize_rows(queries)
+    knob = "ef_search" if store.mode == "hnsw" else "nprobe"
+    settings = settings or ([16, 32, 64, 128, 256] if knob == "ef_search" else [1, 4, 16, 64])
+
+    def timed(search):
+        latencies, results = [], []
+        for q in queries:
+            t0 = time.perf_counter()
+            results.append(search(q[None, :])[0])
+            latencies.append((time.perf_counter() - t0) * 1000)
+        return np.array(latencies), results
+
+    def exact_search(q):
+        scores = q @ store.matrix.T
+        scores[:, store._dead] = -np.inf
+        return top_k(scores, k)
+
+    latencies, truth = timed(exact_search)
+    report = [{knob: "exact", "recall": 1.0,
+               "mean_ms": float(latencies.mean()), "p95_ms": float(np.percentile(latencies, 95))}]
+    previous = getattr(store.index, knob)
+    try:
+        for value in settings:
+            setattr(store.index, knob, value)
+            # the index's own hits: no exact fill-in for short results, -1 padding dropped
+            latencies, found = timed(lambda q: store.index.search(q, k)[0])
+            recall = np.mean([len(set(f[f >= 0].tolist()) & set(t.tolist())) / max(1, len(t))
+                              for f, t in zip(found, truth)])
+            report.append({knob: value, "recall": float(recall),
+                           "mean_ms": float(latencies.mean()),
+                           "p95_ms": float(np.percentile(latencies, 95))})
+    finally:
+        setattr(store.index, knob, previous)
+    return report
@@ -0,0 +1,268 @@
+# Incremental BM25 keyword index on scipy.sparse postings.
+#
+# `TFIDFRetriever.from_texts` refits scikit-learn over the whole corpus every
+# time. `BM25Index` keeps term frequencies in column-compressed (CSC) sparse
+# matrices, one column per term, so a query only touches the posting columns
+# of its own terms. New documents go into a new segment instead of rebuilding
+# the existing ones; small segments are merged once there are more than
+# `max_segments`. Deletes mark rows dead and are dropped at the next merge.
+# Document frequencies and lengths are kept up to date on every change, so
+# scores always reflect the live corpus.
+#
+# Writers hold a lock; a search takes it only to snapshot the segment list,
+# the statistics and each segment's `alive` mask (replaced, never written in
+# place, by deletes), so it can score while another thread adds documents.
+
+import json
+import os
+import re
+import threading
+import uuid
+
+import numpy as np
+import scipy.sparse as sp
+
+try:
+    from langchain_core.documents import Document
+except ImportError:
+    from langchain.schema import Document
+
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    return _TOKEN.findall(text.lower())
+
+
+class _Segment:
+    def __init__(self, postings, ids, lengths, alive=None):
+        self.postings = postings.tocsc()          # (docs, terms) term frequencies
+        self.ids = list(ids)
+        self.lengths = np.asarray(lengths, dtype=np.float32)
+        self.alive = np.ones(len(self.ids), dtype=bool) if alive is None else alive
+
+    def __len__(self):
+        return len(self.ids)
+
+    def live(self):
+        return int(self.alive.sum())
+
+
+class BM25Index:
+    """Okapi BM25 over a growing set of documents, searchable by id."""
+
+    def __init__(self, k1=1.5, b=0.75, max_segments=8):
+        self.k1 = k1
+        self.b = b
+        self.max_segments = max_segments
+        self.vocab = {}
+        self.df = np.zeros(0, dtype=np.int64)
+        self.texts = {}
+        self.metadatas = {}
+        self.segments = []
+        self._where = {}          # id -> (segment, row)
+        self._total_length = 0.0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._where)
+
+    # -- writing -----------------------------------------------------------
+
+    def _term_ids(self, tokens, grow=True):
+        ids = []
+        for token in tokens:
+            term = self.vocab.get(token)
+            if term is None and grow:
+                term = self.vocab[token] = len(self.vocab)
+            if term is not None:
+                ids.append(term)
+        return ids
+
+    def add_texts(self, texts, metadatas=None, ids=None):
+        texts = list(texts)
+        metadatas = list(metadatas) if metadatas is not None else [{} for _ in texts]
+        ids = list(ids) if ids is not None else [str(uuid.uuid4()) for _ in texts]
+        with self._lock:
+            self.delete([i for i in ids if i in self._where])
+            if not texts:
+                return []
+
+            rows, cols, lengths = [], [], []
+            for row, text in enumerate(texts):
+                terms = self._term_ids(tokenize(text))
+                rows.extend([row] * len(terms))
+                cols.extend(terms)
+                lengths.append(len(terms))
+            # duplicate (row, term) pairs are summed into term frequencies
+            postings = sp.coo_matrix((np.ones(len(rows), dtype=np.float32), (rows, cols)),
+                                     shape=(len(texts), len(self.vocab))).tocsc()
+            postings.sum_duplicates()
+
+            if len(self.df) < len(self.vocab):
+                self.df = np.concatenate([self.df, np.zeros(len(self.vocab) - len(self.df), dtype=np.int64)])
+            self.df += np.diff(postings.indptr)
+            self._total_length += float(sum(lengths))
+
+            segment = _Segment(postings, ids, lengths)
+            self.segments.append(segment)
+            for row, (id_, text, metadata) in enumerate(zip(ids, texts, metadatas)):
+                self._where[id_] = (segment, row)
+                self.texts[id_] = text
+                self.metadatas[id_] = dict(metadata or {})
+            if len(self.segments) > self.max_segments:
+                self._merge_smallest()
+            return ids
+
+    def add_documents(self, documents, ids=None):
+        documents = list(documents)
+        return self.add_texts([d.page_content for d in documents],
+                              [d.metadata for d in documents], ids)
+
+    def delete(self, ids):
+        with self._lock:
+            copied = set()
+            for id_ in ids or ():
+                found = self._where.pop(id_, None)
+                if found is None:
+                    continue
+                segment, row = found
+                if id(segment) not in copied:
+                    # searches may hold the old mask
+                    segment.alive = segment.alive.copy()
+                    copied.add(id(segment))
+                segment.alive[row] = False
+                terms = segment.postings.getrow(row).indices
+                self.df[terms] -= 1
+                self._total_length -= float(segment.lengths[row])
+                self.texts.pop(id_, None)
+                self.metadatas.pop(id_, None)
+            self.segments = [s for s in self.segments if s.live()]
+
+    def _merge_smallest(self):
+        self.segments.sort(key=len)
+        merged = self._merge(self.segments[:2])
+        self.segments = [merged] + self.segments[2:]
+
+    def _merge(self, segments):
+        terms = len(self.vocab)
+        blocks, ids, lengths = [], [], []
+        for segment in segments:
+            keep = np.flatnonzero(segment.alive)
+            postings = segment.postings[keep]
+            postings.resize((len(keep), terms))
+            blocks.append(postings)
+            ids.extend(segment.ids[r] for r in keep)
+            lengths.append(segment.lengths[keep])
+        merged = _Segment(sp.vstack(blocks, format="csc"), ids, np.concatenate(lengths))
+        for row, id_ in enumerate(ids):
+            self._where[id_] = (merged, row)
+        return merged
+
+    def optimize(self):
+        """Merge every segment into one and drop deleted rows."""
+        with self._lock:
+            if self.segments:
+                self.segments = [self._merge(self.segments)]
+
+    # -- searching ---------------------------------------------------------
+
+    def search(self, query, k=4):
+        """Best `k` `(id, score)` pairs for `query`, highest score first."""
+        tokens = tokenize(query)
+        with self._lock:
+            terms = np.unique(self._term_ids(tokens, grow=False))
+            if not len(terms) or not self._where:
+                return []
+            n = len(self._where)
+            df = self.df[terms]
+            avgdl = self._total_length / n or 1.0
+            segments = [(segment, segment.alive) for segment in self.segments]
+        idf = np.log1p((n - df + 0.5) / (df + 0.5)).astype(np.float32)
+
+        found_ids, found_scores = [], []
+        for segment, alive in segments:
+            present = terms < segment.postings.shape[1]
+            if not present.any():
+                continue
+            columns = segment.postings[:, terms[present]].tocoo()
+            tf, rows = columns.data, columns.row
+            norm = self.k1 * (1 - self.b + self.b * segment.lengths[rows] / avgdl)
+            weights = idf[present][columns.col] * tf * (self.k1 + 1) / (tf + norm)
+            scores = np.bincount(rows, weights=weights, minlength=len(segment))
+            hits = np.flatnonzero((scores > 0) & alive)
+            found_ids.extend(segment.ids[r] for r in hits)
+            found_scores.append(scores[hits])
+        if not found_ids:
+            return []
+        scores = np.concatenate(found_scores)
+        best = np.argsort(-scores, kind="stable")[:k]
+        return [(found_ids[i], float(scores[i])) for i in best]
+
+    def document(self, id_):
+        return Document(page_content=self.texts[id_], metadata=dict(self.metadatas[id_]))
+
+    def similarity_search(self, query, k=4):
+        hits = self.search(query, k)
+        with self._lock:
+            # skip documents deleted since the search
+            return [self.document(id_) for id_, _ in hits if id_ in self.texts]
+
+    # -- building and persistence -------------------------------------------
+
+    @classmethod
+    def from_documents(cls, documents, ids=None, **kwargs):
+        index = cls(**kwargs)
+        index.add_documents(documents, ids)
+        return index
+
+    @classmethod
+    def from_chroma(cls, vectordb, **kwargs):
+        """Index the texts already stored in a LangChain `Chroma` store, under the same ids."""
+        data = vectordb.get(include=["documents", "metadatas"])
+        index = cls(**kwargs)
+        index.add_texts(data["documents"], data["metadatas"], data["ids"])
+        return index
+
+    def save(self, directory):
+        """Write the merged postings, vocabulary and records to `directory`."""
+        with self._lock:
+            self.optimize()
+            os.makedirs(directory, exist_ok=True)
+            segment = self.segments[0] if self.segments else _Segment(
+                sp.csc_matrix((0, len(self.vocab)), dtype=np.float32), [], [])
+            postings = segment.postings.copy()
+            postings.resize((len(segment), len(self.vocab)))
+            sp.save_npz(os.path.join(directory, "postings.npz"), postings)
+            with open(os.path.join(directory, "vocab.json"), "w") as f:
+                json.dump({"k1": self.k1, "b": self.b, "terms": sorted(self.vocab, key=self.vocab.get)}, f)
+            tmp = os.path.join(directory, "records.jsonl.tmp")
+            with open(tmp, "w") as f:
+                for id_, length in zip(segment.ids, segment.lengths):
+                    f.write(json.dumps({"id": id_, "text": self.texts[id_],
+                                        "metadata": self.metadatas[id_], "length": int(length)}) + "\n")
+            os.replace(tmp, os.path.join(directory, "records.jsonl"))
+
+    @classmethod
+    def load(cls, directory, **kwargs):
+        with open(os.path.join(directory, "vocab.json")) as f:
+            saved = json.load(f)
+        index = cls(k1=saved["k1"], b=saved["b"], **kwargs)
+        index.vocab = {term: i for i, term in enumerate(saved["terms"])}
+        ids, lengths = [], []
+        with open(os.path.join(directory, "records.jsonl")) as f:
+            for line in f:
+                record = json.loads(line)
+                ids.append(record["id"])
+                lengths.append(record["length"])
+                index.texts[record["id"]] = record["text"]
+                index.metadatas[record["id"]] = record["metadata"]
+        postings = sp.load_npz(os.path.join(directory, "postings.npz")).tocsc()
+        index.df = np.diff(postings.indptr).astype(np.int64)
+        index._total_length = float(sum(lengths))
+        if ids:
+            segment = _Segment(postings, ids, lengths)
+            index.segments = [segment]
+            index._where = {id_: (segment, row) for row, id_ in enumerate(ids)}
+        return index
@@ -0,0 +1,235 @@
+# Persistent response cache for deterministic (temperature=0) model calls.
+#
+# Entries live in a single SQLite file keyed by a SHA-256 of everything that
+# determines the answer: model, messages, temperature and function schemas.
+# The cache sits under the raw `openai.ChatCompletion.create` helpers in
+# `llm_utils.completion` and, through `LangChainResponseCache`, under every
+# LangChain chat model once `enable_cache()` has been called, so re-running a
+# notebook only pays for the prompts that actually changed.
+
+import contextlib
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+
+DEFAULT_PATH = os.path.join(
+    os.environ.get("LLM_CACHE_DIR", os.path.expanduser("~/.cache/llm-material")),
+    "responses.sqlite",
+)
+
+
+def make_key(**parts):
+    """Stable content hash of the request parts (dict order does not matter)."""
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def response_key(model, messages, temperature, functions=None, **kwargs):
+    return make_key(model=model, messages=messages, temperature=temperature,
+                    functions=functions, **kwargs)
+
+
+class ResponseCache:
+    """SQLite-backed key/value cache with TTL, LRU eviction and hit/miss counters.
+
+    `ttl` is in seconds (None keeps entries forever). When the cache grows
+    past `max_entries` or `max_bytes` the least recently used entries are
+    dropped, down to 90% of the limit so the next writes do not evict again.
+    Entry and byte totals are kept as running counts; expired entries are
+    swept, and the totals resynced with the file, every `sweep_every` writes.
+    Set `bypass = True` (or the LLM_CACHE_BYPASS environment variable) to
+    skip reads while still recording fresh answers.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, ttl=30 * 24 * 3600, max_entries=100_000,
+                 max_bytes=512 * 1024 * 1024, sweep_every=256):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sweep_every = sweep_every
+        self.bypass = bool(os.environ.get("LLM_CACHE_BYPASS"))
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL,"
+            " created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses(accessed)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_created ON responses(created)")
+        self._writes = 0
+        self._recount()
+
+    def _recount(self):
+        self._count, self._bytes = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+
+    def get(self, key):
+        if self.bypass:
+            return None
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created, size FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and self.ttl is not None and now - row[1] > self.ttl:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._count -= 1
+                self._bytes -= row[2]
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def set(self, key, value):
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        with self._lock:
+            old = self._conn.execute(
+                "SELECT size FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, created, accessed)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now, now),
+            )
+            if old is None:
+                self._count += 1
+                self._bytes += size
+            else:
+                self._bytes += size - old[0]
+            self._writes += 1
+            if (self._writes % self.sweep_every == 0
+                    or (self.max_entries and self._count > self.max_entries)
+                    or (self.max_bytes and self._bytes > self.max_bytes)):
+                self._evict()
+
+    def _evict(self):
+        # expired rows go first, so they are not counted against the LRU budgets
+        if self.ttl is not None:
+            self._conn.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.ttl,))
+        self._recount()
+        evicted = False
+        if self.max_entries and self._count > self.max_entries:
+            over = self._count - int(self.max_entries * 0.9)
+            self._conn.execute(
+                "DELETE FROM responses WHERE key IN"
+                " (SELECT key FROM responses ORDER BY accessed LIMIT ?)", (over,)
+            )
+            self._recount()
+            evicted = True
+        if self.max_bytes and self._bytes > self.max_bytes:
+            # drop the oldest entries until we are back under 90% of the limit
+            excess, doomed = self._bytes - int(self.max_bytes * 0.9), []
+            for key, entry_size in self._conn.execute(
+                "SELECT key, size FROM responses ORDER BY accessed"
+            ):
+                doomed.append((key,))
+                excess -= entry_size
+                if excess <= 0:
+                    break
+            self._conn.executemany("DELETE FROM responses WHERE key = ?", doomed)
+            evicted = True
+        if evicted:
+            self._recount()
+
+    @contextlib.contextmanager
+    def bypassed(self):
+        previous, self.bypass = self.bypass, True
+        try:
+            yield self
+        finally:
+            self.bypass = previous
+
+    def stats(self):
+        with self._lock:
+            count, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": count, "bytes": size}
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._count = self._bytes = 0
+        self.hits = self.misses = 0
+
+
+_TEMPERATURE_ZERO = re.compile(r"""['"]temperature['"]\s*[:,]\s*0(\.0+)?(?![\d.])""")
+
+
+def _load_langchain_cache_base():
+    try:
+        from langchain_core.caches import BaseCache
+    except ImportError:
+        from langchain.cache import BaseCache
+    return BaseCache
+
+
+def LangChainResponseCache(cache, deterministic_only=True):
+    """Adapter exposing a `ResponseCache` as a LangChain `llm_cache`.
+
+    LangChain hands the cache the rendered prompt plus an `llm_string` that
+    already encodes the model name, temperature and bound function schemas,
+    so those two strings are all the key needs. With `deterministic_only`
+    only temperature=0 models are cached.
+    """
+    from langchain.load import dumps, loads
+
+    BaseCache = _load_langchain_cache_base()
+
+    class _LangChainResponseCache(BaseCache):
+        def _key(self, prompt, llm_string):
+            if deterministic_only and not _TEMPERATURE_ZERO.search(llm_string):
+                return None
+            return make_key(prompt=prompt, llm_string=llm_string)
+
+        def lookup(self, prompt, llm_string):
+            key = self._key(prompt, llm_string)
+            if key is None:
+                return None
+            value = cache.get(key)
+            return None if value is None else [loads(g) for g in json.loads(value)]
+
+        def update(self, prompt, llm_string, return_val):
+            key = self._key(prompt, llm_string)
+            if key is not None:
+                cache.set(key, json.dumps([dumps(g) for g in return_val]))
+
+        def clear(self, **kwargs):
+            cache.clear()
+
+    return _LangChainResponseCache()
+
+
+def enable_cache(path=DEFAULT_PATH, langchain=True, **kwargs):
+    """Open a `ResponseCache` and install it under the completion helpers and LangChain."""
+    from llm_utils import completion
+
+    cache = ResponseCache(path, **kwargs)
+    completion.response_cache = cache
+    if langchain:
+        try:
+            from langchain.globals import set_llm_cache
+        except ImportError:
+            import langchain as _langchain
+
+            def set_llm_cache(value):
+                _langchain.llm_cache = value
+        set_llm_cache(LangChainResponseCache(cache))
+    return cache
@@ -0,0 +1,437 @@
+# Multi-session asyncio chat service for the notebook chatbots.
+#
+# The panel `cbfs` chatbots hold one chain and one history per Python process
+# and block while the model answers. `ChatServer` (aiohttp) hosts many
+# sessions in one process over a shared retriever and model client:
+#
+#   POST   /sessions                      -> {"session_id": ...}
+#   POST   /sessions/{id}/messages        {"message": ...} -> text/event-stream of tokens
+#   GET    /sessions/{id}/ws              WebSocket: send {"message": ...}, receive
+#                                         {"type": "token"|"done"|"error", ...}
+#   DELETE /sessions/{id}
+#   GET    /health                        session and load counters
+#
+# * Each session keeps its own memory and answers one message at a time; a
+#   message sent while it is still answering is refused (HTTP 429 / a
+#   WebSocket "session busy" error).
+#   Sessions idle for longer than `idle_timeout` are evicted by a background
+#   sweep, and the least recently used are dropped beyond `max_sessions`.
+# * Backpressure: at most `max_concurrent` answers are generated at once,
+#   with at most `max_waiting` requests queued behind them. Anything beyond
+#   that is refused right away (HTTP 503 / a WebSocket "busy" error) rather
+#   than piling up. Writes to a slow client await the transport's drain.
+# * Answers stream token by token from the model's `astream`.
+#
+# `FakeChatModel` streams canned tokens with configurable latency, and
+# `benchmark` runs the server on it under hundreds of simulated users
+# (`python -m llm_utils.chat_server benchmark --users 300`).
+
+import argparse
+import asyncio
+import itertools
+import json
+import statistics
+import time
+import uuid
+from collections import OrderedDict
+from types import SimpleNamespace
+
+from aiohttp import ClientSession, TCPConnector, WSMsgType, web
+
+from llm_utils.context import pack_documents
+
+try:
+    from langchain_core.documents import Document
+    from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+except ImportError:
+    from langchain.schema import AIMessage, Document, HumanMessage, SystemMessage
+
+
+class Busy(Exception):
+    """Raised when the server is at its concurrency and queue limits."""
+
+
+class SessionBusy(Busy):
+    """Raised when the session is still answering its previous message."""
+
+
+class Session:
+    def __init__(self, session_id):
+        self.id = session_id
+        self.history = []            # [(question, answer), ...]
+        self.state = {}              # per-session objects owned by the responder
+        self.lock = asyncio.Lock()   # one message at a time per session
+        self.last_seen = time.monotonic()
+
+    def touch(self):
+        self.last_seen = time.monotonic()
+
+
+class SessionStore:
+    """Sessions by id, evicting idle and least recently used ones.
+
+    Sessions that are answering a message are never evicted, so the store
+    can briefly hold more than `max_sessions` when they all are.
+    """
+
+    def __init__(self, idle_timeout=900, max_sessions=10_000):
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self.evicted = 0
+        self._sessions = OrderedDict()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def create(self):
+        session = Session(uuid.uuid4().hex)
+        self._sessions[session.id] = session
+        excess = len(self._sessions) - self.max_sessions
+        if excess > 0:
+            # least recently used first, skipping sessions mid-answer
+            idle = itertools.islice(
+                (sid for sid, s in self._sessions.items()
+                 if not s.lock.locked() and s is not session), excess)
+            for sid in list(idle):
+                del self._sessions[sid]
+                self.evicted += 1
+        return session
+
+    def get(self, session_id):
+        session = self._sessions.get(session_id)
+        if session is not None:
+            session.touch()
+            self._sessions.move_to_end(session_id)
+        return session
+
+    def delete(self, session_id):
+        return self._sessions.pop(session_id, None) is not None
+
+    def sweep(self):
+        """Drop sessions idle for longer than `idle_timeout`; returns how many."""
+        cutoff = time.monotonic() - self.idle_timeout
+        idle = [sid for sid, s in self._sessions.items()
+                if s.last_seen < cutoff and not s.lock.locked()]
+        for sid in idle:
+            del self._sessions[sid]
+        self.evicted += len(idle)
+        return len(idle)
+
+
+class Gate:
+    """At most `max_concurrent` holders, at most `max_waiting` queued; beyond that `Busy`."""
+
+    def __init__(self, max_concurrent=64, max_waiting=256):
+        self.max_waiting = max_waiting
+        self.waiting = 0
+        self.active = 0
+        self.rejected = 0
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+
+    async def __aenter__(self):
+        if self._semaphore.locked() and self.waiting >= self.max_waiting:
+            self.rejected += 1
+            raise Busy()
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        return self
+
+    async def __aexit__(self, *exc):
+        self.active -= 1
+        self._semaphore.release()
+
+
+# -- responders ------------------------------------------------------------
+#
+# A responder is called as `responder(session, message)` and returns an async
+# iterator of text chunks; the server records the turn in `session.history`.
+
+class RetrievalChatResponder:
+    """Streaming RAG chat over a shared `retriever` and chat model.
+
+    Retrieved chunks are packed into `max_context_tokens`; the last
+    `max_history_turns` turns of the session are sent along.
+    """
+
+    def __init__(self, llm, retriever, system_prompt=None, max_history_turns=6,
+                 max_context_tokens=3000, model="gpt-3.5-turbo"):
+        self.llm = llm
+        self.retriever = retriever
+        self.system_prompt = system_prompt or (
+            "Use the following pieces of context to answer the question. If you don't know "
+            "the answer, just say that you don't know, don't try to make up an answer.")
+        self.max_history_turns = max_history_turns
+        self.max_context_tokens = max_context_tokens
+        self.model = model
+
+    async def _retrieve(self, question):
+        if hasattr(self.retriever, "aget_relevant_documents"):
+            return await self.retriever.aget_relevant_documents(question)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.retriever.get_relevant_documents, question)
+
+    async def __call__(self, session, message):
+        docs = pack_documents(await self._retrieve(message), self.max_context_tokens, self.model)
+        context = "\n\n".join(d.page_content for d in docs)
+        messages = [SystemMessage(content=f"{self.system_prompt}\n\n{context}")]
+        for question, answer in session.history[-self.max_history_turns:]:
+            messages += [HumanMessage(content=question), AIMessage(content=answer)]
+        messages.append(HumanMessage(content=message))
+        async for chunk in self.llm.astream(messages):
+            text = getattr(chunk, "content", chunk)
+            if text:
+                yield text
+
+
+class ChainResponder:
+    """Runs a blocking LangChain chain/agent per session in a worker thread.
+
+    `make_chain()` builds the session's chain (e.g. an `AgentExecutor` with its
+    own memory around shared tools and model); the answer is sent in one chunk.
+    """
+
+    def __init__(self, make_chain, input_key="input", output_key="output"):
+        self.make_chain = make_chain
+        self.input_key = input_key
+        self.output_key = output_key
+
+    async def __call__(self, session, message):
+        chain = session.state.get("chain")
+        if chain is None:
+            chain = session.state["chain"] = self.make_chain()
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(None, chain.invoke, {self.input_key: message})
+        yield result[self.output_key]
+
+
+class FakeChatModel:
+    """Local stand-in for a chat model: streams `tokens` after `ttft` seconds, `token_delay` apart."""
+
+    def __init__(self, tokens=None, ttft=0.3, token_delay=0.02):
+        self.tokens = tokens or ("This is a simulated answer from the fake model . " * 4).split()
+        self.ttft = ttft
+        self.token_delay = token_delay
+
+    async def astream(self, messages):
+        await asyncio.sleep(self.ttft)
+        for i, token in enumerate(self.tokens):
+            if i:
+                await asyncio.sleep(self.token_delay)
+            yield SimpleNamespace(content=token + " ")
+
+
+# -- server ----------------------------------------------------------------
+
+class ChatServer:
+    def __init__(self, responder, idle_timeout=900, max_sessions=10_000,
+                 max_concurrent=64, max_waiting=256, sweep_interval=30):
+        self.responder = responder
+        self.sessions = SessionStore(idle_timeout, max_sessions)
+        self.max_concurrent = max_concurrent
+        self.max_waiting = max_waiting
+        self.sweep_interval = sweep_interval
+        self.gate = None
+        self.completed = 0
+
+    async def _answer(self, session, message):
+        """Yield the answer's chunks and record the turn once it is complete."""
+        if session.lock.locked():
+            raise SessionBusy()
+        # a free asyncio.Lock is taken without suspending, so no other request
+        # for this session can get in between the check and the acquire
+        async with session.lock:
+            async with self.gate:
+                parts = []
+                async for chunk in self.responder(session, message):
+                    parts.append(chunk)
+                    yield chunk
+                session.history.append((message, "".join(parts)))
+                session.touch()
+                self.completed += 1
+
+    def _session(self, request):
+        session = self.sessions.get(request.match_info["session_id"])
+        if session is None:
+            raise web.HTTPNotFound(text="unknown or expired session")
+        return session
+
+    # -- handlers ----------------------------------------------------------
+
+    async def create_session(self, request):
+        return web.json_response({"session_id": self.sessions.create().id})
+
+    async def delete_session(self, request):
+        if not self.sessions.delete(request.match_info["session_id"]):
+            raise web.HTTPNotFound()
+        return web.json_response({"deleted": True})
+
+    async def health(self, request):
+        return web.json_response({
+            "sessions": len(self.sessions), "evicted": self.sessions.evicted,
+            "active": self.gate.active, "waiting": self.gate.waiting,
+            "rejected": self.gate.rejected, "completed": self.completed})
+
+    async def post_message(self, request):
+        session = self._session(request)
+        message = (await request.json())["message"]
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream",
+                                               "Cache-Control": "no-cache"})
+        answer = self._answer(session, message)
+        try:
+            try:
+                first = await answer.__anext__()
+            except SessionBusy:
+                raise web.HTTPTooManyRequests(text="this session is still answering")
+            except Busy:
+                raise web.HTTPServiceUnavailable(text="server busy, retry later")
+            except StopAsyncIteration:
+                first = None
+            await response.prepare(request)
+            if first is not None:
+                await response.write(f"data: {json.dumps(first)}\n\n".encode())
+                async for chunk in answer:
+                    # write() waits for the transport to drain: a slow reader slows its own stream
+                    await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            await response.write(b"event: done\ndata: {}\n\n")
+            await response.write_eof()
+            return response
+        finally:
+            # release the gate and the session lock even if the client went away
+            await answer.aclose()
+
+    async def websocket(self, request):
+        session = self._session(request)
+        ws = web.WebSocketResponse(heartbeat=30)
+        await ws.prepare(request)
+        async for msg in ws:
+            if msg.type != WSMsgType.TEXT:
+                continue
+            message = json.loads(msg.data).get("message", "")
+            try:
+                async for chunk in self._answer(session, message):
+                    await ws.send_json({"type": "token", "text": chunk})
+                await ws.send_json({"type": "done"})
+            except SessionBusy:
+                await ws.send_json({"type": "error", "error": "session busy"})
+            except Busy:
+                await ws.send_json({"type": "error", "error": "busy"})
+            except Exception as e:
+                # a failed answer ends that message, not the connection
+                if ws.closed:
+                    break
+                await ws.send_json({"type": "error", "error": f"{type(e).__name__}: {e}"})
+        return ws
+
+    # -- lifecycle ---------------------------------------------------------
+
+    async def _sweeper(self, app):
+        async def sweep():
+            while True:
+                await asyncio.sleep(self.sweep_interval)
+                self.sessions.sweep()
+
+        self.gate = Gate(self.max_concurrent, self.max_waiting)
+        task = asyncio.create_task(sweep())
+        yield
+        task.cancel()
+
+    def app(self):
+        app = web.Application()
+        app.cleanup_ctx.append(self._sweeper)
+        app.add_routes([
+            web.post("/sessions", self.create_session),
+            web.delete("/sessions/{session_id}", self.delete_session),
+            web.post("/sessions/{session_id}/messages", self.post_message),
+            web.get("/sessions/{session_id}/ws", self.websocket),
+            web.get("/health", self.health),
+        ])
+        return app
+
+    def run(self, host="127.0.0.1", port=8080):
+        web.run_app(self.app(), host=host, port=port)
+
+
+# -- load testing ----------------------------------------------------------
+
+def _percentiles(values):
+    if not values:
+        return {}
+    values = sorted(values)
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))]
+    return {"p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99), "max": values[-1],
+            "mean": statistics.fmean(values)}
+
+
+async def load_test(base_url, users=200, turns=3, message="What are major topics for this class?"):
+    """Simulate `users` concurrent WebSocket users, each sending `turns` messages.
+
+    Returns counts plus time-to-first-token and full-answer latency percentiles (seconds).
+    """
+    ttft, latency, errors = [], [], []
+
+    async def user(http):
+        async with http.post(f"{base_url}/sessions") as r:
+            session_id = (await r.json())["session_id"]
+        async with http.ws_connect(f"{base_url}/sessions/{session_id}/ws") as ws:
+            for _ in range(turns):
+                start, first = time.perf_counter(), None
+                await ws.send_json({"message": message})
+                async for msg in ws:
+                    event = json.loads(msg.data)
+                    if event["type"] == "token" and first is None:
+                        first = time.perf_counter() - start
+                    elif event["type"] == "done":
+                        ttft.append(first or 0.0)
+                        latency.append(time.perf_counter() - start)
+                        break
+                    elif event["type"] == "error":
+                        errors.append(event["error"])
+                        break
+
+    start = time.perf_counter()
+    # the default connector allows only 100 connections, which would cap the test
+    async with ClientSession(connector=TCPConnector(limit=0)) as http:
+        results = await asyncio.gather(*(user(http) for _ in range(users)), return_exceptions=True)
+    errors += [repr(r) for r in results if isinstance(r, Exception)]
+    elapsed = time.perf_counter() - start
+    return {"users": users, "answers": len(latency), "errors": len(errors),
+            "elapsed_s": elapsed, "answers_per_s": len(latency) / elapsed,
+            "ttft_s": _percentiles(ttft), "latency_s": _percentiles(latency)}
+
+
+async def benchmark(users=300, turns=3, port=8089, ttft=0.3, token_delay=0.02, **server_kwargs):
+    """Run a `ChatServer` on `FakeChatModel` in-process and load-test it."""
+    class StaticRetriever:
+        async def aget_relevant_documents(self, query):
+            return [Document(page_content="Lecture notes about machine learning.", metadata={})]
+
+    responder = RetrievalChatResponder(FakeChatModel(ttft=ttft, token_delay=token_delay),
+                                       StaticRetriever())
+    server = ChatServer(responder, **server_kwargs)
+    runner = web.AppRunner(server.app())
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", port)
+    await site.start()
+    try:
+        return await load_test(f"http://127.0.0.1:{port}", users=users, turns=turns)
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chat server load test against a fake model")
+    parser.add_argument("command", choices=["benchmark", "loadtest"])
+    parser.add_argument("--url", default="http://127.0.0.1:8080")
+    parser.add_argument("--users", type=int, default=300)
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--max-concurrent", type=int, default=64)
+    args = parser.parse_args()
+    if args.command == "benchmark":
+        report = asyncio.run(benchmark(args.users, args.turns, max_concurrent=args.max_concurrent))
+    else:
+        report = asyncio.run(load_test(args.url, args.users, args.turns))
+    print(json.dumps(report, indent=2))
@@ -0,0 +1,475 @@
+# Delta-encoded, compressed SQLite checkpoints for LangGraph threads.
+#
+# `SqliteSaver` stores the whole state at every step. With a long message
+# history, every checkpoint repeats all the earlier messages. `get_next_version`
+# also md5-hashes a full serialization of every channel that was written, and
+# all of this happens while the graph waits. `DeltaSqliteSaver` is a drop-in
+# replacement:
+#
+#   * a checkpoint stores only what changed since its parent: the channels
+#     whose version moved and, for list channels such as `messages`, only
+#     the elements after the longest unchanged prefix. Every
+#     `snapshot_every` steps (and when the parent is unknown) the full state
+#     is stored instead, so rebuilding one reads at most that many rows;
+#   * values are serialized with the saver's `serde`, as in `SqliteSaver`,
+#     one list element at a time (never pickled, so loading a thread runs
+#     no code from the file), and each row is compressed with zstd
+#     (`pip install zstandard`), or zlib without it;
+#   * recently written or rebuilt states are kept encoded in an LRU, so a
+#     put normally diffs against its parent without reading the database,
+#     and walking `get_state_history` backwards reuses the rebuilt chain.
+#     States are decoded only when a checkpoint is requested, into fresh
+#     objects each time, so callers may modify what they get back;
+#   * channel versions are a counter plus a random suffix instead of a hash
+#     of the channel's content.
+#
+# Pending writes and metadata are stored as in `SqliteSaver` (the metadata
+# stays JSON, so `list(filter=...)` works unchanged). Nodes must return the
+# state they change: a channel mutated in place without a version bump is
+# not written again.
+#
+# For time travel, each row also keeps the step, source and writing node in
+# indexed columns:
+#
+#   * `history(config, cursor=..., limit=...)` pages through a thread as
+#     `HistoryEntry`s (config, step, source, node, next) without reading or
+#     decoding any state. `next` is taken from the checkpoints that ran
+#     from this one;
+#   * `find(config, step=..., node=...)` returns the config of a matching
+#     checkpoint in O(log n), ready for `graph.get_state` / `graph.invoke`.
+#     `node` matches any checkpoint the node wrote, also when other nodes
+#     wrote in the same step;
+#   * `list(filter={"step": ..., "source": ...})`, and with it
+#     `get_state_history`, use the same indexes.
+
+import asyncio
+import random
+import sqlite3
+import struct
+import threading
+import zlib
+from collections import OrderedDict, namedtuple
+from itertools import islice
+
+from langgraph.checkpoint.base import CheckpointTuple
+from langgraph.checkpoint.sqlite import SqliteSaver, search_where
+
+from llm_utils.messages import MessageLog
+
+
+HistoryEntry = namedtuple("HistoryEntry", "config parent_config step source node next")
+
+_INDEXED = ("step", "source")  # metadata keys `list(filter=...)` answers from indexes
+
+_zstd = None
+
+
+def _zstd_module():
+    global _zstd
+    if _zstd is None:
+        try:
+            import zstandard
+        except ImportError:
+            zstandard = False
+        _zstd = zstandard
+    return _zstd
+
+
+def _compress(data):
+    if len(data) < 64:
+        return b"0" + data
+    zstd = _zstd_module()
+    if zstd:
+        return b"Z" + zstd.ZstdCompressor(level=3).compress(data)
+    return b"z" + zlib.compress(data, 6)
+
+
+def _decompress(blob):
+    codec, data = blob[:1], blob[1:]
+    if codec == b"Z":
+        zstd = _zstd_module()
+        if not zstd:
+            raise RuntimeError("checkpoint was compressed with zstd: pip install zstandard")
+        return zstd.ZstdDecompressor().decompress(data)
+    if codec == b"z":
+        return zlib.decompress(data)
+    return data
+
+
+def _pack(parts):
+    """Length-prefixed concatenation of byte strings."""
+    return struct.pack(f"<I{len(parts)}I", len(parts), *map(len, parts)) + b"".join(parts)
+
+
+def _unpack(data):
+    (n,) = struct.unpack_from("<I", data)
+    parts, offset = [], 4 + 4 * n
+    for length in struct.unpack_from(f"<{n}I", data, 4):
+        parts.append(data[offset:offset + length])
+        offset += length
+    return parts
+
+
+def _encode(dumps, value):
+    # list channels are kept element by element so deltas can share a prefix
+    if type(value) is list or isinstance(value, MessageLog):
+        return ("list", tuple(dumps(v) for v in value))
+    return ("value", dumps(value))
+
+
+def _decode(loads, encoded):
+    kind, data = encoded
+    if kind == "list":
+        return [loads(b) for b in data]
+    return loads(data)
+
+
+def _diff(parent, values, versions, dumps):
+    """Encode `values` against the parent state: (all channels encoded, delta)."""
+    parent_channels = parent[2] if parent is not None else {}
+    parent_versions = parent[1]["channel_versions"] if parent is not None else {}
+    channels, delta = {}, {}
+    for name, value in values.items():
+        previous = parent_channels.get(name)
+        if previous is not None and versions.get(name) == parent_versions.get(name):
+            channels[name] = previous  # channel not written this step
+            continue
+        encoded = _encode(dumps, value)
+        if previous is not None and previous[0] == encoded[0] == "list":
+            old, new = previous[1], encoded[1]
+            k = 0
+            for a, b in zip(old, new):
+                if a != b:
+                    break
+                k += 1
+            if k == len(old) == len(new):
+                channels[name] = previous
+                continue
+            channels[name] = ("list", old[:k] + new[k:])
+            delta[name] = ("extend", k, new[k:])
+        elif previous is not None and previous == encoded:
+            channels[name] = previous
+        else:
+            channels[name] = delta[name] = encoded
+    for name in parent_channels:
+        if name not in values:
+            delta[name] = ("drop",)
+    return channels, delta
+
+
+def _writers(metadata):
+    """Names of the nodes that produced a checkpoint, from its metadata."""
+    source = metadata.get("source")
+    if source == "input":
+        return ("__input__",)
+    writes = metadata.get("writes") or {}
+    if writes:
+        return tuple(sorted(writes))
+    return ("__start__",) if source == "loop" else ()
+
+
+def _apply(channels, delta):
+    channels = dict(channels)
+    for name, op in delta.items():
+        if op[0] == "drop":
+            channels.pop(name, None)
+        elif op[0] == "extend":
+            channels[name] = ("list", channels[name][1][:op[1]] + op[2])
+        else:
+            channels[name] = op
+    return channels
+
+
+class DeltaSqliteSaver(SqliteSaver):
+    """`SqliteSaver` that stores per-step deltas with periodic full snapshots.
+
+    `DeltaSqliteSaver.from_conn_string(":memory:")` or
+    `DeltaSqliteSaver(sqlite3.connect(path, check_same_thread=False))`.
+    """
+
+    def __init__(self, conn, *, serde=None, snapshot_every=32, cache_size=256):
+        super().__init__(conn, serde=serde)
+        self.snapshot_every = snapshot_every
+        self.cache_size = cache_size
+        self._states = OrderedDict()  # (thread_id, thread_ts) -> (depth, header, channels)
+        self._states_lock = threading.Lock()
+
+    @classmethod
+    def from_conn_string(cls, conn_string, **kwargs):
+        return cls(sqlite3.connect(conn_string, check_same_thread=False), **kwargs)
+
+    def setup(self):
+        if self.is_setup:
+            return
+        super().setup()
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS delta_checkpoints (
+                thread_id TEXT NOT NULL,
+                thread_ts TEXT NOT NULL,
+                parent_ts TEXT,
+                depth INTEGER NOT NULL,
+                checkpoint BLOB,
+                metadata BLOB,
+                step INTEGER,
+                source TEXT,
+                node TEXT,
+                PRIMARY KEY (thread_id, thread_ts)
+            );
+            CREATE TABLE IF NOT EXISTS delta_checkpoint_writers (
+                thread_id TEXT NOT NULL,
+                node TEXT NOT NULL,
+                thread_ts TEXT NOT NULL,
+                PRIMARY KEY (thread_id, node, thread_ts)
+            );
+            CREATE INDEX IF NOT EXISTS delta_checkpoints_step ON delta_checkpoints (thread_id, step, thread_ts);
+            CREATE INDEX IF NOT EXISTS delta_checkpoints_parent ON delta_checkpoints (thread_id, parent_ts);
+            """
+        )
+
+    def _dump_row(self, header, body):
+        # the layout says how the element payloads that follow map to channels
+        layout, payloads = [], []
+        for name, op in body.items():
+            if op[0] == "list":
+                layout.append([name, "list", len(op[1])])
+                payloads.extend(op[1])
+            elif op[0] == "extend":
+                layout.append([name, "extend", op[1], len(op[2])])
+                payloads.extend(op[2])
+            elif op[0] == "value":
+                layout.append([name, "value"])
+                payloads.append(op[1])
+            else:
+                layout.append([name, "drop"])
+        return _compress(_pack([self.serde.dumps(header), self.serde.dumps(layout), *payloads]))
+
+    def _load_row(self, blob):
+        header, layout, *payloads = _unpack(_decompress(blob))
+        payloads, body = iter(payloads), {}
+        for name, kind, *args in self.serde.loads(layout):
+            if kind == "list":
+                body[name] = ("list", tuple(islice(payloads, args[0])))
+            elif kind == "extend":
+                body[name] = ("extend", args[0], tuple(islice(payloads, args[1])))
+            elif kind == "value":
+                body[name] = ("value", next(payloads))
+            else:
+                body[name] = ("drop",)
+        return self.serde.loads(header), body
+
+    def _remember(self, thread_id, thread_ts, state):
+        with self._states_lock:
+            self._states[(thread_id, thread_ts)] = state
+            self._states.move_to_end((thread_id, thread_ts))
+            while len(self._states) > self.cache_size:
+                self._states.popitem(last=False)
+
+    def _cached(self, thread_id, thread_ts):
+        with self._states_lock:
+            state = self._states.get((thread_id, thread_ts))
+            if state is not None:
+                self._states.move_to_end((thread_id, thread_ts))
+            return state
+
+    def _state(self, cur, thread_id, thread_ts):
+        """Encoded (depth, header, channels) of a checkpoint, rebuilt from its snapshot."""
+        chain, ts, state = [], thread_ts, None
+        while state is None:
+            state = self._cached(thread_id, ts)
+            if state is not None:
+                break
+            cur.execute(
+                "SELECT parent_ts, depth, checkpoint FROM delta_checkpoints WHERE thread_id = ? AND thread_ts = ?",
+                (thread_id, ts),
+            )
+            row = cur.fetchone()
+            if row is None:
+                return None
+            parent_ts, depth, blob = row
+            header, body = self._load_row(blob)
+            if depth == 0:
+                state = (0, header, body)
+                self._remember(thread_id, ts, state)
+            else:
+                chain.append((ts, depth, header, body))
+                ts = parent_ts
+        for ts, depth, header, body in reversed(chain):
+            state = (depth, header, _apply(state[2], body))
+            self._remember(thread_id, ts, state)
+        return state
+
+    def _tuple(self, cur, thread_id, thread_ts, parent_ts, metadata):
+        state = self._state(cur, thread_id, thread_ts)
+        checkpoint = dict(state[1])
+        checkpoint["channel_values"] = {name: _decode(self.serde.loads, v)
+                                        for name, v in state[2].items()}
+        cur.execute(
+            "SELECT task_id, channel, value FROM writes WHERE thread_id = ? AND thread_ts = ?",
+            (thread_id, thread_ts),
+        )
+        return CheckpointTuple(
+            {"configurable": {"thread_id": thread_id, "thread_ts": thread_ts}},
+            checkpoint,
+            self.serde.loads(metadata) if metadata is not None else {},
+            {"configurable": {"thread_id": thread_id, "thread_ts": parent_ts}} if parent_ts else None,
+            [(task_id, channel, self.serde.loads(value)) for task_id, channel, value in cur.fetchall()],
+        )
+
+    def get_tuple(self, config):
+        thread_id = str(config["configurable"]["thread_id"])
+        thread_ts = config["configurable"].get("thread_ts")
+        with self.cursor(transaction=False) as cur:
+            if thread_ts:
+                cur.execute(
+                    "SELECT thread_ts, parent_ts, metadata FROM delta_checkpoints WHERE thread_id = ? AND thread_ts = ?",
+                    (thread_id, str(thread_ts)),
+                )
+            else:
+                cur.execute(
+                    "SELECT thread_ts, parent_ts, metadata FROM delta_checkpoints WHERE thread_id = ? ORDER BY thread_ts DESC LIMIT 1",
+                    (thread_id,),
+                )
+            row = cur.fetchone()
+            if row is None:
+                return None
+            return self._tuple(cur, thread_id, *row)
+
+    def list(self, config, *, filter=None, before=None, limit=None):
+        filter = dict(filter or {})
+        indexed = {key: filter.pop(key) for key in _INDEXED if key in filter}
+        where, param_values = search_where(config, filter, before)
+        for key, value in indexed.items():
+            where += (" AND " if where else "WHERE ") + f"{key} = ?"
+            param_values.append(value)
+        query = f"""SELECT thread_id, thread_ts, parent_ts, metadata
+        FROM delta_checkpoints
+        {where}
+        ORDER BY thread_ts DESC"""
+        if limit:
+            query += f" LIMIT {int(limit)}"
+        with self.cursor(transaction=False) as cur:
+            rows = cur.execute(query, param_values)
+            with self.cursor(transaction=False) as state_cur:
+                for thread_id, thread_ts, parent_ts, metadata in rows:
+                    yield self._tuple(state_cur, thread_id, thread_ts, parent_ts, metadata)
+
+    def put(self, config, checkpoint, metadata, new_versions=None):
+        thread_id = str(config["configurable"]["thread_id"])
+        parent_ts = config["configurable"].get("thread_ts")
+        header = {k: v for k, v in checkpoint.items() if k != "channel_values"}
+        with self.lock, self.cursor() as cur:
+            parent = self._state(cur, thread_id, parent_ts) if parent_ts else None
+            channels, delta = _diff(parent, checkpoint["channel_values"], header["channel_versions"],
+                                    self.serde.dumps)
+            if parent is None or parent[0] + 1 >= self.snapshot_every:
+                depth, body = 0, channels
+            else:
+                depth, body = parent[0] + 1, delta
+            writers = _writers(metadata)
+            cur.execute(
+                "INSERT OR REPLACE INTO delta_checkpoints (thread_id, thread_ts, parent_ts, depth, checkpoint, metadata, step, source, node) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (thread_id, checkpoint["id"], parent_ts, depth,
+                 self._dump_row(header, body), self.serde.dumps(metadata),
+                 metadata.get("step"), metadata.get("source"), ",".join(writers) or None),
+            )
+            cur.executemany(
+                "INSERT OR IGNORE INTO delta_checkpoint_writers (thread_id, node, thread_ts) VALUES (?, ?, ?)",
+                [(thread_id, node, checkpoint["id"]) for node in writers],
+            )
+        self._remember(thread_id, checkpoint["id"], (depth, header, channels))
+        return {"configurable": {"thread_id": config["configurable"]["thread_id"],
+                                 "thread_ts": checkpoint["id"]}}
+
+    def history(self, config, *, cursor=None, limit=20, step=None, node=None, source=None,
+                oldest_first=False):
+        """One page of a thread's checkpoints as `HistoryEntry`s, without loading any state.
+
+        Returns `(entries, cursor)`: pass `cursor` back for the next page; it
+        is None after the last one, and `limit=None` returns every match.
+        `node` matches checkpoints the node wrote, alone or with others.
+        `next` lists the nodes that ran from a checkpoint, and is None when
+        none has run from it yet (use `graph.get_state(entry.config).next`
+        there).
+        """
+        thread_id = str(config["configurable"]["thread_id"])
+        tables, wheres, params = "delta_checkpoints c", ["c.thread_id = ?"], [thread_id]
+        ts = "c.thread_ts"
+        if node is not None:
+            # walk the node's own index in thread_ts order
+            tables = ("delta_checkpoint_writers w JOIN delta_checkpoints c"
+                      " ON c.thread_id = w.thread_id AND c.thread_ts = w.thread_ts")
+            wheres, params = ["w.thread_id = ?", "w.node = ?"], [thread_id, node]
+            ts = "w.thread_ts"
+        for column, value in (("step", step), ("source", source)):
+            if value is not None:
+                wheres.append(f"c.{column} = ?")
+                params.append(value)
+        if cursor is not None:
+            wheres.append(f"{ts} > ?" if oldest_first else f"{ts} < ?")
+            params.append(cursor)
+        order = "ASC" if oldest_first else "DESC"
+        with self.cursor(transaction=False) as cur:
+            rows = cur.execute(
+                f"SELECT c.thread_ts, c.parent_ts, c.step, c.source, c.node FROM {tables} WHERE {' AND '.join(wheres)} ORDER BY {ts} {order} LIMIT ?",
+                (*params, -1 if limit is None else limit + 1),  # LIMIT -1: no limit
+            ).fetchall()
+            more = limit is not None and len(rows) > limit
+            rows = rows[:limit]
+            ran = {}
+            # batches stay under SQLite's bound-parameter limit
+            for start in range(0, len(rows), 500):
+                batch = [row[0] for row in rows[start:start + 500]]
+                marks = ",".join("?" * len(batch))
+                cur.execute(
+                    f"SELECT parent_ts, node FROM delta_checkpoints WHERE thread_id = ? AND source = 'loop' AND parent_ts IN ({marks}) ORDER BY thread_ts",
+                    (thread_id, *batch),
+                )
+                for parent_ts, child_node in cur.fetchall():
+                    ran.setdefault(parent_ts, {}).update(dict.fromkeys(child_node.split(",")))
+        thread = config["configurable"]["thread_id"]
+        entries = [
+            HistoryEntry(
+                {"configurable": {"thread_id": thread, "thread_ts": thread_ts}},
+                {"configurable": {"thread_id": thread, "thread_ts": parent_ts}} if parent_ts else None,
+                row_step, row_source, row_node,
+                tuple(ran[thread_ts]) if thread_ts in ran else None,
+            )
+            for thread_ts, parent_ts, row_step, row_source, row_node in rows
+        ]
+        return entries, (rows[-1][0] if more else None)
+
+    def find(self, config, *, step=None, node=None, oldest=False):
+        """Config of the latest (or `oldest`) checkpoint at `step` and/or written by `node`."""
+        entries, _ = self.history(config, limit=1, step=step, node=node, oldest_first=oldest)
+        return entries[0].config if entries else None
+
+    def get_next_version(self, current, channel):
+        current_v = 0 if current is None else int(current.split(".")[0])
+        return f"{current_v + 1:032}.{random.random():016}"
+
+    def storage_stats(self):
+        """Row counts and stored bytes of the checkpoint table."""
+        with self.cursor(transaction=False) as cur:
+            rows, snapshots, payload, metadata = cur.execute(
+                "SELECT COUNT(*), SUM(depth = 0), SUM(LENGTH(checkpoint)), SUM(LENGTH(metadata)) FROM delta_checkpoints"
+            ).fetchone()
+        return {"checkpoints": rows, "snapshots": snapshots or 0,
+                "checkpoint_bytes": payload or 0, "metadata_bytes": metadata or 0}
+
+    # async graphs (`astream_events`): run the sqlite calls in a worker thread
+
+    async def aget_tuple(self, config):
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(self, config, *, filter=None, before=None, limit=None):
+        items = await asyncio.to_thread(
+            lambda: [*self.list(config, filter=filter, before=before, limit=limit)])
+        for item in items:
+            yield item
+
+    async def aput(self, config, checkpoint, metadata, new_versions=None):
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata)
+
+    async def aput_writes(self, config, writes, task_id):
+        return await asyncio.to_thread(self.put_writes, config, writes, task_id)
@@ -0,0 +1,189 @@
+# Chat-completion helpers shared by the Prompt_Engineering and Bases notebooks.
+#
+# `get_completion` / `get_completion_from_messages` keep the signatures the
+# notebooks always used. `get_completions` runs a whole list of prompts on a
+# bounded thread pool (threads rather than asyncio, so it also works inside a
+# Jupyter kernel that already owns an event loop), throttled by a token bucket
+# and retried with jittered exponential backoff. Results come back in the
+# same order as the prompts. `stream_completion_from_messages` yields an
+# answer's text as it is generated, for the chat UIs.
+
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import openai
+
+
+DEFAULT_MODEL = "gpt-3.5-turbo"
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second, bursts up to `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def acquire(self, tokens=1):
+        # a request bigger than the bucket would wait forever, so cap it
+        tokens = min(float(tokens), self.capacity)
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def _retryable_errors():
+    # openai 0.27 keeps its exceptions in `openai.error`
+    error = getattr(openai, "error", None)
+    if error is None:
+        return (ConnectionError, TimeoutError)
+    return (
+        error.RateLimitError,
+        error.APIError,
+        error.Timeout,
+        error.ServiceUnavailableError,
+        error.APIConnectionError,
+    )
+
+
+def with_retries(fn, max_retries=6, base_delay=1.0, max_delay=60.0, retry_on=None):
+    """Call `fn()` and retry transient failures with full-jitter exponential backoff."""
+    retry_on = retry_on or _retryable_errors()
+    for attempt in range(max_retries + 1):
+        try:
+            return fn()
+        except retry_on:
+            if attempt == max_retries:
+                raise
+            time.sleep(random.uniform(0, min(max_delay, base_delay * 2 ** attempt)))
+
+
+def _estimate_tokens(messages):
+    # rough 4-characters-per-token estimate, only used for throttling
+    return sum(len(m.get("content") or "") for m in messages) // 4 + 1
+
+
+# Set by `llm_utils.cache.enable_cache()`; temperature=0 calls are then
+# answered from disk when the exact same request was made before.
+response_cache = None
+
+
+def _cache_lookup(model, messages, temperature, kwargs):
+    if response_cache is None or temperature != 0:
+        return None, None
+    from llm_utils.cache import response_key
+
+    key = response_key(model, messages, temperature, **kwargs)
+    return key, response_cache.get(key)
+
+
+def _create(messages, model, temperature, cache_key=None, **kwargs):
+    response = openai.ChatCompletion.create(
+        model=model,
+        messages=messages,
+        temperature=temperature, # this is the degree of randomness of the model's output
+        **kwargs,
+    )
+    content = response.choices[0].message["content"]
+    if cache_key is not None and content is not None:
+        response_cache.set(cache_key, content)
+    return content
+
+
+def get_completion_from_messages(messages, model=DEFAULT_MODEL, temperature=0, **kwargs):
+    key, cached = _cache_lookup(model, messages, temperature, kwargs)
+    if cached is not None:
+        return cached
+    return with_retries(lambda: _create(messages, model, temperature, cache_key=key, **kwargs))
+
+
+def stream_completion_from_messages(messages, model=DEFAULT_MODEL, temperature=0, **kwargs):
+    """Yield the completion's text as it arrives, one delta at a time.
+
+    Only opening the stream is retried. Closing the generator early (e.g. a
+    cancelled `llm_utils.streaming` answer) closes the HTTP stream.
+    """
+    key, cached = _cache_lookup(model, messages, temperature, kwargs)
+    if cached is not None:
+        yield cached
+        return
+    response = with_retries(lambda: openai.ChatCompletion.create(
+        model=model, messages=messages, temperature=temperature, stream=True, **kwargs))
+    parts = []
+    try:
+        for chunk in response:
+            delta = chunk.choices[0].delta.get("content")
+            if delta:
+                parts.append(delta)
+                yield delta
+    finally:
+        close = getattr(response, "close", None)
+        if close is not None:
+            close()
+    if key is not None:
+        response_cache.set(key, "".join(parts))
+
+
+def get_completion(prompt, model=DEFAULT_MODEL, temperature=0, **kwargs):
+    messages = [{"role": "user", "content": prompt}]
+    return get_completion_from_messages(messages, model=model, temperature=temperature, **kwargs)
+
+
+def get_completions(prompts, model=DEFAULT_MODEL, temperature=0, max_workers=16,
+                    requests_per_minute=3500, tokens_per_minute=None,
+                    return_exceptions=False, **kwargs):
+    """Complete many prompts concurrently and return the answers in input order.
+
+    Each item of `prompts` is either a prompt string or a list of chat messages.
+    `requests_per_minute` / `tokens_per_minute` should match the account's
+    rate limits; the pool never has more than `max_workers` calls in flight.
+    With `return_exceptions=True` a prompt that still fails after its retries
+    yields the exception in its slot instead of aborting the whole batch.
+    """
+    requests = TokenBucket(requests_per_minute / 60.0, capacity=max(1, max_workers))
+    tokens = None
+    if tokens_per_minute:
+        tokens = TokenBucket(tokens_per_minute / 60.0, capacity=tokens_per_minute / 6.0)
+
+    def run(prompt):
+        if isinstance(prompt, str):
+            messages = [{"role": "user", "content": prompt}]
+        else:
+            messages = prompt
+
+        # cache hits don't spend rate-limit budget
+        key, cached = _cache_lookup(model, messages, temperature, kwargs)
+        if cached is not None:
+            return cached
+
+        def call():
+            requests.acquire()
+            if tokens is not None:
+                tokens.acquire(_estimate_tokens(messages))
+            return _create(messages, model, temperature, cache_key=key, **kwargs)
+
+        try:
+            return with_retries(call)
+        except Exception as e:
+            if return_exceptions:
+                return e
+            raise
+
+    prompts = list(prompts)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(run, prompts))
@@ -0,0 +1,154 @@
+# Contextual compression without an LLM call per document.
+#
+# `LLMChainExtractor` asks the LLM to extract the relevant part of every
+# retrieved chunk, one call after another. `EmbeddingCompressor` instead
+# splits the chunks into sentences, embeds them (one batched request, cached
+# by `CachedEmbeddings`), scores all of them against the query with a single
+# matrix product and keeps the best sentences that fit in a token budget, in
+# their original order.
+#
+# `HybridCompressor` uses those scores to triage: clearly relevant documents
+# are compressed by embeddings, clearly irrelevant ones are dropped, and only
+# the borderline ones go to the LLM extractor, concurrently.
+
+import asyncio
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+import numpy as np
+
+from llm_utils.tokens import count_tokens
+from llm_utils.vectorstore import normalize_rows
+
+try:
+    from langchain_core.documents import Document
+    from langchain_core.documents.compressor import BaseDocumentCompressor
+except ImportError:
+    from langchain.schema import Document
+    from langchain.retrievers.document_compressors.base import BaseDocumentCompressor
+
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+(?=[\"'(\[]?[A-Z0-9])|\n\s*\n")
+
+
+def split_sentences(text, min_chars=20):
+    """Split `text` into sentences; fragments shorter than `min_chars` join the previous one."""
+    sentences = []
+    for part in _SENTENCE_END.split(text):
+        part = " ".join(part.split())
+        if not part:
+            continue
+        if sentences and len(part) < min_chars:
+            sentences[-1] = f"{sentences[-1]} {part}"
+        else:
+            sentences.append(part)
+    return sentences
+
+
+class EmbeddingCompressor(BaseDocumentCompressor):
+    """Keep the sentences most similar to the query, up to `token_budget` tokens in total.
+
+    Sentences scoring below `similarity_threshold` are never kept; documents
+    left with no sentences are dropped.
+    """
+
+    embeddings: Any
+    token_budget: int = 1000
+    similarity_threshold: float = 0.0
+    min_sentence_chars: int = 20
+    model: str = "gpt-3.5-turbo"
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def score(self, documents, query):
+        """Split `documents` into sentences and score them against `query`.
+
+        Returns `(sentences, scores)`: one list of sentences and one array of
+        cosine similarities per document.
+        """
+        sentences = [split_sentences(d.page_content, self.min_sentence_chars) for d in documents]
+        flat = [s for doc_sentences in sentences for s in doc_sentences]
+        if not flat:
+            return sentences, [np.empty(0, dtype=np.float32) for _ in documents]
+        vectors = normalize_rows(self.embeddings.embed_documents(flat))
+        query_vector = normalize_rows(self.embeddings.embed_query(query))[0]
+        flat_scores = vectors @ query_vector
+        bounds = np.cumsum([0] + [len(s) for s in sentences])
+        return sentences, [flat_scores[a:b] for a, b in zip(bounds[:-1], bounds[1:])]
+
+    def select(self, documents, sentences, scores):
+        """Greedily keep the highest-scoring sentences across `documents` within the budget.
+
+        Returns one compressed document per input, or None where nothing was kept.
+        """
+        candidates = [(float(score), d, i) for d, doc_scores in enumerate(scores)
+                      for i, score in enumerate(doc_scores) if score >= self.similarity_threshold]
+        candidates.sort(key=lambda c: -c[0])
+        kept, used = [set() for _ in documents], 0
+        for _, d, i in candidates:
+            tokens = count_tokens(sentences[d][i], self.model)
+            if used + tokens > self.token_budget:
+                continue
+            kept[d].add(i)
+            used += tokens
+        return [Document(page_content=" ".join(doc_sentences[i] for i in sorted(keep)),
+                         metadata=dict(doc.metadata)) if keep else None
+                for doc, doc_sentences, keep in zip(documents, sentences, kept)]
+
+    def compress_documents(self, documents, query, callbacks=None):
+        documents = list(documents)
+        sentences, scores = self.score(documents, query)
+        return [doc for doc in self.select(documents, sentences, scores) if doc is not None]
+
+    async def acompress_documents(self, documents, query, callbacks=None):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.compress_documents, documents, query)
+
+
+class HybridCompressor(BaseDocumentCompressor):
+    """Embedding compression with an LLM extractor for the borderline documents.
+
+    A document's relevance is its best sentence score. Documents at or above
+    `high` are compressed by `embedding_compressor`, those below `low` are
+    dropped, and the rest are sent to `llm_compressor` (e.g. an
+    `LLMChainExtractor`) in parallel, `max_workers` at a time. Output keeps the
+    retrieval order.
+    """
+
+    embedding_compressor: Any
+    llm_compressor: Any
+    low: float = 0.75
+    high: float = 0.85
+    max_workers: int = 8
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def compress_documents(self, documents, query, callbacks=None):
+        documents = list(documents)
+        sentences, scores = self.embedding_compressor.score(documents, query)
+        relevance = [float(s.max()) if len(s) else -1.0 for s in scores]
+
+        confident = [d for d, r in enumerate(relevance) if r >= self.high]
+        borderline = [d for d, r in enumerate(relevance) if self.low <= r < self.high]
+
+        compressed = self.embedding_compressor.select(
+            [documents[d] for d in confident], [sentences[d] for d in confident],
+            [scores[d] for d in confident])
+        results = {d: [doc] for d, doc in zip(confident, compressed)}
+
+        def extract(d):
+            return self.llm_compressor.compress_documents([documents[d]], query, callbacks=callbacks)
+
+        if borderline:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(borderline))) as pool:
+                for d, extracted in zip(borderline, pool.map(extract, borderline)):
+                    results[d] = extracted
+
+        return [doc for d in sorted(results) for doc in results[d] if doc is not None]
+
+    async def acompress_documents(self, documents, query, callbacks=None):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.compress_documents, documents, query, callbacks)
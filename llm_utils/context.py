@@ -0,0 +1,117 @@
+# Token-budgeted context packing for "stuff" chains.
+#
+# A "stuff" chain pastes every retrieved chunk into the prompt. With a large
+# k that wastes tokens, and it can overflow the model's context window.
+# `pack_documents` prepares the chunks first:
+#
+#   1. keeps them in relevance order (retriever order, or by score when given);
+#   2. trims text shared with chunks already kept: neighbouring chunks from a
+#      splitter with `chunk_overlap` repeat up to that many characters, and a
+#      chunk contained in another one is dropped;
+#   3. adds chunks until `max_tokens` is reached, cutting the last one down to
+#      the tokens that are left.
+#
+# Tokens are counted with the cached tokenizer in `llm_utils.tokens`.
+# `PackedRetriever` applies this to any retriever, so `RetrievalQA` and
+# `ConversationalRetrievalChain` get the packed chunks without other changes.
+
+from typing import Any
+
+from llm_utils.tokens import count_tokens, truncate_tokens
+
+try:
+    from langchain_core.documents import Document
+    from langchain_core.retrievers import BaseRetriever
+except ImportError:
+    from langchain.schema import BaseRetriever, Document
+
+
+def _overlap(left, right, min_overlap, max_overlap):
+    """Length of the longest suffix of `left` that is also a prefix of `right`."""
+    longest = min(len(left), len(right), max_overlap)
+    probe = right[:min_overlap]
+    start = left.find(probe, len(left) - longest) if len(probe) == min_overlap else -1
+    while start != -1:
+        if right.startswith(left[start:]):
+            return len(left) - start
+        start = left.find(probe, start + 1)
+    return 0
+
+
+def remove_overlap(text, kept, min_overlap=20, max_overlap=1000):
+    """`text` without the parts already present in the `kept` texts ("" if it is contained in one)."""
+    for other in kept:
+        if text in other:
+            return ""
+    for other in kept:
+        # `other` came just before `text` in the source: drop the shared head
+        cut = _overlap(other, text, min_overlap, max_overlap)
+        if cut:
+            text = text[cut:]
+        # `other` came just after `text`: drop the shared tail
+        cut = _overlap(text, other, min_overlap, max_overlap)
+        if cut:
+            text = text[:-cut]
+    return text.strip()
+
+
+def pack_documents(documents, max_tokens=3000, model="gpt-3.5-turbo", scores=None,
+                   min_overlap=20, max_overlap=1000, min_tail_tokens=50, separator_tokens=2):
+    """Deduplicated, relevance-ordered documents totalling at most `max_tokens` tokens.
+
+    `scores`, if given, are relevance scores (higher is better) parallel to
+    `documents`. A document that no longer fits is truncated when at least
+    `min_tail_tokens` tokens are left, otherwise packing stops.
+    """
+    documents = list(documents)
+    if scores is not None:
+        order = sorted(range(len(documents)), key=lambda i: -scores[i])
+        documents = [documents[i] for i in order]
+
+    packed, kept, used = [], [], 0
+    for doc in documents:
+        text = remove_overlap(doc.page_content, kept, min_overlap, max_overlap)
+        if not text:
+            continue
+        remaining = max_tokens - used - separator_tokens
+        tokens = count_tokens(text, model)
+        if tokens > remaining:
+            if remaining < min_tail_tokens:
+                break
+            text = truncate_tokens(text, remaining, model)
+            tokens = remaining
+        kept.append(doc.page_content)
+        packed.append(Document(page_content=text, metadata=dict(doc.metadata)))
+        used += tokens + separator_tokens
+        if used >= max_tokens:
+            break
+    return packed
+
+
+def pack_context(documents, max_tokens=3000, model="gpt-3.5-turbo", separator="\n\n", **kwargs):
+    """`pack_documents` joined into one context string."""
+    return separator.join(d.page_content for d in pack_documents(documents, max_tokens, model, **kwargs))
+
+
+class PackedRetriever(BaseRetriever):
+    """Wraps `retriever` and packs its results into `max_tokens` tokens.
+
+    Retrieve generously (a large k) and let the budget decide how much of it
+    reaches the prompt.
+    """
+
+    retriever: Any
+    max_tokens: int = 3000
+    model: str = "gpt-3.5-turbo"
+    min_overlap: int = 20
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        documents = self.retriever.get_relevant_documents(query)
+        return pack_documents(documents, self.max_tokens, self.model, min_overlap=self.min_overlap)
+
+    async def _aget_relevant_documents(self, query, *, run_manager=None):
+        documents = await self.retriever.aget_relevant_documents(query)
+        return pack_documents(documents, self.max_tokens, self.model, min_overlap=self.min_overlap)
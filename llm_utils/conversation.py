@@ -0,0 +1,181 @@
+# Cheaper question condensing for `ConversationalRetrievalChain`.
+#
+# Before retrieving, the chain asks the LLM to rewrite every follow-up into a
+# standalone question. `FastConversationalRetrievalChain` avoids that round
+# trip whenever it can:
+#
+#   * no history, or a question with no anaphora ("it", "those", "why?" ...)
+#     is already standalone, so it is used as is;
+#   * rewrites are cached per (digest of the history, question);
+#   * with `speculative_retrieval`, retrieval for the raw question starts
+#     while the rewrite is in flight; when the rewrite comes back unchanged
+#     its documents are used directly. Otherwise the speculative retrieval
+#     is cancelled if it has not started, and at most
+#     `MAX_SPECULATIVE` run at once, so under load they cannot crowd out
+#     the retrievals that are needed.
+
+import hashlib
+import inspect
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+from langchain.chains import ConversationalRetrievalChain
+from langchain.chains.conversational_retrieval.base import _get_chat_history
+
+try:
+    from langchain_core.callbacks import CallbackManagerForChainRun
+except ImportError:
+    from langchain.callbacks.manager import CallbackManagerForChainRun
+
+
+_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="condense")
+
+MAX_SPECULATIVE = 4
+_speculative_slots = threading.BoundedSemaphore(MAX_SPECULATIVE)
+_stats_lock = threading.Lock()
+
+# words that point back at earlier turns, and openings of elliptical follow-ups
+_ANAPHORA = re.compile(
+    r"\b(it|its|it's|they|them|their|theirs|this|that|these|those|he|him|his|she|her|hers|"
+    r"former|latter|above|aforementioned|previous|same|such|there|then|else|again|"
+    r"another|other|others|one|ones|more|also)\b"
+    r"|^\s*(and|but|or|so|also|why|how come|what about|how about|what else)\b",
+    re.IGNORECASE)
+
+
+def needs_context(question):
+    """True if `question` probably refers to earlier turns."""
+    return bool(_ANAPHORA.search(question))
+
+
+def _normalize(question):
+    return " ".join(question.lower().split()).rstrip("?!. ")
+
+
+class RephraseCache:
+    """Thread-safe LRU of (chat history, question) -> standalone question."""
+
+    def __init__(self, maxsize=10_000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(chat_history, question):
+        digest = hashlib.sha256(chat_history.encode("utf-8")).hexdigest()
+        return f"{digest}\x00{_normalize(question)}"
+
+    def get(self, chat_history, question):
+        key = self.key(chat_history, question)
+        with self._lock:
+            standalone = self._entries.get(key)
+            if standalone is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return standalone
+
+    def set(self, chat_history, question, standalone):
+        key = self.key(chat_history, question)
+        with self._lock:
+            self._entries[key] = standalone
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+class FastConversationalRetrievalChain(ConversationalRetrievalChain):
+    """`ConversationalRetrievalChain` that only condenses questions when it has to.
+
+    Build it with `from_llm(..., rephrase_cache=RephraseCache(),
+    speculative_retrieval=True)`. `stats` counts how each turn's standalone
+    question was obtained ("first_turn", "standalone", "cached", "llm") and
+    how often a speculative retrieval was used or skipped.
+    """
+
+    rephrase_cache: Any = None
+    detect_anaphora: bool = True
+    speculative_retrieval: bool = False
+    stats: dict = {}
+
+    def _count(self, what):
+        with _stats_lock:
+            self.stats[what] = self.stats.get(what, 0) + 1
+
+    def _speculate(self, question, inputs, run_manager):
+        """Start retrieving for the raw question, or None if enough already are."""
+        if not _speculative_slots.acquire(blocking=False):
+            self._count("speculative_skipped")
+            return None
+        future = _pool.submit(self._retrieve, question, inputs, run_manager)
+        future.add_done_callback(lambda _: _speculative_slots.release())
+        return future
+
+    def _retrieve(self, question, inputs, run_manager):
+        if "run_manager" in inspect.signature(self._get_docs).parameters:
+            return self._get_docs(question, inputs, run_manager=run_manager)
+        return self._get_docs(question, inputs)
+
+    def _known_standalone(self, question, chat_history_str):
+        """The standalone question if it is known without the LLM, else None."""
+        if not chat_history_str:
+            self._count("first_turn")
+            return question
+        if self.detect_anaphora and not needs_context(question):
+            self._count("standalone")
+            return question
+        if self.rephrase_cache is not None:
+            cached = self.rephrase_cache.get(chat_history_str, question)
+            if cached is not None:
+                self._count("cached")
+                return cached
+        return None
+
+    def _call(self, inputs, run_manager=None):
+        _run_manager = run_manager or CallbackManagerForChainRun.get_noop_manager()
+        question = inputs["question"]
+        get_chat_history = self.get_chat_history or _get_chat_history
+        chat_history_str = get_chat_history(inputs["chat_history"])
+
+        new_question = self._known_standalone(question, chat_history_str)
+        if new_question is not None:
+            docs = self._retrieve(new_question, inputs, _run_manager)
+        else:
+            self._count("llm")
+            speculative = None
+            if self.speculative_retrieval:
+                speculative = self._speculate(question, inputs, _run_manager)
+            new_question = self.question_generator.run(
+                question=question, chat_history=chat_history_str,
+                callbacks=_run_manager.get_child())
+            if self.rephrase_cache is not None:
+                self.rephrase_cache.set(chat_history_str, question, new_question)
+            if speculative is not None and _normalize(new_question) == _normalize(question):
+                self._count("speculative_hit")
+                docs = speculative.result()
+            else:
+                if speculative is not None:
+                    speculative.cancel()  # no-op if it is already running
+                docs = self._retrieve(new_question, inputs, _run_manager)
+
+        output = {}
+        if getattr(self, "response_if_no_docs_found", None) is not None and len(docs) == 0:
+            output[self.output_key] = self.response_if_no_docs_found
+        else:
+            new_inputs = inputs.copy()
+            if getattr(self, "rephrase_question", True):
+                new_inputs["question"] = new_question
+            new_inputs["chat_history"] = chat_history_str
+            output[self.output_key] = self.combine_docs_chain.run(
+                input_documents=docs, callbacks=_run_manager.get_child(), **new_inputs)
+        if self.return_source_documents:
+            output["source_documents"] = docs
+        if self.return_generated_question:
+            output["generated_question"] = new_question
+        return output
@@ -0,0 +1,141 @@
+# Exact and near-duplicate chunk elimination before embedding.
+#
+# Exact duplicates are found by hashing whitespace-normalized chunk text.
+# Near duplicates are found with MinHash signatures over word shingles,
+# bucketed with LSH banding so only chunks sharing a band are compared.
+# Dropped chunks are not forgotten: `DedupResult.provenance` maps every kept
+# chunk to the metadata of the chunks folded into it.
+
+import hashlib
+import re
+import zlib
+from collections import defaultdict
+from dataclasses import dataclass, field
+
+import numpy as np
+
+
+_MERSENNE = np.uint64((1 << 31) - 1)
+_WS = re.compile(r"\s+")
+
+
+def normalize(text):
+    return _WS.sub(" ", text).strip().lower()
+
+
+def text_hash(text):
+    return hashlib.sha256(normalize(text).encode("utf-8")).hexdigest()
+
+
+def _shingles(text, size):
+    words = normalize(text).split(" ")
+    if len(words) <= size:
+        grams = [" ".join(words)]
+    else:
+        grams = [" ".join(words[i:i + size]) for i in range(len(words) - size + 1)]
+    return np.fromiter((zlib.crc32(g.encode("utf-8")) for g in set(grams)),
+                       dtype=np.uint64)
+
+
+class MinHasher:
+    """MinHash signatures with `num_perm` universal hash functions (a*x + b) mod p."""
+
+    def __init__(self, num_perm=128, shingle_size=5, seed=1):
+        rng = np.random.RandomState(seed)
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.a = rng.randint(1, int(_MERSENNE), size=num_perm).astype(np.uint64)
+        self.b = rng.randint(0, int(_MERSENNE), size=num_perm).astype(np.uint64)
+
+    def signature(self, text):
+        x = _shingles(text, self.shingle_size) % _MERSENNE
+        # (num_shingles, num_perm); every product stays below 2**62
+        hashed = (np.outer(x, self.a) + self.b) % _MERSENNE
+        return hashed.min(axis=0)
+
+
+def _lsh_params(num_perm, threshold):
+    # pick the banding whose S-curve midpoint (1/b)**(1/r) is closest to the threshold
+    best = None
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        error = abs((1.0 / bands) ** (1.0 / rows) - threshold)
+        if best is None or error < best[0]:
+            best = (error, bands, rows)
+    return best[1], best[2]
+
+
+@dataclass
+class DedupResult:
+    documents: list
+    # index into `documents` -> [{"metadata": ..., "kind": "exact"|"near", "similarity": float}]
+    provenance: dict = field(default_factory=dict)
+    exact_dropped: int = 0
+    near_dropped: int = 0
+
+    def sources(self, i):
+        """Metadata of the kept chunk `i` followed by that of every chunk merged into it."""
+        return [self.documents[i].metadata] + [d["metadata"] for d in self.provenance.get(i, [])]
+
+    def __repr__(self):
+        return (f"DedupResult(kept={len(self.documents)}, exact_dropped={self.exact_dropped}, "
+                f"near_dropped={self.near_dropped})")
+
+
+def dedup_documents(docs, near=True, threshold=0.85, num_perm=128, shingle_size=5):
+    """Drop exact and (optionally) near-duplicate chunks, keeping the first occurrence.
+
+    `threshold` is the estimated Jaccard similarity of word shingles above
+    which two chunks count as near duplicates.
+    """
+    kept, provenance = [], defaultdict(list)
+    seen = {}
+    exact_dropped = 0
+    for doc in docs:
+        h = text_hash(doc.page_content)
+        if h in seen:
+            provenance[seen[h]].append({"metadata": doc.metadata, "kind": "exact", "similarity": 1.0})
+            exact_dropped += 1
+            continue
+        seen[h] = len(kept)
+        kept.append(doc)
+
+    near_dropped = 0
+    if near and len(kept) > 1:
+        hasher = MinHasher(num_perm=num_perm, shingle_size=shingle_size)
+        bands, rows = _lsh_params(num_perm, threshold)
+        signatures = np.stack([hasher.signature(d.page_content) for d in kept])
+        buckets = defaultdict(list)
+        survivors, merged_into = [], {}
+        for i, sig in enumerate(signatures):
+            keys = [(band, sig[band * rows:(band + 1) * rows].tobytes()) for band in range(bands)]
+            candidates = {j for key in keys for j in buckets.get(key, ())}
+            match, best = None, threshold
+            for j in candidates:
+                similarity = float(np.mean(signatures[j] == sig))
+                if similarity >= best:
+                    match, best = j, similarity
+            if match is not None:
+                merged_into[i] = (match, best)
+                near_dropped += 1
+                continue
+            survivors.append(i)
+            for key in keys:
+                buckets[key].append(i)
+
+        position = {old: new for new, old in enumerate(survivors)}
+        new_provenance = defaultdict(list)
+        for old, entries in provenance.items():
+            if old in position:
+                new_provenance[position[old]].extend(entries)
+        for old, (target, similarity) in merged_into.items():
+            entries = new_provenance[position[target]]
+            entries.append({"metadata": kept[old].metadata, "kind": "near", "similarity": similarity})
+            # exact duplicates of a near-duplicate follow it to the kept chunk
+            entries.extend(provenance.get(old, []))
+        kept = [kept[i] for i in survivors]
+        provenance = new_provenance
+
+    return DedupResult(kept, dict(provenance), exact_dropped, near_dropped)
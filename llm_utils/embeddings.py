@@ -0,0 +1,243 @@
+# Embedding cache shared by every vector store in the notebooks.
+#
+# Vectors are appended to one float32 file per model dimension and read back
+# through `np.memmap`; a small SQLite table maps (model, sha256(text)) to the
+# row holding its vector. `CachedEmbeddings` wraps any LangChain embeddings
+# object, so Chroma, DocArrayInMemorySearch and SVMRetriever all reuse the
+# same stored vectors and a rebuilt index only embeds text it has never seen.
+# `BatchedEmbeddings` sits underneath it and turns the misses into as few,
+# concurrently sent, provider-sized requests as possible.
+
+import hashlib
+import os
+import sqlite3
+import threading
+from functools import partial
+
+import numpy as np
+
+from llm_utils.tokens import count_tokens
+
+try:
+    from langchain_core.embeddings import Embeddings
+except ImportError:
+    from langchain.embeddings.base import Embeddings
+
+
+DEFAULT_DIR = os.path.join(
+    os.environ.get("LLM_CACHE_DIR", os.path.expanduser("~/.cache/llm-material")),
+    "embeddings",
+)
+
+
+def model_name(embeddings):
+    for attr in ("model", "model_name", "deployment"):
+        value = getattr(embeddings, attr, None)
+        if isinstance(value, str):
+            return value
+    return type(embeddings).__name__
+
+
+def text_key(model, text):
+    return hashlib.sha256(f"{model}\x00{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingStore:
+    """Append-only float32 vector file plus a (model, text-hash) -> row index."""
+
+    def __init__(self, directory=DEFAULT_DIR):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._maps = {}
+        self._conn = sqlite3.connect(os.path.join(directory, "index.sqlite"),
+                                     check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS vectors ("
+            " key TEXT PRIMARY KEY, dim INTEGER NOT NULL, row INTEGER NOT NULL)"
+        )
+
+    def _path(self, dim):
+        return os.path.join(self.directory, f"vectors-{dim}.f32")
+
+    def _matrix(self, dim):
+        path = self._path(dim)
+        rows = os.path.getsize(path) // (4 * dim) if os.path.exists(path) else 0
+        cached = self._maps.get(dim)
+        if cached is None or cached.shape[0] < rows:
+            cached = np.memmap(path, dtype=np.float32, mode="r", shape=(rows, dim)) if rows else None
+            self._maps[dim] = cached
+        return cached
+
+    def get_many(self, keys):
+        """Return {key: vector} for the keys that are stored."""
+        if not keys:
+            return {}
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                marks = ",".join("?" * len(batch))
+                found.update((key, (dim, row)) for key, dim, row in self._conn.execute(
+                    f"SELECT key, dim, row FROM vectors WHERE key IN ({marks})", batch))
+            return {key: self._matrix(dim)[row] for key, (dim, row) in found.items()}
+
+    def put_many(self, keys, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if not len(keys):
+            return
+        dim = vectors.shape[1]
+        with self._lock:
+            path = self._path(dim)
+            start = os.path.getsize(path) // (4 * dim) if os.path.exists(path) else 0
+            with open(path, "ab") as f:
+                f.write(np.ascontiguousarray(vectors).tobytes())
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO vectors (key, dim, row) VALUES (?, ?, ?)",
+                [(key, dim, start + i) for i, key in enumerate(keys)],
+            )
+
+    def __len__(self):
+        return self._conn.execute("SELECT COUNT(*) FROM vectors").fetchone()[0]
+
+
+_default_store = None
+
+
+def default_store():
+    global _default_store
+    if _default_store is None:
+        _default_store = EmbeddingStore()
+    return _default_store
+
+
+class CachedEmbeddings(Embeddings):
+    """LangChain `Embeddings` that only calls `embeddings` for text it has not seen.
+
+    All instances share one `EmbeddingStore` unless another is passed, which
+    is what lets different vector stores reuse each other's vectors.
+    """
+
+    def __init__(self, embeddings, store=None):
+        self.embeddings = embeddings
+        self.store = store if store is not None else default_store()
+        self.model = model_name(embeddings)
+        self.hits = 0
+        self.misses = 0
+
+    def embed_documents(self, texts):
+        texts = list(texts)
+        keys = [text_key(self.model, t) for t in texts]
+        found = self.store.get_many(list(dict.fromkeys(keys)))
+        # embed each missing text once, even if it occurs several times
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            self.store.put_many(list(missing), vectors)
+            found.update(zip(missing, np.asarray(vectors, dtype=np.float32)))
+        self.misses += len(missing)
+        self.hits += len(texts) - len(missing)
+        return [found[key].tolist() for key in keys]
+
+    def embed_query(self, text):
+        key = text_key(self.model, text)
+        found = self.store.get_many([key])
+        if key in found:
+            self.hits += 1
+            return found[key].tolist()
+        self.misses += 1
+        vector = self.embeddings.embed_query(text)
+        self.store.put_many([key], [vector])
+        return list(vector)
+
+
+_SIZE_ERROR_HINTS = ("maximum context length", "too many", "too large", "max_tokens_per_request",
+                     "maximum request size", "reduce the length")
+
+
+def _is_size_error(error):
+    message = str(error).lower()
+    return any(hint in message for hint in _SIZE_ERROR_HINTS)
+
+
+class BatchedEmbeddings(Embeddings):
+    """Pack texts into provider-sized batches and embed them concurrently.
+
+    Batches hold at most `max_batch_size` texts and `max_tokens_per_request`
+    tokens. They are sent on `max_workers` threads behind a token bucket of
+    `requests_per_minute`. A batch rejected for its size is split in half
+    and the token budget for later batches shrinks accordingly. Use
+    `iter_embeddings` to consume vectors as their batch completes.
+    """
+
+    def __init__(self, embeddings, max_batch_size=1000, max_tokens_per_request=300_000,
+                 max_workers=8, requests_per_minute=3000):
+        self.embeddings = embeddings
+        self.model = model_name(embeddings)
+        self.max_batch_size = max_batch_size
+        self.max_tokens_per_request = max_tokens_per_request
+        self.max_workers = max_workers
+        self.requests_per_minute = requests_per_minute
+        self._count_tokens = partial(count_tokens, model=self.model)
+        self._lock = threading.Lock()
+
+    def _batches(self, texts):
+        batch, batch_tokens = [], 0
+        for i, text in enumerate(texts):
+            tokens = self._count_tokens(text)
+            if batch and (len(batch) == self.max_batch_size
+                          or batch_tokens + tokens > self.max_tokens_per_request):
+                yield batch
+                batch, batch_tokens = [], 0
+            batch.append(i)
+            batch_tokens += tokens
+        if batch:
+            yield batch
+
+    def _embed_batch(self, texts, indices, bucket):
+        from llm_utils.completion import with_retries
+
+        def call():
+            bucket.acquire()
+            return self.embeddings.embed_documents([texts[i] for i in indices])
+
+        try:
+            return list(zip(indices, with_retries(call)))
+        except Exception as e:
+            if len(indices) == 1 or not _is_size_error(e):
+                raise
+            with self._lock:
+                tokens = sum(self._count_tokens(texts[i]) for i in indices)
+                self.max_tokens_per_request = max(1, min(self.max_tokens_per_request, tokens // 2))
+                self.max_batch_size = max(1, min(self.max_batch_size, len(indices) // 2))
+            middle = len(indices) // 2
+            return (self._embed_batch(texts, indices[:middle], bucket)
+                    + self._embed_batch(texts, indices[middle:], bucket))
+
+    def iter_embeddings(self, texts):
+        """Yield `(index, vector)` pairs as soon as each batch comes back."""
+        from concurrent.futures import ThreadPoolExecutor, as_completed
+
+        from llm_utils.completion import TokenBucket
+
+        texts = list(texts)
+        bucket = TokenBucket(self.requests_per_minute / 60.0, capacity=self.max_workers)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = [pool.submit(self._embed_batch, texts, batch, bucket)
+                       for batch in self._batches(texts)]
+            for future in as_completed(futures):
+                yield from future.result()
+
+    def embed_documents(self, texts):
+        texts = list(texts)
+        vectors = [None] * len(texts)
+        for i, vector in self.iter_embeddings(texts):
+            vectors[i] = vector
+        return vectors
+
+    def embed_query(self, text):
+        return self.embeddings.embed_query(text)
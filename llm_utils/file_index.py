@@ -0,0 +1,135 @@
+# Persistent per-file vector indexes, keyed by content hash.
+#
+# The document chatbot used to parse, split and embed its PDF from scratch
+# every time a session started or a file was uploaded. `open_file_index` keeps
+# one saved `NumpyVectorStore` per (file content, splitter settings, embedding
+# model) under `DEFAULT_DIR`:
+#
+#   * a file seen before, by any session or under any name, is loaded
+#     from disk with its vectors memory-mapped, without parsing or embedding;
+#   * sessions in the same process share one store object, and processes
+#     share the mapped pages through the OS page cache, so the index is
+#     read-only (its add/delete methods raise): build a separate store if you
+#     need to add to it;
+#   * within a process, a file whose path, mtime and size were seen before
+#     is found without re-reading it; the content is only hashed on a miss.
+#     Beyond `MAX_OPEN` stores the least recently used is dropped (sessions
+#     still holding it keep it);
+#   * concurrent first opens of the same file build it once per process, and
+#     the finished index is moved into place atomically, so readers never see
+#     a half-written one.
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+from llm_utils.embeddings import model_name
+from llm_utils.ingest import _parse_pdf, file_digest
+
+
+DEFAULT_DIR = os.path.join(
+    os.environ.get("LLM_CACHE_DIR", os.path.expanduser("~/.cache/llm-material")),
+    "file_indexes",
+)
+
+MAX_OPEN = 32
+
+_open = OrderedDict()         # key -> store, shared by every session in the process
+_keys = OrderedDict()         # (realpath, mtime, size, splitter, model) -> key
+_cache_lock = threading.Lock()  # guards _open and _keys
+_build_locks = [threading.Lock() for _ in range(64)]  # striped by key
+
+
+def _splitter_config(splitter):
+    if splitter is None:
+        return None
+    return {"type": type(splitter).__name__,
+            "chunk_size": getattr(splitter, "_chunk_size", None),
+            "chunk_overlap": getattr(splitter, "_chunk_overlap", None),
+            "separators": getattr(splitter, "_separators", None)}
+
+
+def index_key(path, splitter, embedding):
+    """Digest of the file content, the splitter settings and the embedding model."""
+    config = {"file": file_digest(path), "splitter": _splitter_config(splitter),
+              "model": model_name(getattr(embedding, "embeddings", embedding))}
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()
+
+
+def _stat_key(path, splitter, embedding):
+    stat = os.stat(path)
+    return (os.path.realpath(path), stat.st_mtime_ns, stat.st_size,
+            json.dumps(_splitter_config(splitter), sort_keys=True),
+            model_name(getattr(embedding, "embeddings", embedding)))
+
+
+def _remember(cache, key, value):
+    # callers hold _cache_lock
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > MAX_OPEN:
+        cache.popitem(last=False)
+
+
+def _refuse_writes(*args, **kwargs):
+    raise RuntimeError("shared file indexes are read-only; build a separate store to add to it")
+
+
+def _read_only(store):
+    for name in ("add_vectors", "add_texts", "add_documents", "delete"):
+        setattr(store, name, _refuse_writes)
+    return store
+
+
+def _lock_for(key):
+    # a fixed set of locks, so none is left behind per key; two files that
+    # share a stripe just build one after the other
+    return _build_locks[hash(key) % len(_build_locks)]
+
+
+def _build(path, splitter, embedding, target, store_cls):
+    docs = _parse_pdf(path, splitter)
+    store = store_cls.from_documents(docs, embedding)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=os.path.dirname(target), prefix=".building-")
+    try:
+        store.save(tmp)
+        os.rename(tmp, target)
+    except OSError:
+        # another process finished the same index first; keep theirs
+        shutil.rmtree(tmp, ignore_errors=True)
+        if not os.path.isdir(target):
+            raise
+
+
+def open_file_index(path, embedding, splitter=None, directory=DEFAULT_DIR, store_cls=None):
+    """The shared, read-only vector store for the PDF at `path`, building it on first use."""
+    if store_cls is None:
+        from llm_utils.vectorstore import NumpyVectorStore as store_cls
+
+    stat_key = _stat_key(path, splitter, embedding)
+    with _cache_lock:
+        key = _keys.get(stat_key)
+        store = _open.get(key)
+        if store is not None:
+            _keys.move_to_end(stat_key)
+            _open.move_to_end(key)
+            return store
+    if key is None:
+        key = index_key(path, splitter, embedding)
+    with _lock_for(key):
+        with _cache_lock:
+            store = _open.get(key)
+        if store is None:
+            target = os.path.join(directory, key)
+            if not os.path.isdir(target):
+                _build(path, splitter, embedding, target, store_cls)
+            store = _read_only(store_cls.load(target, embedding, mmap=True))
+        with _cache_lock:
+            _remember(_open, key, store)
+            _remember(_keys, stat_key, key)
+    return store
@@ -0,0 +1,80 @@
+# Hybrid keyword + dense retrieval with reciprocal rank fusion.
+#
+# Dense embeddings miss exact keywords ("matlab", an equation name) and BM25
+# misses paraphrases; fusing both rankings gets the best of each. RRF only
+# uses ranks, so the two score scales never need calibrating:
+#
+#     score(d) = sum over rankings of  weight / (rrf_k + rank(d))
+#
+# `HybridRetriever` runs the vector search and the `BM25Index` search at the
+# same time on a shared thread pool, and `add_documents` updates both indexes
+# under the same ids.
+
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+try:
+    from langchain_core.retrievers import BaseRetriever
+except ImportError:
+    from langchain.schema import BaseRetriever
+
+
+_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="hybrid")
+
+
+def reciprocal_rank_fusion(rankings, rrf_k=60, weights=None):
+    """Fuse ranked lists of hashable keys; returns `(key, score)` pairs, best first."""
+    weights = weights or [1.0] * len(rankings)
+    scores = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, key in enumerate(ranking, start=1):
+            scores[key] = scores.get(key, 0.0) + weight / (rrf_k + rank)
+    return sorted(scores.items(), key=lambda item: -item[1])
+
+
+class HybridRetriever(BaseRetriever):
+    """Dense + BM25 retrieval fused with RRF.
+
+    `vectorstore` is any LangChain vector store (Chroma, `NumpyVectorStore`),
+    `bm25` a `BM25Index` holding the same chunks. Each side contributes its
+    best `fetch_k` results; the `k` best fused documents are returned.
+    """
+
+    vectorstore: Any
+    bm25: Any
+    k: int = 4
+    fetch_k: int = 20
+    rrf_k: int = 60
+    dense_weight: float = 1.0
+    sparse_weight: float = 1.0
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        dense = _pool.submit(self.vectorstore.similarity_search, query, k=self.fetch_k)
+        sparse = _pool.submit(self.bm25.similarity_search, query, k=self.fetch_k)
+        dense_docs, sparse_docs = dense.result(), sparse.result()
+
+        # chunks are identified by their text: Chroma does not return ids from a search
+        by_text = {}
+        for doc in sparse_docs + dense_docs:
+            by_text.setdefault(doc.page_content, doc)
+        fused = reciprocal_rank_fusion(
+            [[d.page_content for d in dense_docs], [d.page_content for d in sparse_docs]],
+            rrf_k=self.rrf_k, weights=[self.dense_weight, self.sparse_weight])
+        return [by_text[text] for text, _ in fused[:self.k]]
+
+    def add_documents(self, documents, ids=None, **kwargs):
+        """Add `documents` to both indexes (concurrently) under the same ids."""
+        documents = list(documents)
+        ids = list(ids) if ids is not None else [str(uuid.uuid4()) for _ in documents]
+        dense = _pool.submit(self.vectorstore.add_documents, documents, ids=ids)
+        sparse = _pool.submit(self.bm25.add_documents, documents, ids)
+        dense.result(), sparse.result()
+        return ids
+
+    def delete(self, ids):
+        self.vectorstore.delete(ids)
+        self.bm25.delete(ids)
@@ -0,0 +1,206 @@
+# Parallel, incremental PDF ingestion for the RAG notebooks.
+#
+# `load_pdfs` parses a list of PDFs across a process pool (PDF parsing is
+# CPU bound, so threads would not help). `IngestionPipeline` adds a manifest
+# recording each file's content hash, mtime and size together with the ids of
+# the chunks it produced; on re-run only new or changed files are re-parsed,
+# re-split and re-embedded, and chunks of deleted files are removed from the
+# vector store.
+
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+
+
+def file_digest(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _parse_pdf(path, splitter=None):
+    # runs in a worker process, so it has to be a module-level function
+    from langchain.document_loaders import PyPDFLoader
+
+    pages = PyPDFLoader(path).load()
+    if splitter is not None:
+        return splitter.split_documents(pages)
+    return pages
+
+
+def load_pdfs(paths, splitter=None, max_workers=None):
+    """Parse (and optionally split) PDFs in parallel, keeping the order of `paths`.
+
+    Each distinct path is parsed once even if it is listed several times.
+    """
+    paths = list(paths)
+    unique = list(dict.fromkeys(paths))
+    if len(unique) == 1:
+        parsed = {unique[0]: _parse_pdf(unique[0], splitter)}
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            results = pool.map(_parse_pdf, unique, [splitter] * len(unique))
+            parsed = dict(zip(unique, results))
+    docs = []
+    for path in paths:
+        docs.extend(parsed[path])
+    return docs
+
+
+@dataclass
+class IngestResult:
+    added: list = field(default_factory=list)
+    changed: list = field(default_factory=list)
+    removed: list = field(default_factory=list)
+    unchanged: list = field(default_factory=list)
+    splits: list = field(default_factory=list)
+
+    def __repr__(self):
+        return (f"IngestResult(added={len(self.added)}, changed={len(self.changed)}, "
+                f"removed={len(self.removed)}, unchanged={len(self.unchanged)}, "
+                f"splits={len(self.splits)})")
+
+
+class IngestionPipeline:
+    """Keep a vector store in sync with a set of PDFs, touching only what changed.
+
+    The manifest is a small JSON file (conventionally next to the vector
+    store's persist directory) mapping each path to its sha256, mtime, size
+    and chunk ids. A file whose mtime and size are unchanged is not even
+    re-hashed; one whose mtime changed but whose content did not is only
+    re-stamped.
+
+    Before a file's chunks go into the store, a "pending" entry with their
+    ids is appended to a journal next to the manifest, and a "done" entry
+    after; appends are O(1), and the journal is folded into the manifest
+    every `checkpoint_every` files or `checkpoint_interval` seconds. An
+    interrupted run resumes from the journal: finished files are skipped,
+    and a file left pending has its ids deleted from the store and is added
+    again, so nothing is added twice.
+    """
+
+    def __init__(self, manifest_path, splitter, max_workers=None, checkpoint_every=50,
+                 checkpoint_interval=30.0):
+        self.manifest_path = manifest_path
+        self.splitter = splitter
+        self.max_workers = max_workers
+        self.checkpoint_every = checkpoint_every
+        self.checkpoint_interval = checkpoint_interval
+        self.journal_path = manifest_path + ".journal"
+        self.manifest = {}
+        self._digests = {}        # path -> (mtime, size, sha256) hashed during this run
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                self.manifest = json.load(f)
+        if os.path.exists(self.journal_path):
+            # replay what an interrupted run did after its last checkpoint
+            with open(self.journal_path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break  # torn last line
+                    self.manifest[record["path"]] = record["entry"]
+
+    def _save_manifest(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.manifest_path)), exist_ok=True)
+        tmp = self.manifest_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.manifest, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.manifest_path)
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+
+    def _journal(self, path, entry):
+        os.makedirs(os.path.dirname(os.path.abspath(self.journal_path)), exist_ok=True)
+        with open(self.journal_path, "a") as f:
+            f.write(json.dumps({"path": path, "entry": entry}) + "\n")
+        self.manifest[path] = entry
+
+    def _digest(self, path, stat):
+        cached = self._digests.get(path)
+        if cached is not None and cached[:2] == (stat.st_mtime, stat.st_size):
+            return cached[2]
+        digest = file_digest(path)
+        self._digests[path] = (stat.st_mtime, stat.st_size, digest)
+        return digest
+
+    def _is_unchanged(self, path, stat):
+        entry = self.manifest.get(path)
+        if entry is None or entry.get("pending"):
+            return False
+        if entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size:
+            return True
+        digest = self._digest(path, stat)
+        if digest == entry["sha256"]:
+            entry["mtime"], entry["size"] = stat.st_mtime, stat.st_size
+            return True
+        return False
+
+    def plan(self, paths):
+        """Split `paths` into (new, changed, removed, unchanged) against the manifest."""
+        paths = list(dict.fromkeys(paths))
+        new, changed, unchanged = [], [], []
+        for path in paths:
+            stat = os.stat(path)
+            if path not in self.manifest:
+                new.append(path)
+            elif self._is_unchanged(path, stat):
+                unchanged.append(path)
+            else:
+                changed.append(path)
+        removed = [p for p in self.manifest if p not in set(paths)]
+        return new, changed, removed, unchanged
+
+    def run(self, paths, vectordb=None):
+        """Bring the manifest (and `vectordb`, if given) up to date with `paths`.
+
+        Returns an `IngestResult`; its `splits` are only the chunks of new or
+        changed files, i.e. exactly what had to be embedded.
+        """
+        new, changed, removed, unchanged = self.plan(paths)
+        result = IngestResult(added=new, changed=changed, removed=removed, unchanged=unchanged)
+
+        stale_ids = []
+        for path in changed + removed:
+            stale_ids.extend(self.manifest[path]["ids"])
+        if vectordb is not None and stale_ids:
+            vectordb.delete(ids=stale_ids)
+        for path in removed:
+            del self.manifest[path]
+
+        todo = new + changed
+        pending, last_saved = 0, time.monotonic()
+        if todo:
+            with ProcessPoolExecutor(max_workers=self.max_workers) as pool:
+                parsed = pool.map(_parse_pdf, todo, [self.splitter] * len(todo))
+                for path, splits in zip(todo, parsed):
+                    stat = os.stat(path)
+                    digest = self._digest(path, stat)
+                    ids = [f"{digest[:16]}-{hashlib.sha1(path.encode()).hexdigest()[:8]}-{i}"
+                           for i in range(len(splits))]
+                    entry = {
+                        "sha256": digest,
+                        "mtime": stat.st_mtime,
+                        "size": stat.st_size,
+                        "ids": ids,
+                    }
+                    self._journal(path, {**entry, "pending": True})
+                    if vectordb is not None and splits:
+                        vectordb.add_documents(splits, ids=ids)
+                    self._journal(path, entry)
+                    result.splits.extend(splits)
+                    # fold the journal into the manifest now and then; a
+                    # rewrite per file would be quadratic on large corpora
+                    pending += 1
+                    if (pending >= self.checkpoint_every
+                            or time.monotonic() - last_saved >= self.checkpoint_interval):
+                        self._save_manifest()
+                        pending, last_saved = 0, time.monotonic()
+        self._save_manifest()
+        return result
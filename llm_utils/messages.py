@@ -0,0 +1,89 @@
+# Message-list state with an id index, for LangGraph reducers.
+#
+# The human-in-the-loop agent's `reduce_messages` scanned the whole history
+# for every incoming message to find one with the same `id`, so each state
+# update was O(n·m) and a long thread got slower with every turn.
+# `MessageLog` is a plain `list` of messages plus an id -> position index:
+#
+#   * `merged(messages)` replaces messages with a known id in place and
+#     appends the rest, with O(1) work per incoming message;
+#   * positions never move (messages are only replaced or appended), so a
+#     log and every log derived from it share one index dict instead of
+#     copying it. A position is checked before it is used, and an entry
+#     written by another branch of the thread (time travel, forks) makes
+#     the log rebuild a private index;
+#   * the message list itself is still copied (a C-level copy of
+#     pointers), so states the graph already returned or streamed never
+#     change under the caller;
+#   * it serializes as an ordinary list. Checkpointers that restore a
+#     plain list get a `MessageLog` back on the next update, which
+#     rebuilds the index once.
+
+from uuid import uuid4
+
+
+class MessageLog(list):
+    """List of messages with an id -> position index shared along its history."""
+
+    __slots__ = ("_index",)
+
+    def __init__(self, messages=(), _index=None):
+        super().__init__(messages)
+        self._index = _index
+        if _index is None:
+            self._reindex()
+
+    @classmethod
+    def of(cls, messages):
+        """`messages` as a `MessageLog` (returned as is if it already is one)."""
+        if isinstance(messages, cls):
+            return messages
+        return cls(messages or ())
+
+    def _reindex(self):
+        self._index = {m.id: i for i, m in enumerate(self) if getattr(m, "id", None)}
+
+    def position(self, message_id):
+        """Position of the message with `message_id`, or None."""
+        pos = self._index.get(message_id)
+        if pos is None:
+            return None
+        if pos < len(self) and self[pos].id == message_id:
+            return pos
+        # the entry belongs to another branch of the thread
+        self._reindex()
+        return self._index.get(message_id)
+
+    def append(self, message):
+        if getattr(message, "id", None):
+            self._index[message.id] = len(self)
+        super().append(message)
+
+    def extend(self, messages):
+        for message in messages:
+            self.append(message)
+
+    def merged(self, messages):
+        """New log: same-id messages replaced in place, the others appended."""
+        result = MessageLog(self, self._index)
+        for message in messages:
+            pos = result.position(message.id)
+            if pos is None:
+                result.append(message)
+            else:
+                result[pos] = message
+        return result
+
+    def __reduce__(self):
+        # pickle the messages only; the index is rebuilt on load
+        return (MessageLog, (list(self),))
+
+
+def merge_messages(left, right):
+    """LangGraph reducer: give new messages ids, replace same-id ones, append the rest."""
+    if not isinstance(right, list):
+        right = [right]
+    for message in right:
+        if not message.id:
+            message.id = str(uuid4())
+    return MessageLog.of(left).merged(right)
@@ -0,0 +1,172 @@
+# Metadata index for pre-filtered vector search.
+#
+# Filters use the same dict syntax as Chroma, so LangChain's `ChromaTranslator`
+# turns a SelfQueryRetriever's structured query straight into one:
+#
+#     {"source": "docs/cs229_lectures/MachineLearning-Lecture03.pdf"}
+#     {"page": {"$gte": 3}}
+#     {"$and": [{"source": ...}, {"page": {"$in": [1, 2]}}]}
+#
+# Categorical fields keep an inverted list (value -> sorted row ids); numeric
+# fields additionally keep their values sorted with the matching row ids, so
+# equality and range predicates are a dict lookup or two `searchsorted` calls.
+# `select` returns the sorted ids of the matching rows, in time proportional
+# to the number of matches rather than to the size of the store.
+
+import numbers
+from collections import defaultdict
+
+import numpy as np
+
+
+_EMPTY = np.empty(0, dtype=np.int64)
+
+_COMPARISONS = {
+    "$gt": lambda a, b: a > b,
+    "$gte": lambda a, b: a >= b,
+    "$lt": lambda a, b: a < b,
+    "$lte": lambda a, b: a <= b,
+}
+
+
+def _is_number(value):
+    return isinstance(value, numbers.Number) and not isinstance(value, bool)
+
+
+def _hashable(value):
+    return tuple(value) if isinstance(value, list) else value
+
+
+class _Field:
+    def __init__(self):
+        self.lists = defaultdict(list)   # value -> row ids, appended in row order
+        self.numeric = True
+        self._sorted = None              # (values, rows) for numeric range queries
+        self._present = None
+        self._arrays = {}
+
+    def add(self, value, row):
+        value = _hashable(value)
+        self.lists[value].append(row)
+        self.numeric = self.numeric and _is_number(value)
+        self._sorted = self._present = None
+        self._arrays.pop(value, None)
+
+    def rows(self, value):
+        value = _hashable(value)
+        array = self._arrays.get(value)
+        if array is None:
+            array = np.asarray(self.lists.get(value, ()), dtype=np.int64)
+            self._arrays[value] = array
+        return array
+
+    def present(self):
+        if self._present is None:
+            self._present = (np.sort(np.concatenate([self.rows(v) for v in self.lists]))
+                             if self.lists else _EMPTY)
+        return self._present
+
+    def sorted_values(self):
+        if self._sorted is None:
+            values = np.concatenate([np.full(len(r), v, dtype=np.float64)
+                                     for v, r in self.lists.items()]) if self.lists else np.empty(0)
+            rows = np.concatenate([self.rows(v) for v in self.lists]) if self.lists else _EMPTY
+            order = np.argsort(values, kind="stable")
+            self._sorted = (values[order], rows[order])
+        return self._sorted
+
+    def range(self, op, bound):
+        if self.numeric and _is_number(bound):
+            values, rows = self.sorted_values()
+            if op == "$gt":
+                found = rows[np.searchsorted(values, bound, side="right"):]
+            elif op == "$gte":
+                found = rows[np.searchsorted(values, bound, side="left"):]
+            elif op == "$lt":
+                found = rows[:np.searchsorted(values, bound, side="left")]
+            else:
+                found = rows[:np.searchsorted(values, bound, side="right")]
+            return np.sort(found)
+        # mixed or non-numeric field: compare the distinct values instead of the rows
+        compare = _COMPARISONS[op]
+        matches = []
+        for value in self.lists:
+            try:
+                if compare(value, bound):
+                    matches.append(self.rows(value))
+            except TypeError:
+                continue
+        return np.sort(np.concatenate(matches)) if matches else _EMPTY
+
+
+class MetadataIndex:
+    """Inverted / sorted-array index over a list of metadata dicts (row = position)."""
+
+    def __init__(self, metadatas=()):
+        self.fields = defaultdict(_Field)
+        self.size = 0
+        self.add(metadatas)
+
+    def add(self, metadatas):
+        for metadata in metadatas:
+            for key, value in (metadata or {}).items():
+                self.fields[key].add(value, self.size)
+            self.size += 1
+
+    def select(self, filter):
+        """Sorted row ids matching a Chroma-style `filter`.
+
+        >>> index = MetadataIndex([{"source": "a"}, {"source": "b"}, {"source": "a"}])
+        >>> index.select({"source": {"$in": ["a", "a"]}}).tolist()
+        [0, 2]
+        >>> index.select({"source": {"$nin": ["b", "b"]}}).tolist()
+        [0, 2]
+        """
+        clauses = []
+        for key, condition in filter.items():
+            if key == "$and":
+                clauses.append(self._intersect([self.select(f) for f in condition]))
+            elif key == "$or":
+                parts = [self.select(f) for f in condition]
+                clauses.append(np.unique(np.concatenate(parts)) if parts else _EMPTY)
+            elif isinstance(condition, dict):
+                clauses.extend(self._predicate(key, op, arg) for op, arg in condition.items())
+            else:
+                clauses.append(self._predicate(key, "$eq", condition))
+        return self._intersect(clauses) if clauses else np.arange(self.size, dtype=np.int64)
+
+    def mask(self, filter):
+        mask = np.zeros(self.size, dtype=bool)
+        mask[self.select(filter)] = True
+        return mask
+
+    @staticmethod
+    def _intersect(parts):
+        if not parts:
+            return _EMPTY
+        # start from the most selective clause so every step stays small
+        parts = sorted(parts, key=len)
+        result = parts[0]
+        for part in parts[1:]:
+            if not len(result):
+                break
+            result = np.intersect1d(result, part, assume_unique=True)
+        return result
+
+    def _predicate(self, key, op, arg):
+        field = self.fields.get(key)
+        if field is None:
+            return _EMPTY
+        if op == "$eq":
+            return field.rows(arg)
+        if op == "$in":
+            parts = [field.rows(v) for v in arg]
+            # repeated values would repeat their rows
+            return np.unique(np.concatenate(parts)) if parts else _EMPTY
+        if op == "$ne":
+            return np.setdiff1d(field.present(), field.rows(arg), assume_unique=True)
+        if op == "$nin":
+            return np.setdiff1d(field.present(), self._predicate(key, "$in", arg), assume_unique=True)
+        if op in _COMPARISONS:
+            return field.range(op, arg)
+        raise ValueError(f"unsupported filter operator {op!r}")
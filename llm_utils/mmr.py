@@ -0,0 +1,123 @@
+# Vectorized maximal marginal relevance.
+#
+# The greedy MMR loop picks, k times, the candidate maximizing
+#
+#     lambda * sim(query, c) - (1 - lambda) * max(sim(c, s) for s already selected)
+#
+# LangChain's helper recomputes the candidate/selected similarities on every
+# step. Here the fetch_k x fetch_k candidate similarity matrix is computed
+# once with a single matmul and the running "max similarity to the selected
+# set" is updated with one `np.maximum` per step, so selection costs
+# O(k * fetch_k) after the matmul. `mmr_select_batch` runs the same loop for
+# many queries at once.
+
+from typing import Any, Optional
+
+import numpy as np
+
+try:
+    from langchain_core.documents import Document
+    from langchain_core.retrievers import BaseRetriever
+except ImportError:
+    from langchain.schema import BaseRetriever, Document
+
+
+def _unit(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def mmr_select_batch(queries, candidates, k=4, lambda_mult=0.5, valid=None):
+    """MMR over a batch: `queries` (b, d), `candidates` (b, fetch_k, d).
+
+    `valid` is an optional (b, fetch_k) mask for padded candidate slots.
+    Returns a (b, <=k) array of candidate positions in selection order.
+    """
+    queries = _unit(np.asarray(queries, dtype=np.float32))
+    candidates = _unit(np.asarray(candidates, dtype=np.float32))
+    b, fetch_k, _ = candidates.shape
+
+    relevance = np.einsum("bfd,bd->bf", candidates, queries)
+    pairwise = np.matmul(candidates, candidates.transpose(0, 2, 1))
+    available = np.ones((b, fetch_k), dtype=bool) if valid is None else np.asarray(valid, dtype=bool).copy()
+    k = min(k, int(available.sum(axis=1).min()) if b else 0)
+
+    batch = np.arange(b)
+    max_sim = np.full((b, fetch_k), -np.inf, dtype=np.float32)
+    selected = np.empty((b, k), dtype=np.int64)
+    for step in range(k):
+        # the first pick is the most relevant candidate (no redundancy yet)
+        redundancy = np.where(np.isfinite(max_sim), max_sim, 0.0)
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[~available] = -np.inf
+        best = scores.argmax(axis=1)
+        selected[:, step] = best
+        available[batch, best] = False
+        np.maximum(max_sim, pairwise[batch, best], out=max_sim)
+    return selected
+
+
+def mmr_select(query, candidates, k=4, lambda_mult=0.5):
+    """MMR for one query over a (fetch_k, d) candidate matrix; returns positions."""
+    candidates = np.asarray(candidates, dtype=np.float32)
+    if len(candidates) == 0:
+        return []
+    return mmr_select_batch(np.asarray(query)[None, :], candidates[None], k, lambda_mult)[0].tolist()
+
+
+def _chroma_mmr(vectordb, query_vectors, k, fetch_k, lambda_mult, filter):
+    result = vectordb._collection.query(
+        query_embeddings=[list(map(float, q)) for q in query_vectors],
+        n_results=fetch_k,
+        where=filter,
+        include=["embeddings", "documents", "metadatas"],
+    )
+    out = []
+    for query, embeddings, texts, metadatas in zip(
+            query_vectors, result["embeddings"], result["documents"], result["metadatas"]):
+        picked = mmr_select(query, np.asarray(embeddings), k, lambda_mult)
+        out.append([Document(page_content=texts[i], metadata=metadatas[i] or {}) for i in picked])
+    return out
+
+
+def mmr_search_batch(vectorstore, queries, k=4, fetch_k=20, lambda_mult=0.5, filter=None):
+    """MMR for several query strings against a NumpyVectorStore-like store or Chroma."""
+    embedding = getattr(vectorstore, "embeddings", None) or vectorstore._embedding_function
+    query_vectors = np.asarray(embedding.embed_documents(list(queries)), dtype=np.float32)
+    if hasattr(vectorstore, "search_vectors"):
+        rows, _ = vectorstore.search_vectors(query_vectors, k=fetch_k, filter=filter)
+        if rows.shape[1] == 0:
+            return [[] for _ in queries]
+        picked = mmr_select_batch(query_vectors, vectorstore.matrix[rows], k, lambda_mult)
+        return [[vectorstore._document(r) for r in query_rows[sel]]
+                for query_rows, sel in zip(rows, picked)]
+    if hasattr(vectorstore, "_collection"):
+        return _chroma_mmr(vectorstore, query_vectors, k, fetch_k, lambda_mult, filter)
+    return [vectorstore.max_marginal_relevance_search(q, k=k, fetch_k=fetch_k,
+                                                      lambda_mult=lambda_mult, filter=filter)
+            for q in queries]
+
+
+def mmr_search(vectorstore, query, k=4, fetch_k=20, lambda_mult=0.5, filter=None):
+    return mmr_search_batch(vectorstore, [query], k, fetch_k, lambda_mult, filter)[0]
+
+
+class MMRRetriever(BaseRetriever):
+    """Retriever running the vectorized MMR against `vectorstore`.
+
+    Use in place of `vectordb.as_retriever(search_type="mmr")`; large
+    `fetch_k` values stay cheap.
+    """
+
+    vectorstore: Any
+    k: int = 4
+    fetch_k: int = 20
+    lambda_mult: float = 0.5
+    filter: Optional[dict] = None
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        return mmr_search(self.vectorstore, query, self.k, self.fetch_k, self.lambda_mult, self.filter)
@@ -0,0 +1,212 @@
+# Streaming map-reduce and refine question answering.
+#
+# `RetrievalQA(chain_type="map_reduce")` runs one LLM call per retrieved
+# document and then a single "combine" call over all the answers.
+# `MapReduceQA` runs the map calls concurrently (at most `max_concurrency` at
+# a time), so the map phase costs about one round-trip instead of k, and:
+#
+#   * streams each partial answer as soon as it is available, in document
+#     order (or in completion order with `ordered=False`);
+#   * reduces in a tree, `reduce_fanout` answers per call and those calls in
+#     parallel, instead of one flat call over everything;
+#   * with `confidence_threshold`, asks each map call how well its document
+#     answers the question and cancels the map calls still queued once one
+#     reaches the threshold.
+#
+# Refine is inherently serial (each step needs the previous answer);
+# `refine` streams every intermediate answer instead.
+
+import re
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+MAP_TEMPLATE = """Use the following portion of a long document to see if any of the text is relevant to answer the question.
+Return any relevant text verbatim. If nothing is relevant, return NONE.
+{context}
+Question: {question}
+Relevant text, if any:"""
+
+CONFIDENCE_INSTRUCTIONS = """
+On a last line write "CONFIDENCE: <number between 0 and 1>": how completely this text alone answers the question."""
+
+COMBINE_TEMPLATE = """Given the following extracted parts of a long document and a question, create a final answer.
+If you don't know the answer, just say that you don't know. Don't try to make up an answer.
+QUESTION: {question}
+=========
+{summaries}
+=========
+FINAL ANSWER:"""
+
+COLLAPSE_TEMPLATE = """Given the following extracted parts of a long document and a question, merge them into one passage
+that keeps every detail relevant to the question. Return NONE if none of them is relevant.
+QUESTION: {question}
+=========
+{summaries}
+=========
+MERGED PASSAGE:"""
+
+REFINE_INITIAL_TEMPLATE = """Context information is below.
+---------------------
+{context}
+---------------------
+Given the context information and not prior knowledge, answer the question: {question}
+"""
+
+REFINE_TEMPLATE = """The original question is as follows: {question}
+We have provided an existing answer: {existing_answer}
+We have the opportunity to refine the existing answer (only if needed) with some more context below.
+------------
+{context}
+------------
+Given the new context, refine the original answer to better answer the question. If the context isn't useful, return the original answer."""
+
+_CONFIDENCE = re.compile(r"\n?\s*CONFIDENCE:\s*([01](?:\.\d+)?)\s*$", re.IGNORECASE)
+
+
+def call_llm(llm, prompt):
+    """Text of a LangChain chat model / LLM reply to `prompt`."""
+    if hasattr(llm, "invoke"):
+        reply = llm.invoke(prompt)
+    else:
+        reply = llm.predict(prompt)
+    return getattr(reply, "content", reply).strip()
+
+
+def _is_empty(text):
+    return not text or text.strip().upper().rstrip(".") == "NONE"
+
+
+class MapReduceQA:
+    """Concurrent, streaming replacement for `RetrievalQA` map_reduce / refine.
+
+    `llm` is any LangChain chat model or LLM; `retriever` any retriever (or
+    pass the documents to `stream` / `run` directly).
+    """
+
+    def __init__(self, llm, retriever=None, max_concurrency=8, reduce_fanout=4,
+                 confidence_threshold=None, map_template=MAP_TEMPLATE,
+                 combine_template=COMBINE_TEMPLATE, collapse_template=COLLAPSE_TEMPLATE):
+        self.llm = llm
+        self.retriever = retriever
+        self.max_concurrency = max_concurrency
+        self.reduce_fanout = max(2, reduce_fanout)
+        self.confidence_threshold = confidence_threshold
+        self.map_template = map_template
+        self.combine_template = combine_template
+        self.collapse_template = collapse_template
+
+    def _documents(self, question, documents):
+        if documents is not None:
+            return list(documents)
+        return self.retriever.get_relevant_documents(question)
+
+    # -- map ---------------------------------------------------------------
+
+    def _map_one(self, question, document, stopped):
+        if stopped.is_set():
+            return None, None
+        prompt = self.map_template.format(context=document.page_content, question=question)
+        if self.confidence_threshold is not None:
+            prompt += CONFIDENCE_INSTRUCTIONS
+        text = call_llm(self.llm, prompt)
+        confidence = None
+        match = _CONFIDENCE.search(text)
+        if match:
+            confidence = float(match.group(1))
+            text = text[:match.start()].strip()
+        return text, confidence
+
+    def _map(self, question, documents, ordered, stopped):
+        """Yield `(index, text, confidence)` per document as map calls finish."""
+        pool = ThreadPoolExecutor(max_workers=self.max_concurrency)
+        try:
+            futures = [pool.submit(self._map_one, question, d, stopped) for d in documents]
+            index_of = {future: i for i, future in enumerate(futures)}
+            pending, ready, next_index = set(futures), {}, 0
+            while pending and not stopped.is_set():
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in sorted(done, key=index_of.get):
+                    text, confidence = future.result()
+                    if text is None:
+                        continue
+                    if (self.confidence_threshold is not None and confidence is not None
+                            and confidence >= self.confidence_threshold):
+                        stopped.set()
+                    if ordered:
+                        ready[index_of[future]] = (text, confidence)
+                    else:
+                        yield index_of[future], text, confidence
+                # release the longest finished prefix
+                while ordered and next_index < len(futures) and futures[next_index].done():
+                    if next_index in ready:
+                        yield (next_index,) + ready.pop(next_index)
+                    next_index += 1
+            # after a confident answer: stop waiting, queued calls are cancelled below
+            for index in sorted(ready):
+                yield (index,) + ready[index]
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    # -- reduce ------------------------------------------------------------
+
+    def _join(self, summaries):
+        return "\n\n".join(summaries)
+
+    def _reduce(self, question, summaries):
+        """Tree reduce: collapse groups of `reduce_fanout` in parallel until one call is left."""
+        level = 0
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as pool:
+            while len(summaries) > self.reduce_fanout:
+                groups = [summaries[i:i + self.reduce_fanout]
+                          for i in range(0, len(summaries), self.reduce_fanout)]
+                prompts = [self.collapse_template.format(question=question, summaries=self._join(g))
+                           for g in groups]
+                collapsed = list(pool.map(lambda p: call_llm(self.llm, p), prompts))
+                summaries = [s for s in collapsed if not _is_empty(s)]
+                level += 1
+                yield {"type": "collapse", "level": level, "summaries": summaries}
+        prompt = self.combine_template.format(question=question, summaries=self._join(summaries))
+        yield {"type": "answer", "text": call_llm(self.llm, prompt)}
+
+    # -- public API --------------------------------------------------------
+
+    def stream(self, question, documents=None, ordered=True):
+        """Yield events: `{"type": "map", ...}` per document, any `"collapse"` levels, then `"answer"`."""
+        documents = self._documents(question, documents)
+        stopped = threading.Event()
+        summaries = {}
+        for index, text, confidence in self._map(question, documents, ordered, stopped):
+            relevant = not _is_empty(text)
+            if relevant:
+                summaries[index] = text
+            yield {"type": "map", "index": index, "text": text, "relevant": relevant,
+                   "confidence": confidence, "source": documents[index]}
+        if stopped.is_set():
+            yield {"type": "cancelled", "completed": len(summaries)}
+        # reduce in document order whatever order the map calls finished in
+        yield from self._reduce(question, [summaries[i] for i in sorted(summaries)])
+
+    def run(self, question, documents=None):
+        """Blocking call returning a `RetrievalQA`-style dict."""
+        documents = self._documents(question, documents)
+        steps, answer = [], None
+        for event in self.stream(question, documents):
+            if event["type"] == "map":
+                steps.append(event["text"])
+            elif event["type"] == "answer":
+                answer = event["text"]
+        return {"query": question, "result": answer,
+                "intermediate_steps": steps, "source_documents": documents}
+
+    def refine(self, question, documents=None):
+        """Serial refine chain; yields the answer after each document."""
+        answer = None
+        for document in self._documents(question, documents):
+            if answer is None:
+                prompt = REFINE_INITIAL_TEMPLATE.format(context=document.page_content, question=question)
+            else:
+                prompt = REFINE_TEMPLATE.format(question=question, existing_answer=answer,
+                                                context=document.page_content)
+            answer = call_llm(self.llm, prompt)
+            yield answer
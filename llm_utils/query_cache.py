@@ -0,0 +1,175 @@
+# Caching for the self-query retriever's query-construction step.
+#
+# `SelfQueryRetriever` asks an LLM to turn every question into a structured
+# query (search string + metadata filter) before it can search. With
+# `CachedSelfQueryRetriever` that step is answered, in order, by
+#
+#   1. an LRU cache of parsed `StructuredQuery`s keyed by the normalized question,
+#   2. an optional rule-based parser for common phrasings ("in the third lecture"),
+#   3. the LLM query constructor, whose answer is then cached.
+
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any
+
+try:
+    from langchain_core.structured_query import Comparator, Comparison, Operation, Operator, StructuredQuery
+except ImportError:
+    from langchain.chains.query_constructor.ir import (
+        Comparator, Comparison, Operation, Operator, StructuredQuery)
+
+from langchain.retrievers.self_query.base import SelfQueryRetriever
+
+
+_WS = re.compile(r"\s+")
+_SPACE_BEFORE_PUNCT = re.compile(r"\s+([?!.,])")
+_DANGLING_COMMA = re.compile(r"[,;]+(?=[?!.]|$)")
+
+
+def normalize_question(question):
+    return _WS.sub(" ", question).strip().lower().rstrip("?!. ")
+
+
+class QueryConstructionCache:
+    """Thread-safe LRU of normalized question -> `StructuredQuery`, with optional TTL."""
+
+    def __init__(self, maxsize=10_000, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, question):
+        key = normalize_question(question)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl is not None and time.time() - entry[1] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, question, structured_query):
+        key = normalize_question(question)
+        with self._lock:
+            self._entries[key] = (structured_query, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+_ORDINALS = {
+    "first": 1, "second": 2, "third": 3, "fourth": 4, "fifth": 5,
+    "sixth": 6, "seventh": 7, "eighth": 8, "ninth": 9, "tenth": 10,
+    "1st": 1, "2nd": 2, "3rd": 3, "4th": 4, "5th": 5,
+    "6th": 6, "7th": 7, "8th": 8, "9th": 9, "10th": 10,
+}
+
+
+class RuleBasedQueryParser:
+    """Regex rules that build metadata filters without an LLM call.
+
+    Each rule is `(pattern, build)`: `build(match)` returns a `Comparison`
+    (or None to ignore the match). Matched phrases are cut from the search
+    string. `parse` returns None when no rule matched, so the caller falls
+    back to the LLM.
+    """
+
+    def __init__(self, rules=()):
+        self.rules = [(re.compile(p, re.IGNORECASE) if isinstance(p, str) else p, build)
+                      for p, build in rules]
+
+    def parse(self, question):
+        comparisons, query = [], question
+        for pattern, build in self.rules:
+            for match in list(pattern.finditer(query)):
+                comparison = build(match)
+                if comparison is not None:
+                    comparisons.append(comparison)
+            query = pattern.sub(" ", query)
+        if not comparisons:
+            return None
+        query = _SPACE_BEFORE_PUNCT.sub(r"\1", _WS.sub(" ", query)).strip()
+        query = _DANGLING_COMMA.sub("", query)
+        if len(comparisons) == 1:
+            flt = comparisons[0]
+        else:
+            flt = Operation(operator=Operator.AND, arguments=comparisons)
+        return StructuredQuery(query=query, filter=flt, limit=None)
+
+
+def lecture_rules(source_template, page_attribute="page"):
+    """Rules for "in the third lecture" / "lecture 3" and "on page 5" style questions.
+
+    `source_template` is formatted with `n`, e.g.
+    "docs/cs229_lectures/MachineLearning-Lecture{n:02d}.pdf".
+    """
+    ordinal = "|".join(sorted(_ORDINALS, key=len, reverse=True))
+
+    def lecture(match):
+        token = (match.group("ord") or match.group("num")).lower()
+        n = _ORDINALS.get(token) or int(token)
+        return Comparison(comparator=Comparator.EQ, attribute="source",
+                          value=source_template.format(n=n))
+
+    def page(match):
+        return Comparison(comparator=Comparator.EQ, attribute=page_attribute,
+                          value=int(match.group("page")))
+
+    return [
+        (rf"\b(?:in |from )?(?:the )?(?:(?P<ord>{ordinal}) lecture|lecture (?P<num>\d+))\b", lecture),
+        (r"\b(?:on |in )?page (?P<page>\d+)\b", page),
+    ]
+
+
+class CachedSelfQueryRetriever(SelfQueryRetriever):
+    """`SelfQueryRetriever` that only calls the LLM for questions it cannot answer itself.
+
+    Build it with `CachedSelfQueryRetriever.from_llm(..., query_cache=...,
+    rule_parser=...)`; both are optional.
+    """
+
+    query_cache: Any = None
+    rule_parser: Any = None
+
+    def _construct_query(self, query, run_manager):
+        callbacks = run_manager.get_child() if run_manager is not None else None
+        constructor = getattr(self, "query_constructor", None)
+        if constructor is not None:
+            return constructor.invoke({"query": query}, config={"callbacks": callbacks})
+        # langchain < 0.1 keeps an LLMChain in `llm_chain`
+        inputs = self.llm_chain.prep_inputs({"query": query})
+        return self.llm_chain.predict_and_parse(callbacks=callbacks, **inputs)
+
+    def structured_query(self, query, run_manager=None):
+        cache = self.query_cache
+        structured = cache.get(query) if cache is not None else None
+        if structured is not None:
+            return structured
+        if self.rule_parser is not None:
+            structured = self.rule_parser.parse(query)
+        if structured is None:
+            structured = self._construct_query(query, run_manager)
+        if cache is not None:
+            cache.set(query, structured)
+        return structured
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        structured = self.structured_query(query, run_manager)
+        if self.verbose:
+            print(structured)
+        new_query, new_kwargs = self.structured_query_translator.visit_structured_query(structured)
+        if structured.limit is not None:
+            new_kwargs["k"] = structured.limit
+        if self.use_original_query:
+            new_query = query
+        search_kwargs = {**self.search_kwargs, **new_kwargs}
+        return self.vectorstore.search(new_query, self.search_type, **search_kwargs)
@@ -0,0 +1,150 @@
+# Shared result cache for Tavily web searches.
+#
+# The LangGraph agents and the essay writer send the same queries again
+# across turns, threads and essay revisions, and every one was a round-trip
+# to the search API. `SearchCache` keys results by the normalized query and
+# the search parameters:
+#
+#   * results are fresh for `ttl` seconds. For `stale_ttl` seconds after
+#     that, the stale result is returned at once and refreshed in the
+#     background (stale-while-revalidate);
+#   * concurrent identical queries are coalesced: one request goes out and
+#     the other callers wait for its result (single flight);
+#   * failures are not cached, and a failed background refresh keeps the
+#     stale entry.
+#
+# One cache (`default_cache`) is shared by every graph thread in the process.
+# `CachedTavilySearchAPIWrapper` plugs it into `TavilySearchResults`, and
+# `CachedSearchClient` wraps a `TavilyClient`. Cached results are shared, so
+# treat them as read-only.
+
+import asyncio
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any
+
+from langchain_community.utilities.tavily_search import TavilySearchAPIWrapper
+
+
+_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="search-refresh")
+_WS = re.compile(r"\s+")
+
+
+def normalize_query(query):
+    return _WS.sub(" ", query).strip().lower()
+
+
+def search_key(method, query, *args, **params):
+    """Cache key for `method(query, *args, **params)`."""
+    return json.dumps([method, normalize_query(query), list(args), sorted(params.items())],
+                      default=str)
+
+
+class SearchCache:
+    """Thread-safe LRU with TTL, stale-while-revalidate and single-flight fetches."""
+
+    def __init__(self, ttl=3600, stale_ttl=86400, maxsize=10_000):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._entries = OrderedDict()  # key -> (result, stored at)
+        self._inflight = {}            # key -> Future of the request in flight
+        self._lock = threading.Lock()
+
+    def _store(self, key, result):
+        with self._lock:
+            self._entries[key] = (result, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+            self._inflight.pop(key, None)
+
+    def _fetch(self, key, fetch, future):
+        try:
+            result = fetch()
+        except BaseException as e:
+            with self._lock:
+                self._inflight.pop(key, None)
+            future.set_exception(e)
+            return
+        self._store(key, result)
+        future.set_result(result)
+
+    def get_or_fetch(self, key, fetch):
+        """The cached result for `key`, calling `fetch()` at most once per key at a time."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                age = time.time() - entry[1]
+                if age <= self.ttl + self.stale_ttl:
+                    self._entries.move_to_end(key)
+                    if age <= self.ttl:
+                        self.hits += 1
+                    else:
+                        self.stale_hits += 1
+                        if key not in self._inflight:
+                            future = self._inflight[key] = Future()
+                            _pool.submit(self._fetch, key, fetch, future)
+                    return entry[0]
+                del self._entries[key]
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+        if owner:
+            self._fetch(key, fetch, future)
+        return future.result()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {"hits": self.hits, "stale_hits": self.stale_hits, "misses": self.misses,
+                "coalesced": self.coalesced, "entries": len(self._entries)}
+
+
+default_cache = SearchCache()
+
+
+class CachedTavilySearchAPIWrapper(TavilySearchAPIWrapper):
+    """`TavilySearchAPIWrapper` whose API requests go through a `SearchCache`.
+
+    `TavilySearchResults(max_results=2, api_wrapper=CachedTavilySearchAPIWrapper())`
+    """
+
+    cache: Any = None
+
+    def raw_results(self, query, *args, **kwargs):
+        cache = self.cache if self.cache is not None else default_cache
+        fetch = lambda: super(CachedTavilySearchAPIWrapper, self).raw_results(query, *args, **kwargs)
+        return cache.get_or_fetch(search_key("raw_results", query, *args, **kwargs), fetch)
+
+    async def raw_results_async(self, query, *args, **kwargs):
+        return await asyncio.to_thread(self.raw_results, query, *args, **kwargs)
+
+
+class CachedSearchClient:
+    """Wraps a search client (e.g. `TavilyClient`) so `search(...)` is cached."""
+
+    def __init__(self, client, cache=None):
+        self.client = client
+        self.cache = cache if cache is not None else default_cache
+
+    def search(self, query, *args, **kwargs):
+        fetch = lambda: self.client.search(query, *args, **kwargs)
+        return self.cache.get_or_fetch(search_key("search", query, *args, **kwargs), fetch)
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
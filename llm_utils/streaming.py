@@ -0,0 +1,232 @@
+# Token streaming for the panel chat UIs.
+#
+# The chatbots used to block until the whole completion came back and then
+# render it, so a long answer showed nothing for several seconds. Here the
+# answer is produced on a worker thread and pushed into a Markdown pane as
+# it arrives:
+#
+#   * `StreamRunner.start(fn, ...)` runs `fn(stream)` on a thread. `fn`
+#     either feeds an iterator of text deltas into `stream.consume(...)`
+#     (see `completion.stream_completion_from_messages`) or runs a LangChain
+#     chain whose LLM has a `StreamingCallbackHandler`, which forwards tokens
+#     to the stream running on the current thread;
+#   * pane updates are throttled to one every `min_interval` seconds, and
+#     `markdown_preview` closes an unfinished code fence so partial answers
+#     render properly;
+#   * starting a new answer cancels the previous one: its next token (or
+#     LLM call) raises `Cancelled`, which closes the model stream;
+#   * every answer records its time to first token; `StreamRunner.summary()`
+#     aggregates the recent ones.
+
+import contextvars
+import threading
+import time
+from collections import deque
+
+try:
+    from langchain_core.callbacks import BaseCallbackHandler
+except ImportError:
+    from langchain.callbacks.base import BaseCallbackHandler
+
+
+_current = contextvars.ContextVar("llm_utils_stream", default=None)
+
+
+class Cancelled(Exception):
+    """Raised inside a stream's producer once the stream was cancelled."""
+
+
+def markdown_preview(text, cursor=" ▌"):
+    """`text` made safe to render mid-stream: unbalanced code fences are closed."""
+    if text.count("```") % 2:
+        return text + cursor + "\n```"
+    return text + cursor
+
+
+def markdown_updater(pane, cursor=" ▌"):
+    """`on_update` callback that renders a stream into a panel Markdown pane."""
+    def update(text, done):
+        pane.object = text if done else markdown_preview(text, cursor)
+    return update
+
+
+class TokenStream:
+    """The answer being streamed: text so far, timings and cancellation."""
+
+    def __init__(self, on_update=None, min_interval=0.05, on_cancel=None):
+        self.on_update = on_update
+        self.on_cancel = on_cancel
+        self.min_interval = min_interval
+        self.state = "running"
+        self.started = time.perf_counter()
+        self.first_token = None
+        self.finished = None
+        self.tokens = 0
+        self._parts = []
+        self._last_update = 0.0
+        self._lock = threading.RLock()
+
+    @property
+    def text(self):
+        return "".join(self._parts)
+
+    @property
+    def cancelled(self):
+        return self.state == "cancelled"
+
+    @property
+    def ttft(self):
+        """Seconds from the start of the request to the first token, or None."""
+        if self.first_token is None:
+            return None
+        return self.first_token - self.started
+
+    def check(self):
+        if self.state == "cancelled":
+            raise Cancelled()
+
+    def push(self, token):
+        with self._lock:
+            self.check()
+            if not token:
+                return
+            now = time.perf_counter()
+            if self.first_token is None:
+                self.first_token = now
+            self._parts.append(token)
+            self.tokens += 1
+            if self.on_update is not None and now - self._last_update >= self.min_interval:
+                self._last_update = now
+                self.on_update(self.text, False)
+
+    def consume(self, deltas):
+        """Push every delta of `deltas`; closes the iterator if the stream is cancelled."""
+        try:
+            for delta in deltas:
+                self.push(delta)
+        except Cancelled:
+            close = getattr(deltas, "close", None)
+            if close is not None:
+                close()
+            raise
+        return self.text
+
+    def _settle(self, state):
+        with self._lock:
+            if self.state != "running":
+                return False
+            self.state = state
+            self.finished = time.perf_counter()
+            if self.on_update is not None:
+                self.on_update(self.text, True)
+            return True
+
+    def finish(self):
+        return self._settle("done")
+
+    def fail(self):
+        return self._settle("error")
+
+    def cancel(self):
+        """Stop the stream; `on_cancel(partial_text)` runs in the calling thread."""
+        if self._settle("cancelled") and self.on_cancel is not None:
+            self.on_cancel(self.text)
+
+    def stats(self):
+        end = self.finished if self.finished is not None else time.perf_counter()
+        return {"status": self.state, "ttft": self.ttft, "duration": end - self.started,
+                "tokens": self.tokens}
+
+
+class StreamingCallbackHandler(BaseCallbackHandler):
+    """Forwards LLM tokens to the `TokenStream` running on the current thread.
+
+    Attach it to the LLM that writes the answer (`ChatOpenAI(streaming=True,
+    callbacks=[StreamingCallbackHandler()])`), not to helper calls such as
+    question condensing. Outside a `StreamRunner` it does nothing.
+    """
+
+    raise_error = True  # let `Cancelled` abort the LLM call
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        stream = _current.get()
+        if stream is not None:
+            stream.check()
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        stream = _current.get()
+        if stream is not None:
+            stream.check()
+
+    def on_llm_new_token(self, token, **kwargs):
+        stream = _current.get()
+        if stream is not None:
+            stream.push(token)
+
+
+class StreamRunner:
+    """Runs one streamed answer at a time; starting a new one cancels the previous."""
+
+    def __init__(self, min_interval=0.05, history=200):
+        self.min_interval = min_interval
+        self.stats = deque(maxlen=history)
+        self._stream = None
+        self._lock = threading.Lock()
+
+    def cancel(self):
+        """Cancel the answer in flight, if any."""
+        with self._lock:
+            stream, self._stream = self._stream, None
+        if stream is not None:
+            stream.cancel()
+
+    def start(self, fn, on_update=None, on_done=None, on_cancel=None, on_error=None):
+        """Run `fn(stream)` on a worker thread and return the `TokenStream`.
+
+        `on_done(result)` gets `fn`'s return value; `on_cancel(partial_text)`
+        runs when a later `start` or `cancel` stops this one; exactly one of
+        the two runs. Without `on_error`, errors are rendered through
+        `on_update`.
+        """
+        self.cancel()
+        stream = TokenStream(on_update, self.min_interval, on_cancel)
+        with self._lock:
+            self._stream = stream
+
+        def run():
+            _current.set(stream)
+            try:
+                result = fn(stream)
+            except Cancelled:
+                pass
+            except Exception as e:
+                # callbacks run under the stream's lock, so a concurrent
+                # cancel() cannot settle it (and run on_cancel) in between
+                with stream._lock:
+                    if stream.fail():
+                        if on_error is not None:
+                            on_error(e)
+                        elif on_update is not None:
+                            on_update(f"{stream.text}\n\n**Error:** {e}".lstrip(), True)
+            else:
+                with stream._lock:
+                    if stream.finish() and on_done is not None:
+                        on_done(result)
+            finally:
+                self.stats.append(stream.stats())
+                with self._lock:
+                    if self._stream is stream:
+                        self._stream = None
+
+        threading.Thread(target=run, daemon=True, name="stream").start()
+        return stream
+
+    def summary(self):
+        """Counts and time-to-first-token percentiles (seconds) of the recent answers."""
+        stats = list(self.stats)
+        ttfts = sorted(s["ttft"] for s in stats if s["ttft"] is not None)
+        pick = lambda q: ttfts[min(len(ttfts) - 1, int(q * len(ttfts)))] if ttfts else None
+        return {"answers": len(stats),
+                "cancelled": sum(s["status"] == "cancelled" for s in stats),
+                "errors": sum(s["status"] == "error" for s in stats),
+                "ttft_p50": pick(0.50), "ttft_p95": pick(0.95)}
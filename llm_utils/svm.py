@@ -0,0 +1,138 @@
+# SVM re-ranking on an ANN shortlist.
+#
+# LangChain's `SVMRetriever` trains a linear SVM on the query (positive) vs.
+# every chunk in the corpus (negatives) for each question: O(N) training per
+# request. `ShortlistSVMRetriever` trains the same exemplar SVM (squared hinge,
+# balanced class weights, C=0.1, like `LinearSVC` there) on the query plus its
+# `shortlist` nearest neighbours from a `NumpyVectorStore` / `AnnVectorStore`,
+# so the cost per query is bounded by the shortlist size, not the corpus.
+#
+# The problem is solved in the primal with L-BFGS, started from the previous
+# solution for the same question when there is one (repeat questions, or the
+# same question after new chunks were added) and otherwise from the query
+# direction itself, which is already close to the optimum. Several questions
+# are fitted in parallel on a thread pool.
+
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Optional
+
+import numpy as np
+from scipy.optimize import minimize
+
+from llm_utils.vectorstore import normalize_rows
+
+try:
+    from langchain_core.retrievers import BaseRetriever
+except ImportError:
+    from langchain.schema import BaseRetriever
+
+
+_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="svm")
+
+
+def fit_exemplar_svm(query, negatives, C=0.1, x0=None, tol=1e-6, max_iter=1000):
+    """Linear SVM separating `query` from `negatives`; returns `(w, b)`.
+
+    Same objective as `LinearSVC(class_weight="balanced", C=C)`: squared hinge
+    loss, L2 penalty, intercept regularized like a constant feature.
+    """
+    x = np.vstack([query[None, :], negatives]).astype(np.float64)
+    x = np.hstack([x, np.ones((len(x), 1))])          # intercept as a feature
+    y = -np.ones(len(x))
+    y[0] = 1.0
+    weight = np.full(len(x), len(x) / (2.0 * (len(x) - 1)))
+    weight[0] = len(x) / 2.0
+    cy = 2.0 * C * weight * y
+
+    def objective(wb):
+        margin = np.maximum(0.0, 1.0 - y * (x @ wb))
+        loss = 0.5 * wb @ wb + C * (weight * margin ** 2).sum()
+        return loss, wb - (cy * margin) @ x
+
+    if x0 is None:
+        x0 = np.append(query, 0.0)
+    result = minimize(objective, x0, jac=True, method="L-BFGS-B",
+                      options={"gtol": tol, "maxiter": max_iter})
+    return result.x[:-1], result.x[-1]
+
+
+class SolutionCache:
+    """Thread-safe LRU of question -> last SVM solution, used as the warm start."""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, question):
+        with self._lock:
+            solution = self._entries.get(question)
+            if solution is not None:
+                self._entries.move_to_end(question)
+            return solution
+
+    def set(self, question, solution):
+        with self._lock:
+            self._entries[question] = solution
+            self._entries.move_to_end(question)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+class ShortlistSVMRetriever(BaseRetriever):
+    """`SVMRetriever` semantics with per-query cost bounded by `shortlist`.
+
+    `vectorstore` must offer `search_vectors` (a `NumpyVectorStore` or
+    `AnnVectorStore`); its embeddings embed the questions.
+    """
+
+    vectorstore: Any
+    k: int = 4
+    shortlist: int = 200
+    C: float = 0.1
+    relevancy_threshold: Optional[float] = None
+    warm_starts: Any = None
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        if self.warm_starts is None:
+            self.warm_starts = SolutionCache()
+
+    def _rank(self, query, vector, rows):
+        if not len(rows):
+            # empty shortlist: no negatives to fit against, nothing to rank
+            return []
+        negatives = self.vectorstore.matrix[rows]
+        w, b = fit_exemplar_svm(vector, negatives, C=self.C, x0=self.warm_starts.get(query))
+        self.warm_starts.set(query, np.append(w, b))
+        scores = negatives @ w + b
+        order = np.argsort(-scores, kind="stable")[:self.k]
+        if self.relevancy_threshold is not None:
+            # same min-max normalization as SVMRetriever, over query + shortlist
+            everything = np.append(scores, vector @ w + b)
+            low, high = everything.min(), everything.max()
+            normalized = (scores - low) / (high - low + 1e-6)
+            order = [i for i in order if normalized[i] >= self.relevancy_threshold]
+        return [self.vectorstore._document(rows[i]) for i in order]
+
+    def get_relevant_documents_batch(self, queries):
+        """Retrieve for several questions: one embedding call, SVM fits on the thread pool."""
+        queries = list(queries)
+        vectors = normalize_rows(self.vectorstore.embeddings.embed_documents(queries))
+        rows, _ = self.vectorstore.search_vectors(vectors, k=self.shortlist)
+        return list(_pool.map(self._rank, queries, vectors, rows))
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        vector = normalize_rows(self.vectorstore.embeddings.embed_query(query))
+        rows, _ = self.vectorstore.search_vectors(vector, k=self.shortlist)
+        return self._rank(query, vector[0], rows[0])
+
+    async def _aget_relevant_documents(self, query, *, run_manager=None):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_pool, self._get_relevant_documents, query)
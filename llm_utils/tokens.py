@@ -0,0 +1,40 @@
+# Cached token counting.
+#
+# Loading a tiktoken encoding is slow and the same chunks are counted again
+# and again (every retrieval that returns them). Encodings are loaded once per
+# model and counts are memoized per (text, model). Without tiktoken the
+# counts fall back to the usual ~4 characters per token estimate.
+
+from functools import lru_cache
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model="gpt-3.5-turbo"):
+    """The tiktoken encoding for `model`, or None when tiktoken is not installed."""
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+@lru_cache(maxsize=65536)
+def count_tokens(text, model="gpt-3.5-turbo"):
+    encoding = get_encoding(model)
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text, max_tokens, model="gpt-3.5-turbo"):
+    """The longest prefix of `text` with at most `max_tokens` tokens."""
+    if max_tokens <= 0:
+        return ""
+    encoding = get_encoding(model)
+    if encoding is None:
+        return text[:max_tokens * 4]
+    tokens = encoding.encode(text, disallowed_special=())
+    return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
@@ -0,0 +1,136 @@
+# Concurrent execution of an LLM turn's tool calls.
+#
+# The LangGraph agents' `take_action` invoked the tool calls of a turn one
+# after another, although the research prompt asks the model to make several
+# calls "together": three Tavily searches cost the sum of their latencies.
+# `ToolCallExecutor.run(tool_calls)` submits every call of the turn to a
+# thread pool shared by every agent in the process and returns one
+# `ToolMessage` per call, in the original order, so the turn costs about
+# the slowest call:
+#
+#   * `limits` caps how many calls of a tool run at once across the
+#     whole agent (e.g. an API's rate limit); other calls queue;
+#   * `timeouts` bounds each call, counted from submission. A call that
+#     fails, times out or names an unknown tool becomes a ToolMessage asking
+#     the model to retry, so one bad call doesn't lose the others' results.
+#     A timed-out call cannot be stopped and keeps its worker until it
+#     returns. While `MAX_WORKERS // 2` or more timed-out calls are still
+#     running, new calls go to a second, overflow pool of the same size, so
+#     a few hung tools cannot starve every other agent. The two pools cap
+#     the threads at 2 x `MAX_WORKERS`; past that, calls queue;
+#   * `arun` is the same for async graphs (`astream_events`).
+
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from langchain_core.messages import ToolMessage
+
+
+MAX_WORKERS = 16
+
+_pool = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="tool")
+_overflow = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="tool-overflow")
+_hung = 0  # timed-out calls still holding a worker
+_hung_lock = threading.Lock()
+
+
+def _timed_out(future):
+    """Cancel a timed-out call, or count it as hung until it returns."""
+    global _hung
+    if future.cancel() or future.done():
+        return
+    with _hung_lock:
+        _hung += 1
+
+    def released(_):
+        global _hung
+        with _hung_lock:
+            _hung -= 1
+
+    future.add_done_callback(released)
+
+
+class ToolCallExecutor:
+    """Runs tool calls concurrently with per-tool concurrency limits and timeouts."""
+
+    def __init__(self, tools, limits=None, timeouts=None, default_limit=4,
+                 default_timeout=60.0):
+        self.tools = tools if isinstance(tools, dict) else {t.name: t for t in tools}
+        self.timeouts = dict(timeouts or {})
+        self.default_timeout = default_timeout
+        limits = dict(limits or {})
+        self._limits = {name: threading.BoundedSemaphore(limits.get(name, default_limit))
+                        for name in self.tools
+                        if limits.get(name, default_limit) is not None}
+        self.last_duration = None  # seconds the last turn's calls took together
+
+    def _invoke(self, call):
+        semaphore = self._limits.get(call["name"])
+        if semaphore is None:
+            return self.tools[call["name"]].invoke(call["args"])
+        with semaphore:
+            return self.tools[call["name"]].invoke(call["args"])
+
+    def _submit(self, call):
+        if call["name"] not in self.tools:
+            return None
+        pool = _overflow if _hung >= MAX_WORKERS // 2 else _pool
+        return pool.submit(self._invoke, call)
+
+    def _timeout(self, call):
+        return self.timeouts.get(call["name"], self.default_timeout)
+
+    @staticmethod
+    def _content(call, future, error):
+        if future is None:
+            return "bad tool name, retry"  # instruct LLM to retry if bad
+        if isinstance(error, (FutureTimeout, asyncio.TimeoutError)):
+            return f"{call['name']} timed out, retry or continue without it"
+        if error is not None:
+            return f"{call['name']} failed: {error!r}, retry"
+        return None
+
+    @staticmethod
+    def _message(call, content):
+        return ToolMessage(tool_call_id=call["id"], name=call["name"], content=str(content))
+
+    def run(self, tool_calls):
+        """Run `tool_calls` concurrently; one `ToolMessage` per call, in order."""
+        start = time.perf_counter()
+        futures = [self._submit(call) for call in tool_calls]
+        messages = []
+        for call, future in zip(tool_calls, futures):
+            result, error = None, None
+            if future is not None:
+                remaining = start + self._timeout(call) - time.perf_counter()
+                try:
+                    result = future.result(timeout=max(0.0, remaining))
+                except Exception as e:
+                    _timed_out(future)
+                    error = e
+            content = self._content(call, future, error)
+            messages.append(self._message(call, result if content is None else content))
+        self.last_duration = time.perf_counter() - start
+        return messages
+
+    async def arun(self, tool_calls):
+        """`run` for async graphs; waits without blocking the event loop."""
+        start = time.perf_counter()
+        futures = [self._submit(call) for call in tool_calls]
+
+        async def wait(call, future):
+            if future is None:
+                return self._message(call, self._content(call, None, None))
+            try:
+                result = await asyncio.wait_for(asyncio.wrap_future(future), self._timeout(call))
+            except Exception as e:
+                _timed_out(future)
+                return self._message(call, self._content(call, future, e))
+            return self._message(call, result)
+
+        messages = await asyncio.gather(*(wait(c, f) for c, f in zip(tool_calls, futures)))
+        self.last_duration = time.perf_counter() - start
+        return list(messages)
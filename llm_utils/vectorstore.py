@@ -0,0 +1,276 @@
+# In-memory vector store backed by one contiguous NumPy matrix.
+#
+# A drop-in replacement for `DocArrayInMemorySearch` in the QnA and chat
+# notebooks. Vectors are L2-normalized once on insert and kept in a
+# pre-allocated float32 matrix, so cosine similarity for a query is a single
+# matrix-vector product followed by `argpartition` for the top k. Several
+# queries can be searched with one matrix-matrix product. Metadata filters
+# (Chroma syntax) are resolved by a `MetadataIndex` into candidate rows
+# before scoring; narrow filters score only those rows, broad ones score
+# everything and mask the rest out.
+
+import json
+import os
+import uuid
+
+import numpy as np
+
+from llm_utils.metadata_index import MetadataIndex
+from llm_utils.mmr import mmr_select
+
+try:
+    from langchain_core.documents import Document
+    from langchain_core.vectorstores import VectorStore
+except ImportError:
+    from langchain.schema import Document
+    from langchain.vectorstores.base import VectorStore
+
+
+def normalize_rows(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors[None, :]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def top_k(scores, k):
+    """Indices of the `k` largest scores along the last axis, best first."""
+    k = min(k, scores.shape[-1])
+    if k <= 0:
+        return np.empty(scores.shape[:-1] + (0,), dtype=np.int64)
+    if k < scores.shape[-1]:
+        part = np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+    else:
+        part = np.broadcast_to(np.arange(scores.shape[-1]), scores.shape).copy()
+    order = np.argsort(-np.take_along_axis(scores, part, axis=-1), axis=-1, kind="stable")
+    return np.take_along_axis(part, order, axis=-1)
+
+
+class NumpyVectorStore(VectorStore):
+    """Exact cosine-similarity search over a pre-normalized float32 matrix."""
+
+    # filters matching at most this fraction of rows are searched by scoring
+    # only the matching rows (pre-filtering); broader ones are post-filtered
+    prefilter_threshold = 0.25
+
+    def __init__(self, embedding, dim=None, capacity=1024):
+        self.embedding = embedding
+        self._matrix = None if dim is None else np.empty((capacity, dim), dtype=np.float32)
+        self._size = 0
+        self.ids = []
+        self.texts = []
+        self.metadatas = []
+        self._id_to_row = {}
+        self.metadata_index = MetadataIndex()
+
+    @property
+    def embeddings(self):
+        return self.embedding
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def matrix(self):
+        """The live (size, dim) block of normalized vectors."""
+        if self._matrix is None:
+            return np.empty((0, 0), dtype=np.float32)
+        return self._matrix[:self._size]
+
+    # -- writing -----------------------------------------------------------
+
+    def _reserve(self, extra, dim):
+        if self._matrix is None:
+            self._matrix = np.empty((max(1024, extra), dim), dtype=np.float32)
+            return
+        if self._matrix.shape[1] != dim:
+            raise ValueError(f"expected {self._matrix.shape[1]}-dimensional vectors, got {dim}")
+        needed = self._size + extra
+        if needed > self._matrix.shape[0] or not self._matrix.flags.writeable:
+            grown = np.empty((max(needed, 2 * self._matrix.shape[0]), dim), dtype=np.float32)
+            grown[:self._size] = self._matrix[:self._size]
+            self._matrix = grown
+
+    def add_vectors(self, vectors, texts, metadatas=None, ids=None):
+        vectors = normalize_rows(vectors)
+        texts = list(texts)
+        metadatas = list(metadatas) if metadatas is not None else [{} for _ in texts]
+        ids = list(ids) if ids is not None else [str(uuid.uuid4()) for _ in texts]
+        if not texts:
+            return []
+        self._reserve(len(texts), vectors.shape[1])
+        start = self._size
+        self._matrix[start:start + len(texts)] = vectors
+        self._size += len(texts)
+        for offset, id_ in enumerate(ids):
+            self._id_to_row[id_] = start + offset
+        self.ids.extend(ids)
+        self.texts.extend(texts)
+        self.metadatas.extend(dict(m or {}) for m in metadatas)
+        self.metadata_index.add(self.metadatas[start:])
+        return ids
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        texts = list(texts)
+        vectors = self.embedding.embed_documents(texts)
+        return self.add_vectors(vectors, texts, metadatas, ids)
+
+    def delete(self, ids=None, **kwargs):
+        if not ids:
+            return False
+        doomed = {self._id_to_row[i] for i in ids if i in self._id_to_row}
+        if not doomed:
+            return False
+        self._drop_rows(doomed)
+        return True
+
+    def _drop_rows(self, doomed):
+        # compact the matrix and records; rows after a dropped one move up
+        keep = np.array([r for r in range(self._size) if r not in doomed], dtype=np.int64)
+        if self._matrix.flags.writeable:
+            self._matrix[:len(keep)] = self._matrix[keep]
+        else:
+            self._matrix = np.array(self._matrix[keep])
+        self._size = len(keep)
+        self.ids = [self.ids[r] for r in keep]
+        self.texts = [self.texts[r] for r in keep]
+        self.metadatas = [self.metadatas[r] for r in keep]
+        self._id_to_row = {id_: r for r, id_ in enumerate(self.ids)}
+        self.metadata_index = MetadataIndex(self.metadatas)
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, **kwargs):
+        store = cls(embedding, **kwargs)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
+
+    @classmethod
+    def from_chroma(cls, vectordb, **kwargs):
+        """Copy the vectors, texts and metadata of a LangChain `Chroma` store (no re-embedding)."""
+        data = vectordb.get(include=["embeddings", "documents", "metadatas"])
+        store = cls(vectordb.embeddings, **kwargs)
+        if data["ids"]:
+            store.add_vectors(data["embeddings"], data["documents"], data["metadatas"], data["ids"])
+        return store
+
+    # -- persistence -------------------------------------------------------
+
+    def save(self, directory):
+        """Write `vectors.npy` and `records.jsonl` (ids, texts, metadata) to `directory`."""
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, "vectors.npy"), self.matrix)
+        tmp = os.path.join(directory, "records.jsonl.tmp")
+        with open(tmp, "w") as f:
+            for id_, text, metadata in zip(self.ids, self.texts, self.metadatas):
+                f.write(json.dumps({"id": id_, "text": text, "metadata": metadata}) + "\n")
+        os.replace(tmp, os.path.join(directory, "records.jsonl"))
+
+    @classmethod
+    def load(cls, directory, embedding, mmap=True, **kwargs):
+        """Reopen a saved store; with `mmap` the vectors are paged in from disk lazily."""
+        store = cls(embedding, **kwargs)
+        matrix = np.load(os.path.join(directory, "vectors.npy"), mmap_mode="r" if mmap else None)
+        with open(os.path.join(directory, "records.jsonl")) as f:
+            for line in f:
+                record = json.loads(line)
+                store.ids.append(record["id"])
+                store.texts.append(record["text"])
+                store.metadatas.append(record["metadata"])
+        store._matrix = matrix if len(store.ids) else None
+        store._size = len(store.ids)
+        store._id_to_row = {id_: r for r, id_ in enumerate(store.ids)}
+        store.metadata_index = MetadataIndex(store.metadatas)
+        return store
+
+    # -- filtering ---------------------------------------------------------
+
+    def filter_rows(self, filter):
+        """Sorted ids of the rows matching `filter` (Chroma syntax, or a callable on metadata)."""
+        if callable(filter):
+            return np.flatnonzero(np.fromiter((bool(filter(m)) for m in self.metadatas),
+                                              dtype=bool, count=self._size))
+        return self.metadata_index.select(filter)
+
+    def filter_mask(self, filter):
+        if filter is None:
+            return None
+        mask = np.zeros(self._size, dtype=bool)
+        mask[self.filter_rows(filter)] = True
+        return mask
+
+    # -- searching ---------------------------------------------------------
+
+    def _document(self, row):
+        return Document(page_content=self.texts[row], metadata=dict(self.metadatas[row]))
+
+    def _search_all(self, queries, k):
+        scores = queries @ self.matrix.T
+        rows = top_k(scores, k)
+        return rows, np.take_along_axis(scores, rows, axis=1)
+
+    def _search_rows(self, queries, k, rows):
+        # pre-filtering: only the candidate rows are scored
+        scores = queries @ self._matrix[rows].T
+        local = top_k(scores, k)
+        return rows[local], np.take_along_axis(scores, local, axis=1)
+
+    def _search_post_filtered(self, queries, k, rows):
+        # post-filtering: one full matrix product, non-matching rows masked out
+        scores = queries @ self.matrix.T
+        blocked = np.ones(self._size, dtype=bool)
+        blocked[rows] = False
+        scores[:, blocked] = -np.inf
+        found = top_k(scores, min(k, len(rows)))
+        return found, np.take_along_axis(scores, found, axis=1)
+
+    def search_vectors(self, queries, k=4, filter=None):
+        """Batched search: `(rows, scores)` arrays of shape (n_queries, <=k)."""
+        queries = normalize_rows(queries)
+        if self._size == 0:
+            empty = np.empty((len(queries), 0))
+            return empty.astype(np.int64), empty.astype(np.float32)
+        if filter is None:
+            return self._search_all(queries, k)
+        rows = self.filter_rows(filter)
+        if len(rows) <= self.prefilter_threshold * self._size:
+            return self._search_rows(queries, k, rows)
+        return self._search_post_filtered(queries, k, rows)
+
+    def similarity_search_by_vector_with_score(self, embedding, k=4, filter=None, **kwargs):
+        rows, scores = self.search_vectors([embedding], k=k, filter=filter)
+        return [(self._document(r), float(s)) for r, s in zip(rows[0], scores[0])]
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None, **kwargs):
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k, filter)]
+
+    def similarity_search_with_score(self, query, k=4, filter=None, **kwargs):
+        return self.similarity_search_by_vector_with_score(
+            self.embedding.embed_query(query), k=k, filter=filter)
+
+    def similarity_search(self, query, k=4, filter=None, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter)]
+
+    def similarity_search_batch(self, queries, k=4, filter=None):
+        """Search several query strings with one matrix product."""
+        vectors = self.embedding.embed_documents(list(queries))
+        rows, _ = self.search_vectors(vectors, k=k, filter=filter)
+        return [[self._document(r) for r in query_rows] for query_rows in rows]
+
+    def _select_relevance_score_fn(self):
+        # cosine similarity in [-1, 1] -> relevance in [0, 1]
+        return lambda score: (score + 1.0) / 2.0
+
+    def max_marginal_relevance_search_by_vector(self, embedding, k=4, fetch_k=20,
+                                                lambda_mult=0.5, filter=None, **kwargs):
+        rows, _ = self.search_vectors([embedding], k=fetch_k, filter=filter)
+        rows = rows[0]
+        picked = mmr_select(embedding, self.matrix[rows], k=k, lambda_mult=lambda_mult)
+        return [self._document(rows[i]) for i in picked]
+
+    def max_marginal_relevance_search(self, query, k=4, fetch_k=20, lambda_mult=0.5,
+                                      filter=None, **kwargs):
+        return self.max_marginal_relevance_search_by_vector(
+            self.embedding.embed_query(query), k=k, fetch_k=fetch_k,
+            lambda_mult=lambda_mult, filter=filter)